@@ -0,0 +1,36 @@
+"""Add business co-enrollment index
+
+Revision ID: 5f0c9a1e7b21
+Revises: 28a39c6a838b
+Create Date: 2026-10-18 09:12:41.318254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0c9a1e7b21'
+down_revision = '28a39c6a838b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('business_co_enrollment',
+    sa.Column('business_id', sa.UUID(), nullable=False),
+    sa.Column('other_business_id', sa.UUID(), nullable=False),
+    sa.Column('shared_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('business_id', 'other_business_id')
+    )
+    op.execute("""
+        INSERT INTO business_co_enrollment (business_id, other_business_id, shared_count)
+        SELECT e1.business_id, e2.business_id, count(*)
+        FROM (SELECT DISTINCT user_id, business_id FROM enrollment) e1
+        JOIN (SELECT DISTINCT user_id, business_id FROM enrollment) e2 ON e1.user_id = e2.user_id
+        GROUP BY e1.business_id, e2.business_id
+    """)
+
+
+def downgrade():
+    op.drop_table('business_co_enrollment')
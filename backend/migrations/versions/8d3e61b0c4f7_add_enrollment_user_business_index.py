@@ -0,0 +1,24 @@
+"""Add enrollment (user_id, business_id) index
+
+Revision ID: 8d3e61b0c4f7
+Revises: 5f0c9a1e7b21
+Create Date: 2026-10-18 11:40:03.582610
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3e61b0c4f7'
+down_revision = '5f0c9a1e7b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_enrollment_user_id_business_id', 'enrollment', ['user_id', 'business_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_enrollment_user_id_business_id', table_name='enrollment')
@@ -0,0 +1,26 @@
+"""Add active reward indexes
+
+Revision ID: a7c2e4f9b350
+Revises: f3a9d6b2c418
+Create Date: 2026-10-18 22:58:41.270395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e4f9b350'
+down_revision = 'f3a9d6b2c418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reward_business_id_open_ended', 'reward', ['business_id'], unique=False, postgresql_where=sa.text('valid_until_timestamp IS NULL'))
+    op.create_index('ix_reward_business_id_valid_until', 'reward', ['business_id', 'valid_until_timestamp'], unique=False, postgresql_where=sa.text('valid_until_timestamp IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_reward_business_id_valid_until', table_name='reward', postgresql_where=sa.text('valid_until_timestamp IS NOT NULL'))
+    op.drop_index('ix_reward_business_id_open_ended', table_name='reward', postgresql_where=sa.text('valid_until_timestamp IS NULL'))
@@ -0,0 +1,24 @@
+"""Add response cache version sequence
+
+Revision ID: b4a7d2e9c135
+Revises: 8d3e61b0c4f7
+Create Date: 2026-10-18 14:05:27.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4a7d2e9c135'
+down_revision = '8d3e61b0c4f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('response_cache_version')))
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(sa.Sequence('response_cache_version')))
@@ -0,0 +1,59 @@
+"""Add points ledger
+
+Revision ID: b8d4f1a6c273
+Revises: a7c2e4f9b350
+Create Date: 2026-10-18 23:41:07.518224
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4f1a6c273'
+down_revision = 'a7c2e4f9b350'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('points_transaction',
+    sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False),
+    sa.Column('enrollment_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('reward_id', postgresql.UUID(as_uuid=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('xid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+    sa.ForeignKeyConstraint(['enrollment_id'], ['enrollment.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['reward_id'], ['reward.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_points_transaction_enrollment_id_xid', 'points_transaction', ['enrollment_id', 'xid'], unique=False)
+    op.create_index('ix_points_transaction_xid', 'points_transaction', ['xid'], unique=False)
+    # Existing balances become the first snapshots
+    op.execute('UPDATE enrollment SET points = 0 WHERE points IS NULL')
+    op.alter_column('enrollment', 'points', new_column_name='points_snapshot', nullable=False)
+    op.add_column('enrollment', sa.Column('points_snapshot_xid', sa.BigInteger(), server_default='0', nullable=False))
+    op.alter_column('enrollment', 'points_snapshot_xid', server_default=None)
+
+
+def downgrade():
+    # Fold the ledger back into the balances before dropping it
+    op.execute("""
+        UPDATE enrollment
+        SET points_snapshot = points_snapshot + pending.amount
+        FROM (
+            SELECT t.enrollment_id, sum(t.amount) AS amount
+            FROM points_transaction t
+            JOIN enrollment e ON e.id = t.enrollment_id
+            WHERE t.xid >= e.points_snapshot_xid
+            GROUP BY t.enrollment_id
+        ) pending
+        WHERE enrollment.id = pending.enrollment_id
+    """)
+    op.drop_column('enrollment', 'points_snapshot_xid')
+    op.alter_column('enrollment', 'points_snapshot', new_column_name='points', nullable=True)
+    op.drop_index('ix_points_transaction_xid', table_name='points_transaction')
+    op.drop_index('ix_points_transaction_enrollment_id_xid', table_name='points_transaction')
+    op.drop_table('points_transaction')
@@ -0,0 +1,41 @@
+"""Add reward usage slots
+
+Revision ID: c3e7a9d5f184
+Revises: b8d4f1a6c273
+Create Date: 2026-10-19 00:36:52.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e7a9d5f184'
+down_revision = 'b8d4f1a6c273'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reward_usage_slot',
+    sa.Column('reward_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['reward_id'], ['reward.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('reward_id', 'slot')
+    )
+    # Existing counts become the base the slots are added to
+    op.execute('UPDATE reward SET usage_count = 0 WHERE usage_count IS NULL')
+    op.alter_column('reward', 'usage_count', new_column_name='usage_count_base', nullable=False)
+
+
+def downgrade():
+    op.execute("""
+        UPDATE reward
+        SET usage_count_base = usage_count_base + slots.count
+        FROM (SELECT reward_id, sum(count) AS count FROM reward_usage_slot GROUP BY reward_id) slots
+        WHERE reward.id = slots.reward_id
+    """)
+    op.alter_column('reward', 'usage_count_base', new_column_name='usage_count', nullable=True)
+    op.drop_table('reward_usage_slot')
@@ -0,0 +1,44 @@
+"""Key blacklisted tokens by jti and store their expiry
+
+Revision ID: c9e3f1a6d2b8
+Revises: b4a7d2e9c135
+Create Date: 2026-10-18 16:22:41.905127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e3f1a6d2b8'
+down_revision = 'b4a7d2e9c135'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blacklisted_tokens', sa.Column('jti', sa.String(), nullable=True))
+    op.add_column('blacklisted_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    # Tokens issued before the jti claim are keyed by their SHA-256 and lived for one hour
+    op.execute(
+        "UPDATE blacklisted_tokens "
+        "SET jti = encode(sha256(convert_to(token, 'UTF8')), 'hex'), "
+        "expires_at = blacklisted_on + interval '1 hour'"
+    )
+    op.alter_column('blacklisted_tokens', 'jti', nullable=False)
+    op.alter_column('blacklisted_tokens', 'expires_at', nullable=False)
+    op.create_index('ix_blacklisted_tokens_jti', 'blacklisted_tokens', ['jti'], unique=True)
+    op.create_index('ix_blacklisted_tokens_expires_at', 'blacklisted_tokens', ['expires_at'], unique=False)
+    op.drop_column('blacklisted_tokens', 'token')
+
+
+def downgrade():
+    # Raw tokens are not recoverable; the jti takes their place
+    op.add_column('blacklisted_tokens', sa.Column('token', sa.String(), nullable=True))
+    op.execute("UPDATE blacklisted_tokens SET token = jti")
+    op.alter_column('blacklisted_tokens', 'token', nullable=False)
+    op.create_unique_constraint('blacklisted_tokens_token_key', 'blacklisted_tokens', ['token'])
+    op.drop_index('ix_blacklisted_tokens_expires_at', table_name='blacklisted_tokens')
+    op.drop_index('ix_blacklisted_tokens_jti', table_name='blacklisted_tokens')
+    op.drop_column('blacklisted_tokens', 'expires_at')
+    op.drop_column('blacklisted_tokens', 'jti')
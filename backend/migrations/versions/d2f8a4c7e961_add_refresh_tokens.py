@@ -0,0 +1,41 @@
+"""Add refresh tokens
+
+Revision ID: d2f8a4c7e961
+Revises: c9e3f1a6d2b8
+Create Date: 2026-10-18 19:04:12.381904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f8a4c7e961'
+down_revision = 'c9e3f1a6d2b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('refresh_token',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.Column('family_id', sa.UUID(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('used_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_refresh_token_user_id', 'refresh_token', ['user_id'], unique=False)
+    op.create_index('ix_refresh_token_token_hash', 'refresh_token', ['token_hash'], unique=True)
+    op.create_index('ix_refresh_token_family_id', 'refresh_token', ['family_id'], unique=False)
+    op.create_index('ix_refresh_token_expires_at', 'refresh_token', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_refresh_token_expires_at', table_name='refresh_token')
+    op.drop_index('ix_refresh_token_family_id', table_name='refresh_token')
+    op.drop_index('ix_refresh_token_token_hash', table_name='refresh_token')
+    op.drop_index('ix_refresh_token_user_id', table_name='refresh_token')
+    op.drop_table('refresh_token')
@@ -0,0 +1,37 @@
+"""Add idempotency keys
+
+Revision ID: d6b2f8c4a319
+Revises: c3e7a9d5f184
+Create Date: 2026-10-19 01:24:16.370582
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6b2f8c4a319'
+down_revision = 'c3e7a9d5f184'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('idempotency_key',
+    sa.Column('business_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('mimetype', sa.String(), nullable=True),
+    sa.Column('body', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['business_id'], ['business_detail.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('business_id', 'key')
+    )
+    op.create_index(op.f('ix_idempotency_key_created_at'), 'idempotency_key', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_idempotency_key_created_at'), table_name='idempotency_key')
+    op.drop_table('idempotency_key')
@@ -0,0 +1,26 @@
+"""Add recommendation sampling indexes
+
+Revision ID: e5b1c8d3f027
+Revises: d2f8a4c7e961
+Create Date: 2026-10-18 20:31:55.104362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1c8d3f027'
+down_revision = 'd2f8a4c7e961'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_business_detail_description_id', 'business_detail', ['description', 'id'], unique=False)
+    op.create_index('ix_reward_business_id_id', 'reward', ['business_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_reward_business_id_id', table_name='reward')
+    op.drop_index('ix_business_detail_description_id', table_name='business_detail')
@@ -0,0 +1,24 @@
+"""Add enrollment business index
+
+Revision ID: e9a1c5b7d246
+Revises: d6b2f8c4a319
+Create Date: 2026-10-19 09:12:40.581937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a1c5b7d246'
+down_revision = 'd6b2f8c4a319'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_enrollment_business_id_user_id', 'enrollment', ['business_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_enrollment_business_id_user_id', table_name='enrollment')
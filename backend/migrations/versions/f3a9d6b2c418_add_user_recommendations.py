@@ -0,0 +1,41 @@
+"""Add materialized user recommendations
+
+Revision ID: f3a9d6b2c418
+Revises: e5b1c8d3f027
+Create Date: 2026-10-18 21:47:20.662013
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d6b2c418'
+down_revision = 'e5b1c8d3f027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_recommendation_state',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.Column('dirty', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_user_recommendation_state_computed_at', 'user_recommendation_state', ['computed_at'], unique=False)
+    op.create_table('user_recommendation',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('reward_id', sa.UUID(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user_recommendation_state.user_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['reward_id'], ['reward.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'position')
+    )
+
+
+def downgrade():
+    op.drop_table('user_recommendation')
+    op.drop_index('ix_user_recommendation_state_computed_at', table_name='user_recommendation_state')
+    op.drop_table('user_recommendation_state')
@@ -0,0 +1,30 @@
+"""Add co-enrollment index state
+
+Revision ID: f7c3b9e2a584
+Revises: e9a1c5b7d246
+Create Date: 2026-10-19 15:31:08.204716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3b9e2a584'
+down_revision = 'e9a1c5b7d246'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    state = op.create_table('co_enrollment_index_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('maintained', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Not known to be current: the first worker that maintains the index rebuilds it
+    op.bulk_insert(state, [{'id': 1, 'maintained': False}])
+
+
+def downgrade():
+    op.drop_table('co_enrollment_index_state')
@@ -1,7 +1,7 @@
 from decimal import Decimal
-from pydantic import BaseModel, UUID4
+from pydantic import BaseModel, Field, UUID4, field_validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 class CreateUserRequest(BaseModel):
@@ -33,6 +33,13 @@ class UpsertBusinessRequest(BaseModel):
     phone_number: Optional[str] = None
 
 
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Reward validity windows are stored and compared as naive UTC
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
 class CreateRewardRequest(BaseModel):
     name: str
     description: Optional[str] = None
@@ -40,6 +47,11 @@ class CreateRewardRequest(BaseModel):
     valid_from_timestamp: Optional[datetime] = None
     valid_until_timestamp: Optional[datetime] = None
 
+    @field_validator('valid_from_timestamp', 'valid_until_timestamp')
+    @classmethod
+    def validate_timestamps(cls, value):
+        return _to_naive_utc(value)
+
 
 class UpdateRewardRequest(BaseModel):
     name: Optional[str] = None
@@ -48,6 +60,11 @@ class UpdateRewardRequest(BaseModel):
     valid_from_timestamp: Optional[datetime] = None
     valid_until_timestamp: Optional[datetime] = None
 
+    @field_validator('valid_from_timestamp', 'valid_until_timestamp')
+    @classmethod
+    def validate_timestamps(cls, value):
+        return _to_naive_utc(value)
+
 
 class RewardModel(CreateRewardRequest):
     id: UUID4
@@ -71,6 +88,10 @@ class AddPointsRequest(BaseModel):
     points: Decimal
 
 
+class BulkAddPointsRequest(BaseModel):
+    items: List[AddPointsRequest] = Field(min_length=1)
+
+
 class RedeemRewardRequest(BaseModel):
     user_id: UUID4
     reward_id: UUID4
@@ -79,6 +100,16 @@ class RedeemRewardRequest(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 
 class BusinessRecommendation(BaseModel):
@@ -129,6 +160,18 @@ class AddPointsResponse(BaseModel):
     new_points_balance: Decimal
 
 
+class BulkAddPointsItemResult(BaseModel):
+    user_id: UUID4
+    # 'applied', or 'not_enrolled' when the user is not enrolled in the business
+    status: str
+    # Balance after the whole batch, for items that were applied
+    new_points_balance: Optional[Decimal] = None
+
+
+class BulkAddPointsResponse(BaseModel):
+    results: List[BulkAddPointsItemResult]
+
+
 class RedeemRewardResponse(BaseModel):
     success: bool
     new_points_balance: Decimal
@@ -138,3 +181,35 @@ class BusinessWithRewards(BaseModel):
     details: BusinessDetailsModel
     rewards: List[RewardModel]
     similar_businesses: List[BusinessDetailsModel] = []
+
+
+class ListBusinessesQuery(BaseModel):
+    limit: int = Field(default=50, ge=1, le=200)
+    after: Optional[UUID4] = None
+    expand: List[str] = []
+
+    @field_validator('expand', mode='before')
+    @classmethod
+    def split_expand(cls, value):
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(',') if item.strip()]
+        return value
+
+    @field_validator('expand')
+    @classmethod
+    def validate_expand(cls, value):
+        unknown = set(value) - {'rewards', 'similar'}
+        if unknown:
+            raise ValueError(f"Unknown expansions: {', '.join(sorted(unknown))}")
+        return value
+
+
+class BusinessListItem(BaseModel):
+    details: BusinessDetailsModel
+    rewards: Optional[List[RewardModel]] = None
+    similar_businesses: Optional[List[BusinessDetailsModel]] = None
+
+
+class BusinessPage(BaseModel):
+    items: List[BusinessListItem]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,239 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+import random
+import time
+import uuid
+import click
+from flask import jsonify
+from flask.cli import AppGroup
+from src.api_schemas import BusinessDetailsModel, BusinessWithRewards, RewardModel
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessDetails, Enrollment, Reward
+from src.serialization import dumps, encode_business_listing
+from src.services.business_similarity import BusinessSimilarityService, build_enrollment_sets
+from src.services.business_similarity_minhash import MinHashBusinessSimilarityService
+from src.services.idempotency import idempotency_store
+from src.services.points import points_service
+from src.services.recommendation_batch import BatchRecommendationService
+from src.services.recommendation_store import user_recommendations
+from src.services.refresh_tokens import refresh_token_service
+from src.services.similarity_index import IndexedBusinessSimilarityService, co_enrollment_index
+from src.services.token_revocation import token_revocation_store
+
+_GeneratedBusiness = namedtuple('_GeneratedBusiness', ['id'])
+_GeneratedEnrollment = namedtuple('_GeneratedEnrollment', ['user_id', 'business_id'])
+
+similarity_cli = AppGroup('similarity', help='Manage the business similarity index.')
+serialization_cli = AppGroup('serialization', help='Inspect the JSON serialization paths.')
+auth_cli = AppGroup('auth', help='Manage authentication state.')
+recommendations_cli = AppGroup('recommendations', help='Manage the materialized user recommendations.')
+points_cli = AppGroup('points', help='Manage the points ledger and idempotency keys.')
+
+
+@similarity_cli.command('rebuild-index')
+def rebuild_index():
+    """Rebuild the co-enrollment index from the enrollment table."""
+    rows = co_enrollment_index.rebuild()
+    click.echo(f"Rebuilt co-enrollment index with {rows} rows")
+
+
+@similarity_cli.command('check-index')
+def check_index():
+    """Compare the co-enrollment index against the in-Python similarity service."""
+    businesses = BusinessDetails.query.all()
+    enrollments = db.session.query(Enrollment.user_id, Enrollment.business_id).yield_per(10000)
+    service = IndexedBusinessSimilarityService(index=co_enrollment_index)
+    mismatches = service.find_inconsistencies(businesses, enrollments)
+    if mismatches:
+        for business_id in mismatches:
+            click.echo(f"Similar businesses differ for business {business_id}")
+        raise click.ClickException(f"Co-enrollment index is inconsistent for {len(mismatches)} businesses")
+    click.echo(f"Co-enrollment index is consistent for {len(businesses)} businesses")
+
+
+@similarity_cli.command('minhash-report')
+@click.option('--businesses', 'business_count', default=2000, help='Number of generated businesses.')
+@click.option('--users', 'user_count', default=20000, help='Number of generated users.')
+@click.option('--enrollments-per-user', default=5, help='Enrollments per generated user.')
+@click.option('--cluster-size', default=20, help='Businesses per group that users mostly enroll within.')
+@click.option('--permutations', default=Config.MINHASH_PERMUTATIONS, help='MinHash signature size.')
+@click.option('--bands', default=Config.MINHASH_BANDS, help='Number of LSH bands.')
+@click.option('--seed', default=0, help='Random seed for the generated data.')
+def minhash_report(business_count, user_count, enrollments_per_user, cluster_size, permutations, bands, seed):
+    """Report recall@3 and speed of MinHash/LSH similarity against the exact service on generated data."""
+    businesses, enrollments = _generate_catalog(business_count, user_count, enrollments_per_user, cluster_size, seed)
+    exact_service = BusinessSimilarityService()
+    approximate_service = MinHashBusinessSimilarityService(num_permutations=permutations, num_bands=bands)
+
+    started = time.perf_counter()
+    exact = exact_service.get_all_similar_businesses(businesses, enrollments)
+    exact_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    approximate = approximate_service.get_all_similar_businesses(businesses, enrollments)
+    approximate_seconds = time.perf_counter() - started
+
+    # Only neighbours that actually share users count as relevant
+    business_enrollments = build_enrollment_sets(businesses, enrollments)
+    relevant = found = 0
+    for business in businesses:
+        users = business_enrollments[business.id]
+        expected = {b.id for b in exact[business.id] if users & business_enrollments[b.id]}
+        relevant += len(expected)
+        found += len(expected & {b.id for b in approximate[business.id]})
+
+    click.echo(f"Businesses: {business_count}, users: {user_count}, enrollments: {len(enrollments)}")
+    click.echo(f"MinHash permutations: {permutations}, bands: {bands}")
+    click.echo(f"Exact: {exact_seconds:.2f}s, MinHash/LSH: {approximate_seconds:.2f}s")
+    click.echo(f"Recall@3: {found / relevant if relevant else 1.0:.3f}")
+
+
+def _generate_catalog(business_count, user_count, enrollments_per_user, cluster_size, seed):
+    """Generate businesses and enrollments where users mostly enroll within one group of businesses."""
+    rng = random.Random(seed)
+    businesses = [_GeneratedBusiness(uuid.UUID(int=rng.getrandbits(128))) for _ in range(business_count)]
+    enrollments = []
+    for _ in range(user_count):
+        user_id = uuid.UUID(int=rng.getrandbits(128))
+        cluster_start = rng.randrange(0, business_count, cluster_size)
+        cluster = businesses[cluster_start:cluster_start + cluster_size]
+        chosen = set()
+        for _ in range(enrollments_per_user):
+            pool = cluster if rng.random() < 0.8 else businesses
+            chosen.add(rng.choice(pool).id)
+        enrollments.extend(_GeneratedEnrollment(user_id, business_id) for business_id in chosen)
+    return businesses, enrollments
+
+
+@auth_cli.command('purge-revoked-tokens')
+def purge_revoked_tokens():
+    """Delete expired revoked and refresh tokens. Workers also purge revoked tokens every REVOCATION_PURGE_SECONDS."""
+    rows = token_revocation_store.purge()
+    click.echo(f"Purged {rows} expired revoked tokens")
+    rows = refresh_token_service.purge()
+    click.echo(f"Purged {rows} expired refresh tokens")
+
+
+@recommendations_cli.command('refresh')
+def refresh_recommendations():
+    """Recompute all dirty and stale user recommendations. Workers also do this every RECOMMENDATION_REFRESH_SECONDS."""
+    total = 0
+    while True:
+        rows = user_recommendations.refresh_due()
+        total += rows
+        if rows < user_recommendations.batch_size:
+            break
+    click.echo(f"Refreshed recommendations of {total} users")
+
+
+@recommendations_cli.command('generate')
+@click.option('--workers', default=Config.RECOMMENDATION_BATCH_WORKERS, help='Process pool size; 0 computes inline.')
+@click.option('--chunk-size', default=Config.RECOMMENDATION_BATCH_CHUNK_SIZE, help='Users per chunk.')
+def generate_recommendations(workers, chunk_size):
+    """Recompute the recommendations of every user with enrollments, e.g. before a push campaign."""
+    result = BatchRecommendationService(workers=workers, chunk_size=chunk_size).generate()
+    click.echo(f"Users: {result.users}, recommendations: {result.rows}, time: {result.seconds:.2f}s")
+    click.echo(f"Throughput: {result.rows_per_second:.0f} rows/s")
+
+
+@points_cli.command('compact')
+def compact_points():
+    """Fold committed ledger entries into the enrollment balances. Workers also do this every POINTS_COMPACTION_SECONDS."""
+    rows = points_service.compact()
+    click.echo(f"Compacted points of {rows} enrollments")
+
+
+@points_cli.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    """Delete expired idempotency keys, and the oldest ones beyond IDEMPOTENCY_KEY_MAX_ENTRIES."""
+    rows = idempotency_store.purge()
+    click.echo(f"Purged {rows} idempotency keys")
+
+
+@serialization_cli.command('benchmark')
+@click.option('--businesses', 'business_count', default=10000, help='Number of generated businesses.')
+@click.option('--rewards-per-business', default=3, help='Rewards per generated business.')
+@click.option('--repeat', default=3, help='Runs per path; the fastest one is reported.')
+@click.option('--seed', default=0, help='Random seed for the generated data.')
+def serialization_benchmark(business_count, rewards_per_business, repeat, seed):
+    """Compare Pydantic models + jsonify with the encoder path on the unpaginated GET /businesses body."""
+    businesses, similar_by_business = _generate_listing(business_count, rewards_per_business, seed)
+
+    model_seconds = encoder_seconds = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        model_body = jsonify(_build_listing_with_models(businesses, similar_by_business)).get_data()
+        model_seconds = min(model_seconds, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        encoder_body = dumps(encode_business_listing(businesses, similar_by_business))
+        encoder_seconds = min(encoder_seconds, time.perf_counter() - started)
+
+    if model_body != encoder_body:
+        raise click.ClickException("Encoder output differs from the Pydantic + jsonify output")
+    click.echo(f"Businesses: {business_count}, rewards: {business_count * rewards_per_business}, body: {len(model_body)} bytes")
+    click.echo(f"Pydantic + jsonify: {model_seconds * 1000:.0f}ms, encoders + dump_json: {encoder_seconds * 1000:.0f}ms")
+    click.echo(f"Speedup: {model_seconds / encoder_seconds:.1f}x")
+
+
+def _build_listing_with_models(businesses, similar_by_business):
+    """The unpaginated GET /businesses body as it was built before the encoder path."""
+    def details(business):
+        return BusinessDetailsModel(
+            id=business.id,
+            business_name=business.business_name,
+            description=business.description,
+            email_address=business.email_address,
+            address=business.address,
+            phone_number=business.phone_number
+        )
+
+    return [
+        BusinessWithRewards(
+            details=details(business),
+            rewards=[RewardModel(
+                id=reward.id,
+                name=reward.name,
+                business_id=reward.business_id,
+                usage_count=reward.usage_count,
+                description=reward.description,
+                required_points=reward.required_points,
+            ) for reward in business.rewards],
+            similar_businesses=[details(b) for b in similar_by_business[business.id]]
+        ).model_dump()
+        for business in businesses
+    ]
+
+
+def _generate_listing(business_count, rewards_per_business, seed):
+    """Generate transient businesses with rewards, and three similar businesses for each."""
+    rng = random.Random(seed)
+    businesses = []
+    for index in range(business_count):
+        business = BusinessDetails(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            business_name=f"Business {index}" if index % 10 else f"Café {index}",
+            description="Generated business",
+            email_address=f"business{index}@example.com",
+            address=f"{index} Main Street",
+            phone_number=None,
+        )
+        business.rewards = [
+            Reward(
+                id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                business_id=business.id,
+                name=f"Reward {reward_index}",
+                description=None,
+                required_points=Decimal(rng.randrange(1, 10000)) / 100,
+                usage_count=rng.randrange(0, 1000),
+                valid_from_timestamp=datetime(2024, 1, 1) + timedelta(days=reward_index),
+            )
+            for reward_index in range(rewards_per_business)
+        ]
+        businesses.append(business)
+    similar_by_business = {
+        business.id: rng.sample(businesses, min(3, len(businesses))) for business in businesses
+    }
+    return businesses, similar_by_business
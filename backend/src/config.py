@@ -5,4 +5,53 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1000)
+    # Access tokens are verified without a database lookup, so keep them short-lived;
+    # clients renew them with their refresh token through POST /auth/refresh
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.getenv('JWT_ACCESS_TOKEN_MINUTES', '15')))
+    JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', '30')))
+    # Only the 'index' backend keeps the co-enrollment index current on enroll and cancel
+    SIMILARITY_BACKEND = os.getenv('SIMILARITY_BACKEND', 'python')
+    RECOMMENDATION_BACKEND = os.getenv('RECOMMENDATION_BACKEND', 'index')
+    # How often each worker rebuilds its category index to pick up other workers' writes
+    RECOMMENDATION_INDEX_REFRESH_SECONDS = float(os.getenv('RECOMMENDATION_INDEX_REFRESH_SECONDS', '30'))
+    # Materialized recommendations older than this are recomputed by the background refresher,
+    # which runs every RECOMMENDATION_REFRESH_SECONDS (0 disables it) and right after enrollment changes
+    RECOMMENDATION_STALENESS_SECONDS = float(os.getenv('RECOMMENDATION_STALENESS_SECONDS', '3600'))
+    RECOMMENDATION_REFRESH_SECONDS = float(os.getenv('RECOMMENDATION_REFRESH_SECONDS', '60'))
+    RECOMMENDATION_REFRESH_BATCH_SIZE = int(os.getenv('RECOMMENDATION_REFRESH_BATCH_SIZE', '100'))
+    # Process pool size (0 computes inline) and users per chunk of `flask recommendations generate`
+    RECOMMENDATION_BATCH_WORKERS = int(os.getenv('RECOMMENDATION_BATCH_WORKERS', str(os.cpu_count() or 1)))
+    RECOMMENDATION_BATCH_CHUNK_SIZE = int(os.getenv('RECOMMENDATION_BATCH_CHUNK_SIZE', '1000'))
+    MINHASH_PERMUTATIONS = int(os.getenv('MINHASH_PERMUTATIONS', '128'))
+    MINHASH_BANDS = int(os.getenv('MINHASH_BANDS', '64'))
+    # Serve the full unpaginated catalog when GET /businesses is called without `limit`
+    LEGACY_UNPAGINATED_BUSINESSES = os.getenv('LEGACY_UNPAGINATED_BUSINESSES', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+    # Stream list endpoints from server-side cursors instead of building the whole body in memory
+    STREAM_LIST_RESPONSES = os.getenv('STREAM_LIST_RESPONSES', 'false').lower() == 'true'
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', '100000'))
+    REVOCATION_BLOOM_ERROR_RATE = float(os.getenv('REVOCATION_BLOOM_ERROR_RATE', '0.001'))
+    # How often each worker picks up tokens revoked by other workers
+    REVOCATION_SYNC_SECONDS = float(os.getenv('REVOCATION_SYNC_SECONDS', '2'))
+    # How often the background thread of each worker purges revocations of expired tokens (0 disables it)
+    REVOCATION_PURGE_SECONDS = float(os.getenv('REVOCATION_PURGE_SECONDS', '3600'))
+    PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv('PRINCIPAL_CACHE_MAX_ENTRIES', '10000'))
+    PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv('PRINCIPAL_CACHE_TTL_SECONDS', '60'))
+    # pbkdf2 cost for new hashes; stored hashes with a different cost are rehashed on login
+    PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS', '29000'))
+    # Hashing pool size (0 hashes on the request thread) and how many calls may wait for it
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '32'))
+    # Largest batch accepted by POST /enrollments/add_points/bulk
+    BULK_ADD_POINTS_MAX_ITEMS = int(os.getenv('BULK_ADD_POINTS_MAX_ITEMS', '10000'))
+    # Rows each reward's usage count is spread over; more rows let more redemptions of one reward run at once
+    REWARD_USAGE_SLOTS = int(os.getenv('REWARD_USAGE_SLOTS', '16'))
+    # Responses of points writes sent with an Idempotency-Key are replayed for IDEMPOTENCY_KEY_TTL_SECONDS.
+    # Every IDEMPOTENCY_KEY_PURGE_SECONDS (0 disables it) a background thread of each worker deletes expired ones
+    # and the oldest beyond IDEMPOTENCY_KEY_MAX_ENTRIES.
+    IDEMPOTENCY_KEY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+    IDEMPOTENCY_KEY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_KEY_MAX_ENTRIES', '1000000'))
+    IDEMPOTENCY_KEY_PURGE_SECONDS = float(os.getenv('IDEMPOTENCY_KEY_PURGE_SECONDS', '300'))
+    # How often each worker folds the points ledger into the enrollment balances (0 disables it)
+    POINTS_COMPACTION_SECONDS = float(os.getenv('POINTS_COMPACTION_SECONDS', '60'))
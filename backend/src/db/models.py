@@ -17,6 +17,10 @@ class User(db.Model):
 
 class BusinessDetails(db.Model):
     __tablename__ = 'business_detail'
+    __table_args__ = (
+        # Random sampling of a category's businesses for recommendations
+        db.Index('ix_business_detail_description_id', 'description', 'id'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), nullable=False)
@@ -31,27 +35,158 @@ class BusinessDetails(db.Model):
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollment'
+    __table_args__ = (
+        db.Index('ix_enrollment_user_id_business_id', 'user_id', 'business_id'),
+        # Members of given businesses, for the similar businesses of a catalog page
+        db.Index('ix_enrollment_business_id_user_id', 'business_id', 'user_id'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), nullable=False)
     business_id = db.Column(UUID(as_uuid=True), db.ForeignKey('business_detail.id'), nullable=False)
-    points = db.Column(db.Numeric(10, 2), default=0)
+    # Balance as of the last compaction: it includes every ledger entry whose `xid` is below
+    # `points_snapshot_xid`. `points` (defined below PointsTransaction) adds the newer ones.
+    points_snapshot = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    points_snapshot_xid = db.Column(db.BigInteger, nullable=False, default=0)
 
 class Reward(db.Model):
     __tablename__ = 'reward'
+    __table_args__ = (
+        db.Index('ix_reward_business_id_id', 'business_id', 'id'),
+        # Unexpired rewards of a business without reading its expired ones: open-ended rewards,
+        # and a range scan past `now` over the ones that end
+        db.Index('ix_reward_business_id_open_ended', 'business_id',
+                 postgresql_where=db.text('valid_until_timestamp IS NULL')),
+        db.Index('ix_reward_business_id_valid_until', 'business_id', 'valid_until_timestamp',
+                 postgresql_where=db.text('valid_until_timestamp IS NOT NULL')),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     business_id = db.Column(UUID(as_uuid=True), db.ForeignKey('business_detail.id'), nullable=False)
     name = db.Column(db.String, nullable=False)
     description = db.Column(db.Text)
     required_points = db.Column(db.Numeric(10, 2), nullable=False)
-    usage_count = db.Column(db.Integer, default=0)
+    # Uses counted before usage slots existed; `usage_count` (defined below RewardUsageSlot) adds the slots
+    usage_count_base = db.Column(db.Integer, nullable=False, default=0)
     valid_from_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     valid_until_timestamp = db.Column(db.DateTime)
 
+class RewardUsageSlot(db.Model):
+    __tablename__ = 'reward_usage_slot'
+    
+    # A reward's uses are spread over REWARD_USAGE_SLOTS rows, so concurrent redemptions of
+    # a popular reward rarely increment the same row
+    reward_id = db.Column(UUID(as_uuid=True), db.ForeignKey('reward.id', ondelete='CASCADE'), primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+Reward.usage_count = db.column_property(
+    Reward.usage_count_base + db.func.coalesce(
+        db.select(db.func.sum(RewardUsageSlot.count))
+        .where(RewardUsageSlot.reward_id == Reward.id)
+        .correlate_except(RewardUsageSlot)
+        .scalar_subquery(),
+        0,
+    )
+)
+
+class PointsTransaction(db.Model):
+    __tablename__ = 'points_transaction'
+    __table_args__ = (
+        db.Index('ix_points_transaction_enrollment_id_xid', 'enrollment_id', 'xid'),
+        # Compaction reads the entries written since its previous run
+        db.Index('ix_points_transaction_xid', 'xid'),
+    )
+    
+    # Append-only: one row per earn (positive amount) or redemption (negative amount)
+    id = db.Column(db.BigInteger, db.Identity(), primary_key=True)
+    enrollment_id = db.Column(UUID(as_uuid=True), db.ForeignKey('enrollment.id', ondelete='CASCADE'), nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    reward_id = db.Column(UUID(as_uuid=True), db.ForeignKey('reward.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Id of the writing transaction, which is what compaction folds by: ids are handed out at
+    # the first write, so unlike `id` they say which entries are certainly committed
+    xid = db.Column(db.BigInteger, nullable=False, server_default=db.text('pg_current_xact_id()::text::bigint'))
+
+# Current balance: the snapshot plus the entries compaction has not folded into it yet
+Enrollment.points = db.column_property(
+    Enrollment.points_snapshot + db.func.coalesce(
+        db.select(db.func.sum(PointsTransaction.amount))
+        .where(PointsTransaction.enrollment_id == Enrollment.id,
+               PointsTransaction.xid >= Enrollment.points_snapshot_xid)
+        .correlate_except(PointsTransaction)
+        .scalar_subquery(),
+        0,
+    )
+)
+
 class BlacklistedToken(db.Model):
     __tablename__ = 'blacklisted_tokens'
     
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String, unique=True, nullable=False)
+    # `jti` claim of the revoked token; rows can be purged once `expires_at` has passed
+    jti = db.Column(db.String, unique=True, index=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_token'
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), nullable=False, index=True)
+    # SHA-256 of the token; the token itself is only ever sent to the client
+    token_hash = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    # Tokens rotated from the same sign-in share a family, revoked as a whole on reuse or logout
+    family_id = db.Column(UUID(as_uuid=True), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    used_at = db.Column(db.DateTime)
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_key'
+    
+    # Keys are chosen by clients, so they are scoped to the business that sent them
+    business_id = db.Column(UUID(as_uuid=True), db.ForeignKey('business_detail.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    # SHA-256 of the request path and body, so that a key reused for another request is refused
+    request_hash = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    # The first response, stored in the transaction that claimed the key
+    status_code = db.Column(db.Integer)
+    mimetype = db.Column(db.String)
+    body = db.Column(db.LargeBinary)
+
+class UserRecommendationState(db.Model):
+    __tablename__ = 'user_recommendation_state'
+    
+    # One row per user whose recommendations have been materialized
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), primary_key=True)
+    computed_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Set by enrollment changes until the refresher recomputes the user
+    dirty = db.Column(db.Boolean, nullable=False, default=False)
+
+class UserRecommendation(db.Model):
+    __tablename__ = 'user_recommendation'
+    
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user_recommendation_state.user_id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    reward_id = db.Column(UUID(as_uuid=True), db.ForeignKey('reward.id', ondelete='CASCADE'), nullable=False)
+
+class BusinessCoEnrollment(db.Model):
+    __tablename__ = 'business_co_enrollment'
+
+    # Derived from `enrollment`: number of users enrolled in both businesses.
+    # Rows where business_id == other_business_id hold the business member count.
+    business_id = db.Column(UUID(as_uuid=True), primary_key=True)
+    other_business_id = db.Column(UUID(as_uuid=True), primary_key=True)
+    shared_count = db.Column(db.Integer, nullable=False, default=0)
+
+class CoEnrollmentIndexState(db.Model):
+    __tablename__ = 'co_enrollment_index_state'
+
+    # A single row: whether enroll and cancel have kept `business_co_enrollment` current since its last rebuild
+    id = db.Column(db.Integer, primary_key=True)
+    maintained = db.Column(db.Boolean, nullable=False, default=False)
+
+# Bumped after every commit that changes businesses, rewards or enrollments, so every
+# worker can tell whether its cached catalog responses are still current
+response_cache_version = db.Sequence('response_cache_version', metadata=db.metadata)
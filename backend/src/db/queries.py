@@ -0,0 +1,60 @@
+from typing import Iterable, Optional
+from datetime import datetime
+from uuid import UUID
+from flask_sqlalchemy.query import Query
+from sqlalchemy import and_, or_
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.orm import joinedload, selectinload
+from .models import BusinessDetails, Enrollment, Reward
+
+# Each loader fetches an object graph in a fixed number of round-trips, regardless of how
+# many rows it returns, so routes never fall back to per-row lazy loads. Loaders return
+# queries, so callers can either load everything with .all() or stream with .yield_per().
+
+
+def businesses_with_rewards(unexpired_at: Optional[datetime] = None) -> Query:
+    """Businesses with their rewards loaded in one extra SELECT ... IN query.
+
+    With `unexpired_at`, only rewards that have not expired by then are loaded.
+    """
+    rewards = BusinessDetails.rewards
+    if unexpired_at is not None:
+        rewards = rewards.and_(reward_not_expired(unexpired_at))
+    return BusinessDetails.query.options(selectinload(rewards))
+
+
+def reward_not_expired(now: datetime) -> ColumnElement:
+    """Criterion for rewards that are active or still to come at `now`.
+
+    Its two branches match the partial indexes on `reward`, so expired rewards are
+    never read, however many of them pile up.
+    """
+    return or_(Reward.valid_until_timestamp.is_(None), Reward.valid_until_timestamp > now)
+
+
+def reward_active(now: datetime) -> ColumnElement:
+    """Criterion for rewards that are active at `now`."""
+    return and_(Reward.valid_from_timestamp <= now, reward_not_expired(now))
+
+
+def user_enrollments_with_businesses(user_id: UUID) -> Query:
+    """A user's enrollments with their businesses joined in the same query."""
+    return (
+        Enrollment.query
+        .options(joinedload(Enrollment.business))
+        .filter_by(user_id=user_id)
+    )
+
+
+def business_enrollments_with_users(business_id: UUID) -> Query:
+    """A business's enrollments with their users joined in the same query."""
+    return (
+        Enrollment.query
+        .options(joinedload(Enrollment.user))
+        .filter_by(business_id=business_id)
+    )
+
+
+def businesses_by_ids(business_ids: Iterable[UUID]) -> Query:
+    """Businesses with the given IDs, in one SELECT ... IN query."""
+    return BusinessDetails.query.filter(BusinessDetails.id.in_(list(business_ids)))
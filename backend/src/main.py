@@ -5,6 +5,15 @@ from src.db.connection import db
 from flask_migrate import Migrate, upgrade
 from src.config import Config
 from src.routes import auth, businesses, enrollments
+from src.commands import auth_cli, points_cli, recommendations_cli, serialization_cli, similarity_cli
+from src.services.idempotency import idempotency_store
+from src.services.points import points_service
+from src.services.principal_cache import principal_cache
+from src.services.recommendation_index import category_index
+from src.services.recommendation_store import user_recommendations
+from src.services.response_cache import response_cache
+from src.services.similarity_index import co_enrollment_index
+from src.services.token_revocation import token_revocation_store
 import logging
 
 
@@ -24,16 +33,34 @@ def create_app():
     CORS(app)
     db.init_app(app)
     migrate = Migrate(app, db)
+    response_cache.listen()
+    principal_cache.listen()
+    category_index.listen()
+    user_recommendations.listen()
     
     # Register blueprints
     app.register_blueprint(auth.bp)
     app.register_blueprint(businesses.bp)
     app.register_blueprint(enrollments.bp)
 
+    app.cli.add_command(similarity_cli)
+    app.cli.add_command(serialization_cli)
+    app.cli.add_command(auth_cli)
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(points_cli)
+
     return app
 
 
 if __name__ == '__main__':
     app = create_app()
     _run_db_migrations_if_exists(app)
+    with app.app_context():
+        co_enrollment_index.ensure_current()
+    # With the debug reloader this process only watches files; its child serves requests
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        user_recommendations.start(app)
+        points_service.start(app)
+        token_revocation_store.start(app)
+        idempotency_store.start(app)
     app.run(host='0.0.0.0', port=5013)
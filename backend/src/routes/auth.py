@@ -1,18 +1,26 @@
 from src.routes.auth_middleware import require_auth
 from src.config import Config
 from flask import Blueprint, g, request, jsonify
-from src.db.models import Enrollment, User, BlacklistedToken, BusinessDetails
-from src.api_schemas import CreateUserRequest, LoginUserRequest, TokenResponse, UserModel
+from src.db.models import Enrollment, User, BusinessDetails
+from src.api_schemas import (
+    CreateUserRequest,
+    LoginUserRequest,
+    LogoutRequest,
+    RefreshTokenRequest,
+    TokenResponse,
+    UserModel,
+)
 from src.db.connection import db
-from passlib.hash import pbkdf2_sha256
-from jose import jwt
+from jose import jwt, JWTError
 import datetime
-from src.services.business_recommendation import BusinessRecommendationService
+import uuid
+from src.services.password_hashing import PasswordHasherBusy, password_hasher
+from src.services.refresh_tokens import refresh_token_service
+from src.services.token_revocation import token_id, token_revocation_store
+from src.services.recommendation_store import user_recommendations
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
-business_recommendation_service = BusinessRecommendationService()
-
 @bp.route('/register', methods=['POST'])
 def register():
     print(f"Registering user")
@@ -23,16 +31,15 @@ def register():
         
     user = User(
         username=request_data.username,
-        hashed_password=pbkdf2_sha256.hash(request_data.password),
+        hashed_password=password_hasher.hash(request_data.password),
         email_address=request_data.email_address,
         is_business_owner=request_data.is_business_owner
     )
     
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()
     
-    token = _create_access_token(str(user.id))
-    return TokenResponse(access_token=token).model_dump()
+    return _create_token_response(user.id)
 
 @bp.route('/login', methods=['POST'])
 def login():
@@ -40,11 +47,28 @@ def login():
     request_data = LoginUserRequest.model_validate(request.get_json())
     user = User.query.filter_by(username=request_data.username).first()
     
-    if not user or not pbkdf2_sha256.verify(request_data.password, user.hashed_password):
+    if not user or not password_hasher.verify(request_data.password, user.hashed_password):
         return jsonify({'error': 'Invalid credentials'}), 401
+
+    if password_hasher.needs_update(user.hashed_password):
+        _rehash_password(user, request_data.password)
         
-    token = _create_access_token(str(user.id))
-    return TokenResponse(access_token=token).model_dump()       
+    return _create_token_response(user.id)
+
+@bp.route('/refresh', methods=['POST'])
+def refresh():
+    print(f"Refreshing tokens")
+    request_data = RefreshTokenRequest.model_validate(request.get_json())
+    rotated = refresh_token_service.rotate(request_data.refresh_token)
+    if rotated is None:
+        return jsonify({'error': 'Invalid refresh token'}), 401
+    
+    user_id, refresh_token = rotated
+    return TokenResponse(
+        access_token=_create_access_token(str(user_id)),
+        refresh_token=refresh_token,
+        expires_in=int(Config.JWT_ACCESS_TOKEN_EXPIRES.total_seconds()),
+    ).model_dump()
 
 @bp.route('/logout', methods=['POST'])
 def logout():
@@ -54,11 +78,21 @@ def logout():
         return jsonify({'error': 'Missing or invalid token'}), 401
     
     token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
+    except JWTError:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    # Clients holding a refresh token send it along so that it stops working too
+    request_data = LogoutRequest.model_validate(request.get_json(silent=True) or {})
     
-    blacklisted_token = BlacklistedToken(token=token)
-    db.session.add(blacklisted_token)
     try:
-        db.session.commit()
+        token_revocation_store.revoke(
+            token_id(token, payload),
+            datetime.datetime.utcfromtimestamp(payload['exp'])
+        )
+        if request_data.refresh_token:
+            refresh_token_service.revoke(request_data.refresh_token, uuid.UUID(payload['user_id']))
         return jsonify({'message': 'Successfully logged out'}), 200
     except Exception as e:
         db.session.rollback()
@@ -69,11 +103,9 @@ def logout():
 def get_current_user_details():
     print(f"Getting current user details")
     user = User.query.filter_by(id=g.user.id).first()
+    if not user:
+        return jsonify({'error': 'Authentication required'}), 401
     
-    user_enrollments = Enrollment.query.filter_by(user_id=g.user.id).all()
-    user_businesses = [enrollment.business for enrollment in user_enrollments]
-    all_businesses = BusinessDetails.query.all()
-
     response = UserModel(
         id=user.id,
         username=user.username,
@@ -81,18 +113,43 @@ def get_current_user_details():
         is_business_owner=user.is_business_owner,
     )
 
-    if user_businesses and all_businesses:
-        response.recommendations = business_recommendation_service.get_recommendations(
-            user_businesses, 
-            all_businesses
-        )
+    # Materialized by the background refresher; computed here only for users it has not seen yet
+    recommendations = user_recommendations.get(g.user.id)
+    if recommendations is None:
+        recommendations = user_recommendations.refresh(g.user.id)
+    response.recommendations = recommendations
 
     return response.model_dump()
 
+@bp.errorhandler(PasswordHasherBusy)
+def handle_password_hasher_busy(e):
+    print(f"Password hashing pool is saturated")
+    response = jsonify({'error': 'Server is busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def _rehash_password(user: User, password: str) -> None:
+    try:
+        user.hashed_password = password_hasher.hash(password)
+        db.session.commit()
+    except PasswordHasherBusy:
+        # The upgrade can wait for the next login
+        pass
+
+def _create_token_response(user_id: uuid.UUID) -> dict:
+    """Issue an access token and a new refresh token family, committing the session."""
+    refresh_token = refresh_token_service.issue(user_id)
+    db.session.commit()
+    return TokenResponse(
+        access_token=_create_access_token(str(user_id)),
+        refresh_token=refresh_token,
+        expires_in=int(Config.JWT_ACCESS_TOKEN_EXPIRES.total_seconds()),
+    ).model_dump()
+
 def _create_access_token(user_id: str) -> str:
-    expire = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    expire = datetime.datetime.utcnow() + Config.JWT_ACCESS_TOKEN_EXPIRES
     return jwt.encode(
-        {'user_id': user_id, 'exp': expire},
+        {'user_id': user_id, 'exp': expire, 'jti': uuid.uuid4().hex},
         Config.JWT_SECRET_KEY,
         algorithm='HS256'
     )
@@ -1,21 +1,32 @@
 from functools import wraps
+from uuid import UUID
 from flask import request, jsonify, g
-from src.db.models import User, BlacklistedToken
 from jose import jwt, JWTError
 from src.config import Config
+from src.services.principal_cache import principal_cache
+from src.services.token_revocation import token_id, token_revocation_store
+
+def decode_token(token: str):
+    """Decode and verify a token. Returns None if it is invalid, expired or revoked."""
+    try:
+        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
+    except JWTError:
+        return None
+    if token_revocation_store.is_revoked(token_id(token, payload)):
+        return None
+    return payload
 
 def get_current_user():
+    """The authenticated Principal (user id and is_business_owner), or None."""
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
     
     token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
-        user = User.query.get(payload['user_id'])
-        return user
-    except JWTError:
+    payload = decode_token(token)
+    if payload is None:
         return None
+    return principal_cache.get(UUID(payload['user_id']))
 
 def require_auth(f):
     @wraps(f)
@@ -28,6 +39,7 @@ def require_auth(f):
     return decorated
 
 def require_business_owner(f):
+    """Require a business owner. Sets `g.user`, and `g.business_id` to their business or None."""
     @wraps(f)
     def decorated(*args, **kwargs):
         user = get_current_user()
@@ -35,7 +47,23 @@ def require_business_owner(f):
             return jsonify({'error': 'Authentication required'}), 401
         if not user.is_business_owner:
             return jsonify({'error': 'Business owner access required'}), 403
+        if user.business_id is None:
+            # The business may have been created through another worker since the user was cached
+            user = principal_cache.reload(user.id)
+            if not user:
+                return jsonify({'error': 'Authentication required'}), 401
         g.user = user
+        g.business_id = user.business_id
+        return f(*args, **kwargs)
+    return decorated
+
+def require_business(f):
+    """Like require_business_owner, for handlers that act on the owner's existing business."""
+    @require_business_owner
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if g.business_id is None:
+            return jsonify({'error': 'Business not found'}), 404
         return f(*args, **kwargs)
     return decorated
 
@@ -47,16 +75,16 @@ def token_required(f):
             return jsonify({'error': 'Missing or invalid token'}), 401
         
         token = auth_header.split(' ')[1]
-        
-        # Check if token is blacklisted
-        if BlacklistedToken.query.filter_by(token=token).first():
-            return jsonify({'error': 'Token has been invalidated'}), 401
             
         try:
             payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
-            request.user_id = payload['user_id']
         except JWTError:
             return jsonify({'error': 'Invalid token'}), 401
+        
+        # Check if token is blacklisted
+        if token_revocation_store.is_revoked(token_id(token, payload)):
+            return jsonify({'error': 'Token has been invalidated'}), 401
+        request.user_id = payload['user_id']
             
         return f(*args, **kwargs)
     return decorated
@@ -1,101 +1,144 @@
+from datetime import datetime
+from itertools import islice
 from flask import Blueprint, request, jsonify, g, current_app
+from pydantic import ValidationError
 from src.db.models import BusinessDetails, Reward, User, Enrollment
 from src.api_schemas import (
-    BusinessDetailsModel,
     CreateRewardRequest,
-    RewardModel,
-    UserModel,
-    EnrollmentDetailsResponse,
-    GetBusinessEnrollmentResponse,
-    BusinessWithRewards,
+    ListBusinessesQuery,
     UpsertBusinessRequest,
     UpdateRewardRequest,
 )
 from src.db.connection import db
-from .auth_middleware import require_business_owner
-from src.services.business_similarity import BusinessSimilarityService
+from src.db.queries import business_enrollments_with_users, businesses_by_ids, businesses_with_rewards
+from src.config import Config
+from src.serialization import (
+    business_details_encoder,
+    encode_business_listing,
+    enrollment_encoder,
+    json_response,
+    reward_encoder,
+    reward_summary_encoder,
+    stream_json_array,
+    user_encoder,
+)
+from .auth_middleware import require_business, require_business_owner
+from .cache_middleware import cached_response
+from src.services.business_similarity import create_similarity_service
+from src.services.reward_validity import active_rewards, next_change
 
 bp = Blueprint('businesses', __name__, url_prefix='/businesses')
 
-similarity_service = BusinessSimilarityService()
+similarity_service = create_similarity_service(Config.SIMILARITY_BACKEND)
 
 @bp.route('', methods=['GET'])
+@cached_response
 def list_businesses():
+    if 'limit' in request.args or not Config.LEGACY_UNPAGINATED_BUSINESSES:
+        return _list_businesses_page()
+
+    if Config.STREAM_LIST_RESPONSES:
+        return _stream_businesses()
+
     print(f"Fetching all businesses")
     current_app.logger.warning(f"Fetching all businesses")
-    businesses = BusinessDetails.query.all()
-    enrollments = Enrollment.query.all()
+    now = datetime.utcnow()
+    businesses = businesses_with_rewards(unexpired_at=now).all()
+    enrollments = db.session.query(Enrollment.user_id, Enrollment.business_id).yield_per(10000)
     print(f"Found {len(businesses)} businesses")
-    result = []
+    similar_by_business = similarity_service.get_all_similar_businesses(businesses, enrollments)
+    rewards_by_business = {business.id: active_rewards(business.rewards, now) for business in businesses}
+    g.cache_expires_at = next_change((reward for business in businesses for reward in business.rewards), now)
     
+    return json_response(encode_business_listing(businesses, similar_by_business, rewards_by_business))
+
+def _stream_businesses():
+    """Unpaginated listing streamed in id order, one batch of businesses in memory at a time."""
+    print(f"Streaming all businesses")
+    # Similarity only needs the business IDs, so the full rows are never loaded all at once
+    business_ids = db.session.query(BusinessDetails.id).order_by(BusinessDetails.id).all()
+    enrollments = db.session.query(Enrollment.user_id, Enrollment.business_id).yield_per(10000)
+    similar_by_business = similarity_service.get_all_similar_businesses(business_ids, enrollments)
+    now = datetime.utcnow()
+    businesses = businesses_with_rewards(unexpired_at=now).order_by(BusinessDetails.id).yield_per(Config.STREAM_BATCH_SIZE)
+    return stream_json_array(_iter_business_listing(businesses, similar_by_business, now))
+
+def _iter_business_listing(businesses, similar_by_business, now):
+    """Yield listing items, loading the details of similar businesses once per batch."""
+    businesses = iter(businesses)
+    while batch := list(islice(businesses, Config.STREAM_BATCH_SIZE)):
+        details_by_id = {business.id: business_details_encoder.encode(business) for business in batch}
+        missing_ids = {b.id for business in batch for b in similar_by_business[business.id]} - details_by_id.keys()
+        if missing_ids:
+            details_by_id.update((b.id, business_details_encoder.encode(b)) for b in businesses_by_ids(missing_ids))
+        for business in batch:
+            yield {
+                'details': details_by_id[business.id],
+                'rewards': [reward_summary_encoder.encode(reward) for reward in active_rewards(business.rewards, now)],
+                'similar_businesses': [details_by_id[b.id] for b in similar_by_business[business.id]],
+            }
+
+def _list_businesses_page():
+    """Keyset-paginated listing ordered by business id, with opt-in `rewards` and `similar` expansions."""
+    try:
+        query = ListBusinessesQuery.model_validate(request.args.to_dict())
+    except ValidationError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    print(f"Fetching businesses page after={query.after} limit={query.limit} expand={query.expand}")
+
+    now = datetime.utcnow()
+    page_query = businesses_with_rewards(unexpired_at=now) if 'rewards' in query.expand else BusinessDetails.query
+    page_query = page_query.order_by(BusinessDetails.id)
+    if query.after:
+        page_query = page_query.filter(BusinessDetails.id > query.after)
+    businesses = page_query.limit(query.limit + 1).all()
+    has_more = len(businesses) > query.limit
+    businesses = businesses[:query.limit]
+
+    similar_by_business = {}
+    if 'similar' in query.expand and businesses:
+        # Only the page's businesses, so a page costs the same however large the catalog is
+        similar_by_business = similarity_service.get_similar_for([business.id for business in businesses])
+
+    if 'rewards' in query.expand:
+        g.cache_expires_at = next_change((reward for business in businesses for reward in business.rewards), now)
+
+    items = []
     for business in businesses:
-        similar_businesses = similarity_service.get_similar_businesses(business.id, businesses, enrollments)
-        response = BusinessWithRewards(
-            details=BusinessDetailsModel(
-                id=business.id,
-                business_name=business.business_name,
-                description=business.description,
-                email_address=business.email_address,
-                address=business.address,
-                phone_number=business.phone_number
-            ),
-            rewards=[RewardModel(
-                id=reward.id,
-                name=reward.name,
-                business_id=reward.business_id,
-                usage_count=reward.usage_count,
-                description=reward.description,
-                required_points=reward.required_points,
-            ) for reward in business.rewards],
-            similar_businesses=[BusinessDetailsModel(
-                id=b.id,
-                business_name=b.business_name,
-                description=b.description,
-                email_address=b.email_address,
-                address=b.address,
-                phone_number=b.phone_number
-            ) for b in similar_businesses]
-        )
-        result.append(response.model_dump())
-    
-    return jsonify(result)
+        item = {'details': business_details_encoder.encode(business), 'rewards': None, 'similar_businesses': None}
+        if 'rewards' in query.expand:
+            item['rewards'] = [reward_encoder.encode(reward) for reward in active_rewards(business.rewards, now)]
+        if 'similar' in query.expand:
+            item['similar_businesses'] = [business_details_encoder.encode(b) for b in similar_by_business[business.id]]
+        items.append(item)
+
+    return json_response({
+        'items': items,
+        'next_cursor': str(businesses[-1].id) if has_more else None,
+    })
 
 @bp.route('/me', methods=['GET'])
-@require_business_owner
+@require_business
+@cached_response
 def get_current_business_details():
     print(f"Fetching current business details for user_id: {g.user.id}")
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
+    business = db.session.get(BusinessDetails, g.business_id)
     
     if not business:
         return jsonify({"error": "No business details found for this user"}), 404
     
-    response = BusinessWithRewards(
-            details=BusinessDetailsModel(
-                id=business.id,
-                business_name=business.business_name,
-                description=business.description,
-                email_address=business.email_address,
-                address=business.address,
-                phone_number=business.phone_number
-            ),
-            rewards=[RewardModel(
-                id=reward.id,
-                name=reward.name,
-                business_id=reward.business_id,
-                usage_count=reward.usage_count,
-                description=reward.description,
-                required_points=reward.required_points,
-            ) for reward in business.rewards]
-        )
-    
-    return jsonify(response.model_dump())
+    return json_response({
+        'details': business_details_encoder.encode(business),
+        'rewards': [reward_summary_encoder.encode(reward) for reward in business.rewards],
+        'similar_businesses': [],
+    })
 
 @bp.route('', methods=['PUT'])
 @require_business_owner
 def upsert_business():
     print(f"Upserting business for user_id: {g.user.id}")
     request_data = UpsertBusinessRequest.model_validate(request.get_json())
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
+    business = db.session.get(BusinessDetails, g.business_id) if g.business_id else None
     
     if not business:
         business = BusinessDetails(user_id=g.user.id)
@@ -112,44 +155,29 @@ def upsert_business():
     return '', 200
 
 @bp.route('/enrollments', methods=['GET'])
-@require_business_owner
+@require_business
 def get_business_enrollments():
     print(f"Fetching enrollments for business owned by user_id: {g.user.id}")
-    # Get the business owned by the authenticated user
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
-    if not business:
-        return jsonify({"error": "Business not found"}), 404
-
-    # Get all enrollments for this business
-    enrollments = Enrollment.query.filter_by(business_id=business.id).all()
+    # Get all enrollments for the authenticated owner's business, with their users
+    enrollments = business_enrollments_with_users(g.business_id)
+    if Config.STREAM_LIST_RESPONSES:
+        print(f"Streaming enrollments")
+        return stream_json_array(_to_business_enrollment(e) for e in enrollments.yield_per(Config.STREAM_BATCH_SIZE))
+    enrollments = enrollments.all()
     
     print(f"Found {len(enrollments)} enrollments")
     
-    result = []
-    for enrollment in enrollments:
-        user = User.query.get(enrollment.user_id)
-        response = GetBusinessEnrollmentResponse(
-            user=UserModel.model_validate(user),
-            enrollment=EnrollmentDetailsResponse.model_validate(enrollment)
-        )
-        result.append(response.model_dump())
-    
-    return jsonify(result)
+    return json_response([_to_business_enrollment(enrollment) for enrollment in enrollments])
 
 @bp.route('/rewards', methods=['POST'])
-@require_business_owner
+@require_business
 def create_reward():
     print(f"Creating new reward for business owned by user_id: {g.user.id}")
-    # Get the business owned by the authenticated user
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
-    if not business:
-        return jsonify({"error": "Business not found"}), 404
-
     # Validate and create the reward
     request_data = CreateRewardRequest.model_validate(request.get_json())
     
     reward = Reward(
-        business_id=business.id,
+        business_id=g.business_id,
         name=request_data.name,
         description=request_data.description,
         required_points=request_data.required_points,
@@ -163,20 +191,15 @@ def create_reward():
     return '', 200
 
 @bp.route('/rewards/<int:reward_id>', methods=['DELETE'])
-@require_business_owner
+@require_business
 def delete_reward(reward_id):
     print(f"Attempting to delete reward {reward_id}")
-    # Get the business owned by the authenticated user
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
-    if not business:
-        return jsonify({"error": "Business not found"}), 404
-
     # Find the reward and verify it belongs to this business
     reward = Reward.query.get(reward_id)
     if not reward:
         return jsonify({"error": "Reward not found"}), 404
         
-    if reward.business_id != business.id:
+    if reward.business_id != g.business_id:
         return jsonify({"error": "Unauthorized"}), 403
     
     db.session.delete(reward)
@@ -185,18 +208,14 @@ def delete_reward(reward_id):
     return '', 200
 
 @bp.route('/rewards/<int:reward_id>', methods=['PUT'])
-@require_business_owner
+@require_business
 def update_reward(reward_id):
     print(f"Updating reward {reward_id} for user_id: {g.user.id}")
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
-    if not business:
-        return jsonify({"error": "Business not found"}), 404
-
     reward = Reward.query.get(reward_id)
     if not reward:
         return jsonify({"error": "Reward not found"}), 404
         
-    if reward.business_id != business.id:
+    if reward.business_id != g.business_id:
         return jsonify({"error": "Unauthorized"}), 403
 
     request_data = UpdateRewardRequest.model_validate(request.get_json())
@@ -216,3 +235,6 @@ def update_reward(reward_id):
     db.session.commit()
     print(f"Successfully updated reward {reward_id}")
     return '', 200
+
+def _to_business_enrollment(enrollment: Enrollment) -> dict:
+    return {'enrollment': enrollment_encoder.encode(enrollment), 'user': user_encoder.encode(enrollment.user)}
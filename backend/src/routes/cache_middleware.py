@@ -0,0 +1,34 @@
+from functools import wraps
+from flask import current_app, g, make_response, request
+from src.services.response_cache import response_cache
+
+def cached_response(f):
+    """Serve successful GET responses from the response cache, with ETag/If-None-Match support.
+
+    The cache key is the endpoint, its query parameters and the authenticated user, so place
+    this decorator below the auth decorators. Streamed responses are passed through uncached.
+    Views whose body changes at a known time set `g.cache_expires_at` (naive UTC).
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user = g.get('user')
+        key = (
+            request.endpoint,
+            tuple(sorted(request.args.items(multi=True))),
+            tuple(sorted(kwargs.items())),
+            user.id if user else None,
+        )
+        version = response_cache.current_version()
+        entry = response_cache.get(key, version)
+        if entry is None:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = response_cache.put(key, version, response.get_data(), response.mimetype,
+                                       expires_at=g.pop('cache_expires_at', None))
+
+        response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return decorated
@@ -1,18 +1,26 @@
+from datetime import datetime
 from decimal import Decimal
 from flask import Blueprint, request, jsonify, g
+from pydantic import ValidationError
 from src.db.models import Enrollment, BusinessDetails, Reward
 from src.api_schemas import (
     AddPointsRequest,
+    BulkAddPointsRequest,
     RedeemRewardRequest,
-    BusinessDetailsModel,
-    GetUserEnrollmentsResponse,
-    EnrollmentModel,
     EnrollBusinessResponse,
     AddPointsResponse,
     RedeemRewardResponse
 )
 from src.db.connection import db
-from .auth_middleware import require_auth, require_business_owner
+from src.config import Config
+from src.db.queries import user_enrollments_with_businesses
+from src.serialization import business_details_encoder, enrollment_encoder, json_response, stream_json_array
+from src.services.points import points_service
+from src.services.recommendation_store import user_recommendations
+from src.services.reward_validity import is_active
+from src.services.similarity_index import co_enrollment_index
+from .auth_middleware import require_auth, require_business
+from .idempotency_middleware import commit_write, idempotent
 
 bp = Blueprint('enrollments', __name__, url_prefix='/enrollments')
 
@@ -20,30 +28,14 @@ bp = Blueprint('enrollments', __name__, url_prefix='/enrollments')
 @require_auth
 def get_user_enrollments():
     print(f'Fetching enrollments for user {g.user.id}')
-    enrollments = Enrollment.query.filter_by(user_id=g.user.id).all()
-    result = []
-    
-    for enrollment in enrollments:
-        response = GetUserEnrollmentsResponse(
-            business=BusinessDetailsModel(
-                id=enrollment.business.id,
-                business_name=enrollment.business.business_name,
-                description=enrollment.business.description,
-                email_address=enrollment.business.email_address,
-                address=enrollment.business.address,
-                phone_number=enrollment.business.phone_number
-            ),
-            enrollment=EnrollmentModel(
-                id=enrollment.id,
-                user_id=enrollment.user_id,
-                business_id=enrollment.business_id,
-                points=enrollment.points
-            ),
-        )
-        result.append(response.model_dump())
+    enrollments = user_enrollments_with_businesses(g.user.id)
+    if Config.STREAM_LIST_RESPONSES:
+        return stream_json_array(_to_user_enrollment(e) for e in enrollments.yield_per(Config.STREAM_BATCH_SIZE))
+    enrollments = enrollments.all()
+    result = [_to_user_enrollment(enrollment) for enrollment in enrollments]
     
     print(f'Found {len(enrollments)} enrollments')
-    return jsonify(result)
+    return json_response(result)
 
 @bp.route('/businesses/<uuid:business_id>', methods=['POST'])
 @require_auth
@@ -63,10 +55,13 @@ def enroll_to_business(business_id):
     enrollment = Enrollment(
         user_id=g.user.id,
         business_id=business_id,
-        points=Decimal(0.0)
+        points_snapshot=Decimal(0.0)
     )
     
     db.session.add(enrollment)
+    db.session.flush()
+    co_enrollment_index.record_enrollment(g.user.id, business_id)
+    user_recommendations.mark_stale(g.user.id)
     db.session.commit()
     
     response = EnrollBusinessResponse(message='Successfully enrolled')
@@ -81,80 +76,106 @@ def cancel_enrollment(business_id):
         business_id=business_id
     ).first_or_404()
     
+    co_enrollment_index.record_cancellation(g.user.id, business_id)
     db.session.delete(enrollment)
+    user_recommendations.mark_stale(g.user.id)
     db.session.commit()
     
     return '', 204
 
 @bp.route('/add_points', methods=['POST'])
-@require_business_owner
+@require_business
+@idempotent
 def add_points():
     request_data = AddPointsRequest.model_validate(request.get_json())
     print(f'Adding {request_data.points} points for user {request_data.user_id}')
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
     
-    if not business:
-        return jsonify({'error': 'Business details not found'}), 404
-    
-    enrollment = Enrollment.query.filter_by(
-        user_id=request_data.user_id,
-        business_id=business.id
-    ).first()
-    
-    if not enrollment:
+    balance = points_service.add_points(g.business_id, request_data.user_id, Decimal(request_data.points))
+    if balance is None:
         return jsonify({'error': 'Customer not enrolled'}), 404
-    
-    enrollment.points += Decimal(request_data.points)
-    db.session.commit()
+    commit_write()
     
     response = AddPointsResponse(
-        user_id=enrollment.user_id,
-        new_points_balance=float(enrollment.points)
+        user_id=request_data.user_id,
+        new_points_balance=float(balance)
     )
-    print(f'New points balance: {enrollment.points}')
+    print(f'New points balance: {balance}')
     return jsonify(response.model_dump())
 
+@bp.route('/add_points/bulk', methods=['POST'])
+@require_business
+def add_points_bulk():
+    try:
+        request_data = BulkAddPointsRequest.model_validate(request.get_json())
+    except ValidationError:
+        return jsonify({'error': 'Invalid bulk points request'}), 400
+    if len(request_data.items) > Config.BULK_ADD_POINTS_MAX_ITEMS:
+        return jsonify({'error': f'At most {Config.BULK_ADD_POINTS_MAX_ITEMS} items per request'}), 400
+    print(f'Adding points in bulk for {len(request_data.items)} items')
+    
+    balances = points_service.add_points_bulk(
+        g.business_id, ((item.user_id, item.points) for item in request_data.items)
+    )
+    db.session.commit()
+    
+    results = []
+    for item in request_data.items:
+        balance = balances.get(item.user_id)
+        if balance is None:
+            results.append({'user_id': str(item.user_id), 'status': 'not_enrolled', 'new_points_balance': None})
+        else:
+            results.append({'user_id': str(item.user_id), 'status': 'applied', 'new_points_balance': float(balance)})
+    print(f'Applied points for {len(balances)} customers')
+    return json_response({'results': results})
+
 @bp.route('/redeem_reward', methods=['POST'])
-@require_business_owner
+@require_business
+@idempotent
 def redeem_reward():
     request_data = RedeemRewardRequest.model_validate(request.get_json())
     print(f'Redeeming reward {request_data.reward_id} for user {request_data.user_id}')
-    business = BusinessDetails.query.filter_by(user_id=g.user.id).first()
     
-    if not business:
-        return jsonify({'error': 'Business details not found'}), 404
+    now = datetime.utcnow()
+    balance = points_service.redeem(g.business_id, request_data.user_id, request_data.reward_id, now)
+    if balance is None:
+        return _redeem_reward_error(request_data, now)
+    commit_write()
     
+    response = RedeemRewardResponse(
+        success=True,
+        new_points_balance=float(balance)
+    )
+    print(f'New points balance after redemption: {balance}')
+    return jsonify(response.model_dump())
+
+def _redeem_reward_error(request_data: RedeemRewardRequest, now: datetime):
+    """Explain why a redemption was refused. Only runs when it was, so successful redemptions need no reads."""
     reward = Reward.query.filter_by(
         id=request_data.reward_id,
-        business_id=business.id
+        business_id=g.business_id
     ).first()
     
     if not reward:
         return jsonify({'error': 'Reward not found'}), 404
+
+    if not is_active(reward, now):
+        print(f'Reward {reward.id} is outside its validity window')
+        return jsonify({'error': 'Reward is not active'}), 400
     
     enrollment = Enrollment.query.filter_by(
         user_id=request_data.user_id,
-        business_id=business.id
+        business_id=g.business_id
     ).first()
     
     if not enrollment:
         return jsonify({'error': 'Customer not enrolled'}), 404
     
-    if enrollment.points < reward.required_points:
-        print(f'Insufficient points: required={reward.required_points}, current={enrollment.points}')
-        return jsonify({
-            'error': 'Insufficient points',
-            'required': float(reward.required_points),
-            'current': float(enrollment.points)
-        }), 400
-    
-    enrollment.points -= reward.required_points
-    reward.usage_count += 1
-    db.session.commit()
-    
-    response = RedeemRewardResponse(
-        success=True,
-        new_points_balance=float(enrollment.points)
-    )
-    print(f'New points balance after redemption: {enrollment.points}')
-    return jsonify(response.model_dump())
+    print(f'Insufficient points: required={reward.required_points}, current={enrollment.points}')
+    return jsonify({
+        'error': 'Insufficient points',
+        'required': float(reward.required_points),
+        'current': float(enrollment.points)
+    }), 400
+
+def _to_user_enrollment(enrollment: Enrollment) -> dict:
+    return {'business': business_details_encoder.encode(enrollment.business), 'enrollment': enrollment_encoder.encode(enrollment)}
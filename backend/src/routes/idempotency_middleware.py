@@ -0,0 +1,56 @@
+from functools import wraps
+import hashlib
+from flask import current_app, g, jsonify, make_response, request
+from src.db.connection import db
+from src.services.idempotency import MAX_KEY_LENGTH, idempotency_store
+
+def commit_write() -> None:
+    """Commit the view's write, unless it runs under @idempotent, which commits it together
+    with the stored response."""
+    if g.get('idempotency_key_claimed'):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+def idempotent(f):
+    """Replay the first response of a write retried with the same Idempotency-Key header.
+
+    Keys are scoped to the business, so place this decorator below require_business. Views
+    commit through commit_write(), so that the write, the claimed key and the response
+    commit at once: a request that fails before that leaves nothing behind and can be
+    retried. 5xx responses are not stored either. Replays carry an
+    `Idempotent-Replayed: true` header.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return f(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Invalid Idempotency-Key'}), 400
+        request_hash = hashlib.sha256(request.path.encode() + b'\n' + request.get_data()).hexdigest()
+
+        entry = idempotency_store.get(g.business_id, key)
+        if entry is None:
+            if idempotency_store.claim(g.business_id, key, request_hash):
+                g.idempotency_key_claimed = True
+                response = make_response(f(*args, **kwargs))
+                if response.status_code >= 500:
+                    db.session.rollback()
+                    return response
+                idempotency_store.save(g.business_id, key, response)
+                db.session.commit()
+                return response
+            # A request with the same key committed while this one waited for it
+            db.session.rollback()
+            entry = idempotency_store.get(g.business_id, key)
+
+        if entry is not None and entry.request_hash != request_hash:
+            return jsonify({'error': 'Idempotency-Key was used for a different request'}), 422
+        if entry is None or entry.status_code is None:
+            return jsonify({'error': 'A request with this Idempotency-Key is in progress'}), 409
+        print(f'Replaying response for Idempotency-Key {key}')
+        response = current_app.response_class(entry.body, status=entry.status_code, mimetype=entry.mimetype)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    return decorated
@@ -0,0 +1,164 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type, Union, get_args, get_origin
+from uuid import UUID
+from datetime import datetime
+from decimal import Decimal
+from operator import attrgetter, itemgetter
+import codecs
+from flask import Response, current_app, stream_with_context
+from pydantic import BaseModel, TypeAdapter
+from werkzeug.http import http_date
+from src.api_schemas import BusinessDetailsModel, EnrollmentModel, RewardModel, UserModel
+from src.db.models import BusinessDetails, Reward
+
+# Fast path for responses built from trusted ORM rows. Rows are mapped straight to dicts
+# shaped like the response models' model_dump(), without validation, and pydantic-core
+# encodes them to bytes. The output is byte-identical to jsonify() with Flask's default
+# JSON provider, as long as composite dicts are written with their keys in sorted order.
+
+_json_adapter = TypeAdapter(Any)
+
+
+def _to_http_date(value: datetime) -> str:
+    """Flask's default JSON provider renders datetimes as HTTP dates."""
+    return http_date(value)
+
+
+# Flask renders these with str() and HTTP dates. Converting them up front also keeps
+# pydantic-core on its fast path for plain strings.
+_CONVERTERS_BY_TYPE = ((UUID, str), (Decimal, str), (datetime, _to_http_date))
+
+
+def _converter_for(annotation: Any) -> Optional[Callable[[Any], Any]]:
+    if get_origin(annotation) is Union:
+        annotation = next((arg for arg in get_args(annotation) if arg is not type(None)), None)
+    if not isinstance(annotation, type):
+        return None
+    return next((converter for kind, converter in _CONVERTERS_BY_TYPE if issubclass(annotation, kind)), None)
+
+
+class ModelEncoder:
+    """Maps objects to dicts with the fields of `model`, in sorted key order.
+
+    UUID, Decimal and datetime fields are converted the way jsonify() renders them, and
+    `blank_fields` are always None.
+    """
+
+    def __init__(self, model: Type[BaseModel], blank_fields: Iterable[str] = ()):
+        blank_fields = set(blank_fields)
+        self.fields = tuple(sorted(model.model_fields))
+        self._read_fields = tuple(name for name in self.fields if name not in blank_fields)
+        self._item_getter = itemgetter(*self._read_fields)
+        self._attr_getter = attrgetter(*self._read_fields)
+        self._converters = tuple(
+            (name, converter) for name in self._read_fields
+            if (converter := _converter_for(model.model_fields[name].annotation)) is not None
+        )
+
+    def encode(self, obj: Any) -> Dict[str, Any]:
+        try:
+            # Loaded ORM columns live in the instance dict; reading them there skips the
+            # instrumented attribute descriptors
+            values = self._item_getter(obj.__dict__)
+        except KeyError:
+            values = self._attr_getter(obj)
+        if len(self._read_fields) == 1:
+            values = (values,)
+        # Updating a dict pre-filled with None keeps the sorted key order
+        row = dict.fromkeys(self.fields)
+        row.update(zip(self._read_fields, values))
+        for name, converter in self._converters:
+            value = row[name]
+            if value is not None:
+                row[name] = converter(value)
+        return row
+
+
+def _escape_non_ascii(error: UnicodeEncodeError):
+    """Codec error handler that escapes like json.dumps(ensure_ascii=True)."""
+    escaped = []
+    for char in error.object[error.start:error.end]:
+        code = ord(char)
+        if code < 0x10000:
+            escaped.append(f'\\u{code:04x}')
+        else:
+            code -= 0x10000
+            escaped.append(f'\\u{0xd800 | (code >> 10):04x}\\u{0xdc00 | (code & 0x3ff):04x}')
+    return ''.join(escaped), error.end
+
+
+codecs.register_error('json_ascii_escape', _escape_non_ascii)
+
+
+def _is_pretty() -> bool:
+    json_provider = current_app.json
+    return (json_provider.compact is None and current_app.debug) or json_provider.compact is False
+
+
+def _encode(data: Any, pretty: bool) -> bytes:
+    body = _json_adapter.dump_json(data, indent=2 if pretty else None)
+    if getattr(current_app.json, 'ensure_ascii', True) and not body.isascii():
+        body = body.decode().encode('ascii', 'json_ascii_escape')
+    return body
+
+
+def dumps(data: Any) -> bytes:
+    """Encode JSON-ready data to the exact bytes jsonify() would produce."""
+    return _encode(data, _is_pretty()) + b'\n'
+
+
+def json_response(data: Any) -> Response:
+    """Drop-in replacement for jsonify() on data built with the encoders below."""
+    return current_app.response_class(dumps(data), mimetype=current_app.json.mimetype)
+
+
+def stream_json_array(items: Iterable[Any], chunk_size: int = 65536) -> Response:
+    """Stream a JSON array from an iterator, sending the bytes json_response(list(items)) would.
+
+    Only one chunk of encoded items is held at a time. Iteration happens after the view
+    returns, inside the request context, so `items` may read from a server-side cursor.
+    """
+    pretty = _is_pretty()
+    separator, indent, closing = (b',\n  ', b'\n  ', b'\n]\n') if pretty else (b',', b'', b']\n')
+
+    def generate():
+        buffer = bytearray(b'[')
+        empty = True
+        for item in items:
+            buffer += indent if empty else separator
+            body = _encode(item, pretty)
+            buffer += body.replace(b'\n', b'\n  ') if pretty else body
+            empty = False
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b']\n' if empty else closing
+        yield bytes(buffer)
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=current_app.json.mimetype)
+
+
+business_details_encoder = ModelEncoder(BusinessDetailsModel)
+reward_encoder = ModelEncoder(RewardModel)
+# Listings that never exposed the validity window keep rendering it as null
+reward_summary_encoder = ModelEncoder(RewardModel, blank_fields=('valid_from_timestamp', 'valid_until_timestamp'))
+user_encoder = ModelEncoder(UserModel, blank_fields=('recommendations',))
+enrollment_encoder = ModelEncoder(EnrollmentModel)
+
+
+def encode_business_listing(businesses: List[BusinessDetails],
+                            similar_by_business: Dict[UUID, List[BusinessDetails]],
+                            rewards_by_business: Optional[Dict[UUID, List[Reward]]] = None) -> List[Dict[str, Any]]:
+    """Body of the unpaginated GET /businesses: every business with its rewards and similar businesses.
+
+    `rewards_by_business` overrides the rewards listed for each business, e.g. to leave out inactive ones.
+    """
+    details_by_id = {business.id: business_details_encoder.encode(business) for business in businesses}
+    return [
+        {
+            'details': details_by_id[business.id],
+            'rewards': [reward_summary_encoder.encode(reward) for reward in
+                        (business.rewards if rewards_by_business is None else rewards_by_business[business.id])],
+            'similar_businesses': [details_by_id[b.id] for b in similar_by_business[business.id]],
+        }
+        for business in businesses
+    ]
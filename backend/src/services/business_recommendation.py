@@ -1,10 +1,25 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 from collections import Counter
-from src.db.models import BusinessDetails
+from datetime import datetime
+from uuid import UUID
+from src.db.models import BusinessDetails, Reward
+from src.db.queries import businesses_with_rewards, user_enrollments_with_businesses
 from src.api_schemas import BusinessRecommendation, RewardModel
+from src.services.reward_validity import active_rewards
 import random
 
 class BusinessRecommendationService:
+    # Whether get_recommendations() needs every business, with its rewards, passed in
+    needs_catalog = True
+
+    def get_recommendations_for_user(self, user_id: UUID) -> Optional[List[BusinessRecommendation]]:
+        """Get recommendations for a user from their enrollments. None if they have no enrollments."""
+        user_businesses = [enrollment.business for enrollment in user_enrollments_with_businesses(user_id)]
+        if not user_businesses:
+            return None
+        all_businesses = businesses_with_rewards(unexpired_at=datetime.utcnow()).all() if self.needs_catalog else None
+        return self.get_recommendations(user_businesses, all_businesses)
+
     def get_recommendations(self, user_businesses: List[BusinessDetails], all_businesses: List[BusinessDetails]) -> List[BusinessRecommendation]:
         """Get top 3 business recommendations based on user's most frequented categories."""
         if not user_businesses or not all_businesses:
@@ -16,9 +31,10 @@ class BusinessRecommendationService:
         if not available_businesses:
             return []
 
+        now = datetime.utcnow()
         top_categories = self._get_top_user_categories(user_businesses)
-        businesses_by_category = self._group_businesses_by_category(available_businesses)
-        return self._generate_recommendations(top_categories, businesses_by_category)
+        businesses_by_category = self._group_businesses_by_category(available_businesses, now)
+        return self._generate_recommendations(top_categories, businesses_by_category, now)
 
     def _get_top_user_categories(self, user_businesses: List[BusinessDetails], max_categories: int = 3) -> List[str]:
         """Find the most frequent categories in user's business history."""
@@ -29,11 +45,11 @@ class BusinessRecommendationService:
         category_counts = Counter(categories)
         return [cat for cat, _ in category_counts.most_common(max_categories)]
 
-    def _group_businesses_by_category(self, businesses: List[BusinessDetails]) -> Dict[str, List[BusinessDetails]]:
-        """Group businesses by their category (description)."""
+    def _group_businesses_by_category(self, businesses: List[BusinessDetails], now: datetime) -> Dict[str, List[BusinessDetails]]:
+        """Group businesses with rewards active at `now` by their category (description)."""
         categorized = {}
         for business in businesses:
-            if not business.description or not business.rewards:
+            if not business.description or not active_rewards(business.rewards, now):
                 continue
                 
             if business.description not in categorized:
@@ -42,12 +58,13 @@ class BusinessRecommendationService:
         return categorized
 
     def _generate_recommendations(self, top_categories: List[str], 
-                                businesses_by_category: Dict[str, List[BusinessDetails]]) -> List[BusinessRecommendation]:
+                                businesses_by_category: Dict[str, List[BusinessDetails]],
+                                now: datetime) -> List[BusinessRecommendation]:
         """Generate recommendations for each category."""
         recommendations = []
         for category in top_categories:
             if category in businesses_by_category:
-                recommendation = self._get_random_recommendation(businesses_by_category[category])
+                recommendation = self._get_random_recommendation(businesses_by_category[category], now)
                 if recommendation:
                     recommendations.append(recommendation)
                     if len(recommendations) >= 3:
@@ -55,25 +72,43 @@ class BusinessRecommendationService:
                         
         return recommendations
 
-    def _get_random_recommendation(self, businesses: List[BusinessDetails]) -> BusinessRecommendation | None:
-        """Get a random business and reward from a list of businesses."""
+    def _get_random_recommendation(self, businesses: List[BusinessDetails], now: datetime) -> BusinessRecommendation | None:
+        """Get a random business and reward active at `now` from a list of businesses."""
         businesses_to_try = random.sample(businesses, len(businesses))
         
         for business in businesses_to_try:
-            if business.rewards:
-                reward = random.choice(business.rewards)
-                reward_model = RewardModel(
-                    id=reward.id,
-                    name=reward.name,
-                    business_id=reward.business_id,
-                    usage_count=reward.usage_count,
-                    description=reward.description,
-                    required_points=reward.required_points,
-                    valid_from_timestamp=reward.valid_from_timestamp,
-                    valid_until_timestamp=reward.valid_until_timestamp
-                )
-                return BusinessRecommendation(
-                    business_name=business.business_name,
-                    reward=reward_model
-                )
-        return None 
\ No newline at end of file
+            rewards = active_rewards(business.rewards, now)
+            if rewards:
+                return to_recommendation(business.business_name, random.choice(rewards))
+        return None
+
+
+def to_recommendation(business_name: str, reward: Reward) -> BusinessRecommendation:
+    """Recommendation of `reward`, which may be any object with the Reward columns as attributes."""
+    reward_model = RewardModel(
+        id=reward.id,
+        name=reward.name,
+        business_id=reward.business_id,
+        usage_count=reward.usage_count,
+        description=reward.description,
+        required_points=reward.required_points,
+        valid_from_timestamp=reward.valid_from_timestamp,
+        valid_until_timestamp=reward.valid_until_timestamp
+    )
+    return BusinessRecommendation(
+        business_name=business_name,
+        reward=reward_model
+    )
+
+
+def create_recommendation_service(backend: str = 'python') -> BusinessRecommendationService:
+    """Create the recommendation service for the configured backend ('python', 'index' or 'sql')."""
+    if backend == 'python':
+        return BusinessRecommendationService()
+    if backend == 'index':
+        from src.services.recommendation_index import IndexedBusinessRecommendationService
+        return IndexedBusinessRecommendationService()
+    if backend == 'sql':
+        from src.services.business_recommendation_sql import SqlBusinessRecommendationService
+        return SqlBusinessRecommendationService()
+    raise ValueError(f"Unknown recommendation backend: {backend}") 
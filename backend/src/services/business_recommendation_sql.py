@@ -0,0 +1,87 @@
+from typing import List
+from datetime import datetime
+from uuid import UUID
+from sqlalchemy import text
+from src.db.connection import db
+from src.api_schemas import BusinessRecommendation
+from src.services.business_recommendation import BusinessRecommendationService, to_recommendation
+
+# First row at or after a random pivot in index order, wrapping around to the start of the
+# index when the pivot is past the last match. UUIDv4 keys are uniformly spread, so this
+# samples (nearly) uniformly with one short index scan instead of ORDER BY random().
+_RANDOM_ROW = """
+    SELECT candidate.* FROM (
+        (SELECT {columns}, 0 AS wrapped FROM {table} WHERE {condition} AND {key} >= {pivot} ORDER BY {key} LIMIT 1)
+        UNION ALL
+        (SELECT {columns}, 1 AS wrapped FROM {table} WHERE {condition} AND {key} < {pivot} ORDER BY {key} LIMIT 1)
+    ) candidate
+    ORDER BY candidate.wrapped
+    LIMIT 1
+"""
+
+# Rewards active at :now; the unexpired half is served by the partial indexes on reward
+_ACTIVE_REWARD = """{alias}.valid_from_timestamp <= :now
+        AND ({alias}.valid_until_timestamp IS NULL OR {alias}.valid_until_timestamp > :now)"""
+
+_RANDOM_BUSINESS = _RANDOM_ROW.format(
+    columns='b.id, b.business_name',
+    table='business_detail b',
+    # Uses ix_business_detail_description_id, the partial reward indexes and ix_enrollment_user_id_business_id
+    condition=f"""b.description = top_categories.category
+        AND EXISTS (SELECT 1 FROM reward WHERE reward.business_id = b.id AND {_ACTIVE_REWARD.format(alias='reward')})
+        AND NOT EXISTS (SELECT 1 FROM enrollment WHERE enrollment.user_id = :user_id AND enrollment.business_id = b.id)""",
+    key='b.id',
+    pivot='top_categories.business_pivot',
+)
+
+_RANDOM_REWARD = _RANDOM_ROW.format(
+    columns='r.id, r.name, r.business_id, r.description, r.required_points, '
+            'r.valid_from_timestamp, r.valid_until_timestamp, '
+            # Same as the Reward.usage_count property
+            'r.usage_count_base + coalesce((SELECT sum(s.count) FROM reward_usage_slot s '
+            'WHERE s.reward_id = r.id), 0) AS usage_count',
+    table='reward r',
+    condition=f"r.business_id = business.id AND {_ACTIVE_REWARD.format(alias='r')}",
+    key='r.id',
+    pivot='top_categories.reward_pivot',
+)
+
+_RECOMMENDATIONS = text(f"""
+    WITH top_categories AS (
+        SELECT b.description AS category, count(*) AS enrollment_count,
+               gen_random_uuid() AS business_pivot, gen_random_uuid() AS reward_pivot
+        FROM enrollment e
+        JOIN business_detail b ON b.id = e.business_id
+        WHERE e.user_id = :user_id AND b.description <> ''
+        GROUP BY b.description
+        ORDER BY count(*) DESC, b.description
+        LIMIT :max_categories
+    )
+    SELECT business.business_name, reward.*
+    FROM top_categories
+    CROSS JOIN LATERAL ({_RANDOM_BUSINESS}) business
+    CROSS JOIN LATERAL ({_RANDOM_REWARD}) reward
+    ORDER BY top_categories.enrollment_count DESC, top_categories.category
+""")
+
+
+class SqlBusinessRecommendationService(BusinessRecommendationService):
+    """Recommendations computed inside PostgreSQL.
+
+    The user's top categories come from a GROUP BY over their enrollments, and the
+    business and active reward of each category are sampled through indexes, so only the
+    (at most three) recommendations are sent back instead of the catalog. Unlike the
+    other backends, users without enrollments get an empty list rather than None.
+    """
+
+    def __init__(self, max_categories: int = 3):
+        self.max_categories = max_categories
+
+    def get_recommendations_for_user(self, user_id: UUID) -> List[BusinessRecommendation]:
+        """Get top 3 business recommendations for a user, in a single query over their enrollments."""
+        rows = db.session.execute(_RECOMMENDATIONS, {
+            'user_id': user_id,
+            'max_categories': self.max_categories,
+            'now': datetime.utcnow(),
+        })
+        return [to_recommendation(row.business_name, row) for row in rows]
@@ -1,14 +1,32 @@
 from typing import List, Dict, Set, Tuple
+from collections import defaultdict
 from uuid import UUID
+import heapq
+from sqlalchemy import and_, distinct, func, select
+from sqlalchemy.orm import aliased
+from src.config import Config
+from src.db.connection import db
 from src.db.models import BusinessDetails, Enrollment
 
+def build_enrollment_sets(businesses: List[BusinessDetails], enrollments: List[Enrollment]) -> Dict[UUID, Set[UUID]]:
+    """Create a mapping of business IDs to their enrolled user IDs."""
+    business_enrollments: Dict[UUID, Set[UUID]] = {
+        business.id: set() for business in businesses
+    }
+
+    for enrollment in enrollments:
+        if enrollment.business_id in business_enrollments:
+            business_enrollments[enrollment.business_id].add(enrollment.user_id)
+
+    return business_enrollments
+
 class BusinessSimilarityService:
     def __init__(self, max_similar: int = 3):
         self.max_similar = max_similar
 
     def get_similar_businesses(self, target_business_id: UUID, businesses: List[BusinessDetails], enrollments: List[Enrollment]) -> List[BusinessDetails]:
         """Find similar businesses based on user enrollment overlap."""
-        business_enrollments = self._build_enrollment_sets(businesses, enrollments)
+        business_enrollments = build_enrollment_sets(businesses, enrollments)
         
         if not self._has_valid_enrollments(target_business_id, businesses, business_enrollments):
             return []
@@ -16,17 +34,104 @@ class BusinessSimilarityService:
         similarities = self._calculate_similarities(target_business_id, businesses, business_enrollments)
         return self._get_top_similar(similarities)
 
-    def _build_enrollment_sets(self, businesses: List[BusinessDetails], enrollments: List[Enrollment]) -> Dict[UUID, Set[UUID]]:
-        """Create a mapping of business IDs to their enrolled user IDs."""
-        business_enrollments: Dict[UUID, Set[UUID]] = {
-            business.id: set() for business in businesses
-        }
-        
-        for enrollment in enrollments:
-            if enrollment.business_id in business_enrollments:
-                business_enrollments[enrollment.business_id].add(enrollment.user_id)
-                
-        return business_enrollments
+    def get_all_similar_businesses(self, businesses: List[BusinessDetails], enrollments: List[Enrollment]) -> Dict[UUID, List[BusinessDetails]]:
+        """Find similar businesses for every business in a single pass over the enrollments.
+
+        Returns the same result as calling get_similar_businesses for each business.
+        """
+        business_enrollments = build_enrollment_sets(businesses, enrollments)
+        intersections = self._count_intersections(business_enrollments)
+        sizes = {business_id: len(users) for business_id, users in business_enrollments.items()}
+        positions = {business.id: position for position, business in enumerate(businesses)}
+
+        similar_businesses = {}
+        for business in businesses:
+            if not self._has_valid_enrollments(business.id, businesses, business_enrollments):
+                similar_businesses[business.id] = []
+                continue
+            similar_businesses[business.id] = self._get_top_similar_from_intersections(
+                business.id, businesses, positions, sizes, intersections.get(business.id, {})
+            )
+        return similar_businesses
+
+    def get_similar_for(self, business_ids: List[UUID]) -> Dict[UUID, List[BusinessDetails]]:
+        """Find similar businesses for a few businesses, e.g. a page of the catalog.
+
+        Returns what get_all_similar_businesses returns for them over the whole catalog in id
+        order, but only reads the enrollments of businesses sharing users with them.
+        """
+        sizes, intersections = self._load_intersections_for(business_ids)
+        return self._get_top_similar_by_id(business_ids, sizes, intersections)
+
+    def _load_intersections_for(self, business_ids: List[UUID]) -> Tuple[Dict[UUID, int], Dict[UUID, Dict[UUID, int]]]:
+        """Member counts, and the shared user counts of `business_ids` with every other business."""
+        members, others = aliased(Enrollment), aliased(Enrollment)
+        intersections: Dict[UUID, Dict[UUID, int]] = defaultdict(dict)
+        for business_id, other_business_id, shared_count in db.session.execute(
+            select(members.business_id, others.business_id, func.count(distinct(members.user_id)))
+            .join(others, and_(others.user_id == members.user_id, others.business_id != members.business_id))
+            .where(members.business_id.in_(business_ids))
+            .group_by(members.business_id, others.business_id)
+        ):
+            intersections[business_id][other_business_id] = shared_count
+        counted = set(business_ids).union(*(target.keys() for target in intersections.values()))
+        sizes = dict(db.session.execute(
+            select(Enrollment.business_id, func.count(distinct(Enrollment.user_id)))
+            .where(Enrollment.business_id.in_(counted))
+            .group_by(Enrollment.business_id)
+        ).all())
+        return sizes, intersections
+
+    def _get_top_similar_by_id(self, business_ids: List[UUID], sizes: Dict[UUID, int],
+                               intersections: Dict[UUID, Dict[UUID, int]]) -> Dict[UUID, List[BusinessDetails]]:
+        """Like _get_top_similar_from_intersections over the catalog in id order, loading only the businesses returned."""
+        top_ids = {}
+        for business_id in business_ids:
+            target_size = sizes.get(business_id)
+            if not target_size:
+                top_ids[business_id] = []
+                continue
+            scored = [
+                (-intersection / (target_size + sizes[other_id] - intersection), other_id)
+                for other_id, intersection in intersections.get(business_id, {}).items()
+            ]
+            top_ids[business_id] = [other_id for _, other_id in heapq.nsmallest(self.max_similar, scored)]
+
+        # Businesses without shared users fill the remaining slots in id order. Only businesses
+        # with fewer than max_similar neighbours need them, so the first 2 * max_similar do.
+        fill_ids = []
+        if any(sizes.get(business_id) and len(ids) < self.max_similar for business_id, ids in top_ids.items()):
+            fill_ids = db.session.execute(
+                select(BusinessDetails.id).order_by(BusinessDetails.id).limit(2 * self.max_similar)
+            ).scalars().all()
+        for business_id, ids in top_ids.items():
+            if not sizes.get(business_id):
+                continue
+            for fill_id in fill_ids:
+                if len(ids) >= self.max_similar:
+                    break
+                if fill_id != business_id and fill_id not in intersections.get(business_id, {}):
+                    ids.append(fill_id)
+
+        loaded_ids = {other_id for ids in top_ids.values() for other_id in ids}
+        loaded = {business.id: business for business in
+                  BusinessDetails.query.filter(BusinessDetails.id.in_(loaded_ids))} if loaded_ids else {}
+        return {business_id: [loaded[other_id] for other_id in ids] for business_id, ids in top_ids.items()}
+
+    def _count_intersections(self, business_enrollments: Dict[UUID, Set[UUID]]) -> Dict[UUID, Dict[UUID, int]]:
+        """Count shared users for every pair of businesses, in one pass over the users."""
+        user_businesses: Dict[UUID, List[UUID]] = defaultdict(list)
+        for business_id, users in business_enrollments.items():
+            for user_id in users:
+                user_businesses[user_id].append(business_id)
+
+        intersections: Dict[UUID, Dict[UUID, int]] = defaultdict(lambda: defaultdict(int))
+        for business_ids in user_businesses.values():
+            for i, business_id in enumerate(business_ids):
+                for other_id in business_ids[i + 1:]:
+                    intersections[business_id][other_id] += 1
+                    intersections[other_id][business_id] += 1
+        return intersections
 
     def _has_valid_enrollments(self, target_business_id: UUID, businesses: List[BusinessDetails], 
                              business_enrollments: Dict[UUID, Set[UUID]]) -> bool:
@@ -62,4 +167,47 @@ class BusinessSimilarityService:
     def _get_top_similar(self, similarities: List[Tuple[float, BusinessDetails]]) -> List[BusinessDetails]:
         """Get top N most similar businesses."""
         similarities.sort(key=lambda x: x[0], reverse=True)
-        return [business for _, business in similarities[:self.max_similar]] 
\ No newline at end of file
+        return [business for _, business in similarities[:self.max_similar]] 
+
+    def _get_top_similar_from_intersections(self, target_business_id: UUID, businesses: List[BusinessDetails],
+                                            positions: Dict[UUID, int], sizes: Dict[UUID, int],
+                                            target_intersections: Dict[UUID, int]) -> List[BusinessDetails]:
+        """Get top N most similar businesses from precomputed intersection counts.
+
+        Ties keep the order of `businesses` and businesses without shared users fill the
+        remaining slots with a similarity of 0, exactly like _get_top_similar.
+        """
+        target_size = sizes[target_business_id]
+        scored = []
+        for business_id, intersection in target_intersections.items():
+            if business_id not in positions:
+                continue
+            similarity = intersection / (target_size + sizes[business_id] - intersection)
+            scored.append((-similarity, positions[business_id]))
+
+        top = [businesses[position] for _, position in heapq.nsmallest(self.max_similar, scored)]
+        for business in businesses:
+            if len(top) >= self.max_similar:
+                break
+            if business.id != target_business_id and business.id not in target_intersections:
+                top.append(business)
+        return top
+
+
+def create_similarity_service(backend: str = 'python', max_similar: int = 3) -> BusinessSimilarityService:
+    """Create the similarity service for the configured backend ('python', 'numpy', 'index', 'minhash' or 'sql')."""
+    if backend == 'python':
+        return BusinessSimilarityService(max_similar)
+    if backend == 'numpy':
+        from src.services.business_similarity_numpy import NumpyBusinessSimilarityService
+        return NumpyBusinessSimilarityService(max_similar)
+    if backend == 'index':
+        from src.services.similarity_index import IndexedBusinessSimilarityService
+        return IndexedBusinessSimilarityService(max_similar)
+    if backend == 'minhash':
+        from src.services.business_similarity_minhash import MinHashBusinessSimilarityService
+        return MinHashBusinessSimilarityService(max_similar, Config.MINHASH_PERMUTATIONS, Config.MINHASH_BANDS)
+    if backend == 'sql':
+        from src.services.business_similarity_sql import SqlBusinessSimilarityService
+        return SqlBusinessSimilarityService(max_similar)
+    raise ValueError(f"Unknown similarity backend: {backend}")
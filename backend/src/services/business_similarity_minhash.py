@@ -0,0 +1,121 @@
+from typing import Dict, Iterable, List, Tuple
+from uuid import UUID
+import numpy as np
+from scipy import sparse
+from src.db.models import BusinessDetails, Enrollment
+from src.services.business_similarity_numpy import NumpyBusinessSimilarityService
+
+# Mersenne prime 2^31 - 1 keeps (a * x + b) inside uint64 for 31-bit a, b and x
+_HASH_PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHashBusinessSimilarityService(NumpyBusinessSimilarityService):
+    """Approximate similarity for large catalogs.
+
+    Every business gets a fixed-size MinHash signature of its enrolled users. LSH banding
+    buckets businesses whose signatures agree on a whole band, and exact Jaccard is only
+    computed for pairs of businesses that share at least one bucket.
+    """
+
+    def __init__(self, max_similar: int = 3, num_permutations: int = 128, num_bands: int = 64, seed: int = 42,
+                 chunk_size: int = 16384):
+        super().__init__(max_similar)
+        if num_permutations % num_bands != 0:
+            raise ValueError("num_permutations must be a multiple of num_bands")
+        self.num_permutations = num_permutations
+        self.num_bands = num_bands
+        self.chunk_size = chunk_size
+        rng = np.random.default_rng(seed)
+        self._hash_a = rng.integers(1, int(_HASH_PRIME), size=(num_permutations, 1), dtype=np.uint64)
+        self._hash_b = rng.integers(0, int(_HASH_PRIME), size=(num_permutations, 1), dtype=np.uint64)
+        # Odd multipliers fold the rows of a band into one 64-bit bucket key
+        self._band_multipliers = rng.integers(1, 1 << 63, size=num_permutations // num_bands, dtype=np.uint64) | np.uint64(1)
+
+    def get_similar_businesses(self, target_business_id: UUID, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment]) -> List[BusinessDetails]:
+        """Find approximately most similar businesses for one business."""
+        return self.get_all_similar_businesses(businesses, enrollments).get(target_business_id, [])
+
+    def get_all_similar_businesses(self, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment]) -> Dict[UUID, List[BusinessDetails]]:
+        """Find approximately most similar businesses for every business."""
+        positions = {business.id: position for position, business in enumerate(businesses)}
+        incidence = self._build_incidence_matrix(positions, enrollments)
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+        signatures = self._build_signatures(incidence, sizes)
+        first, second = self._find_candidate_pairs(signatures, sizes)
+
+        intersections = np.asarray(incidence[first].multiply(incidence[second]).sum(axis=1)).ravel()
+        overlapping = intersections > 0
+        first, second, intersections = first[overlapping], second[overlapping], intersections[overlapping]
+        similarities = intersections / (sizes[first] + sizes[second] - intersections)
+
+        # Every pair ranks in both directions
+        targets = np.concatenate([first, second])
+        neighbours = np.concatenate([second, first])
+        similarities = np.concatenate([similarities, similarities])
+        order = np.lexsort((neighbours, -similarities, targets))
+        targets, neighbours = targets[order], neighbours[order]
+        group_starts = np.searchsorted(targets, np.arange(len(businesses)))
+        group_ends = np.searchsorted(targets, np.arange(len(businesses)), side='right')
+
+        similar_businesses = {}
+        for row, business in enumerate(businesses):
+            if len(businesses) <= 1 or sizes[row] == 0:
+                similar_businesses[business.id] = []
+                continue
+            ranked = neighbours[group_starts[row]:group_ends[row]].tolist()
+            similar_businesses[business.id] = self._fill_top_similar(row, businesses, ranked)
+        return similar_businesses
+
+    def _build_signatures(self, incidence: sparse.csr_matrix, sizes: np.ndarray) -> np.ndarray:
+        """Compute a (businesses x num_permutations) matrix of MinHash values over dense user ids."""
+        signatures = np.zeros((incidence.shape[0], self.num_permutations), dtype=np.uint64)
+        nonempty_rows = np.flatnonzero(sizes > 0)
+        indptr = incidence.indptr
+        users = incidence.indices.astype(np.uint64)
+
+        start = 0
+        while start < len(nonempty_rows):
+            # Take whole businesses until the chunk holds about chunk_size enrollments
+            base = indptr[nonempty_rows[start]]
+            end = max(start + 1, int(np.searchsorted(indptr[nonempty_rows + 1], base + self.chunk_size, side='right')))
+            rows = nonempty_rows[start:end]
+            segment_starts = indptr[rows] - base
+            chunk_users = users[base:indptr[rows[-1] + 1]]
+            hashes = (self._hash_a * chunk_users + self._hash_b) % _HASH_PRIME
+            signatures[rows] = np.minimum.reduceat(hashes, segment_starts, axis=1).T
+            start = end
+        return signatures
+
+    def _find_candidate_pairs(self, signatures: np.ndarray, sizes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (first, second) position arrays of businesses sharing at least one band bucket."""
+        rows_per_band = self.num_permutations // self.num_bands
+        nonempty_rows = np.flatnonzero(sizes > 0)
+        business_count = np.int64(signatures.shape[0])
+        pair_codes = [np.empty(0, dtype=np.int64)]
+
+        for band in range(self.num_bands):
+            band_signatures = signatures[nonempty_rows, band * rows_per_band:(band + 1) * rows_per_band]
+            keys = band_signatures @ self._band_multipliers
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            bucket_starts = np.concatenate([[0], np.flatnonzero(np.diff(sorted_keys)) + 1])
+            bucket_ends = np.concatenate([bucket_starts[1:], [len(sorted_keys)]])
+            for bucket_start, bucket_end in zip(bucket_starts[bucket_ends - bucket_starts > 1], bucket_ends[bucket_ends - bucket_starts > 1]):
+                members = np.sort(nonempty_rows[order[bucket_start:bucket_end]])
+                first, second = np.triu_indices(len(members), 1)
+                pair_codes.append(members[first] * business_count + members[second])
+
+        candidates = np.unique(np.concatenate(pair_codes))
+        return candidates // business_count, candidates % business_count
+
+    def _fill_top_similar(self, row: int, businesses: List[BusinessDetails], ranked: List[int]) -> List[BusinessDetails]:
+        """Take the best ranked candidates and fill remaining slots like the exact service."""
+        top_positions = ranked[:self.max_similar]
+        top = [businesses[position] for position in top_positions]
+        ranked_positions = set(ranked)
+        for position, business in enumerate(businesses):
+            if len(top) >= self.max_similar:
+                break
+            if position != row and position not in ranked_positions:
+                top.append(business)
+        return top
@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, List, Sequence
+from uuid import UUID
+import numpy as np
+from scipy import sparse
+from src.db.models import BusinessDetails, Enrollment
+from src.services.business_similarity import BusinessSimilarityService
+
+class NumpyBusinessSimilarityService(BusinessSimilarityService):
+    """Jaccard similarity computed with sparse matrix operations.
+
+    Businesses and users are mapped to dense integer ids and enrollments are held as a
+    sparse business x user incidence matrix, so intersections for all pairs come from a
+    single matrix product instead of Python set operations.
+    """
+
+    def __init__(self, max_similar: int = 3, block_size: int = 1024):
+        super().__init__(max_similar)
+        self.block_size = block_size
+
+    def get_similar_businesses(self, target_business_id: UUID, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment]) -> List[BusinessDetails]:
+        """Find similar businesses based on user enrollment overlap."""
+        positions = {business.id: position for position, business in enumerate(businesses)}
+        if target_business_id not in positions:
+            return []
+
+        incidence = self._build_incidence_matrix(positions, enrollments)
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+        row = positions[target_business_id]
+        intersections = (incidence[row] @ incidence.T).tocsr()
+        return self._get_top_similar_row(row, 0, businesses, sizes, intersections)
+
+    def get_all_similar_businesses(self, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment]) -> Dict[UUID, List[BusinessDetails]]:
+        """Find similar businesses for every business with blockwise sparse matrix products."""
+        positions = {business.id: position for position, business in enumerate(businesses)}
+        incidence = self._build_incidence_matrix(positions, enrollments)
+        sizes = np.asarray(incidence.sum(axis=1)).ravel()
+        transposed = incidence.T
+
+        similar_businesses = {}
+        for start in range(0, len(businesses), self.block_size):
+            end = min(start + self.block_size, len(businesses))
+            intersections = (incidence[start:end] @ transposed).tocsr()
+            for row in range(start, end):
+                similar_businesses[businesses[row].id] = self._get_top_similar_row(
+                    row, row - start, businesses, sizes, intersections
+                )
+        return similar_businesses
+
+    def _build_incidence_matrix(self, positions: Dict[UUID, int], enrollments: Iterable[Enrollment]) -> sparse.csr_matrix:
+        """Create a binary business x user matrix, mapping user IDs to dense integer ids."""
+        user_positions: Dict[UUID, int] = {}
+        rows = []
+        columns = []
+        for enrollment in enrollments:
+            row = positions.get(enrollment.business_id)
+            if row is None:
+                continue
+            rows.append(row)
+            columns.append(user_positions.setdefault(enrollment.user_id, len(user_positions)))
+
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (np.array(rows, dtype=np.int32), np.array(columns, dtype=np.int32))),
+            shape=(len(positions), len(user_positions)),
+        )
+        # Duplicate enrollments are summed by the constructor, clamp them back to membership
+        incidence.data[:] = 1
+        return incidence
+
+    def _get_top_similar_row(self, row: int, block_row: int, businesses: Sequence[BusinessDetails],
+                             sizes: np.ndarray, intersections: sparse.csr_matrix) -> List[BusinessDetails]:
+        """Get top N most similar businesses for one row of the intersection matrix.
+
+        Ties keep the order of `businesses` and businesses without shared users fill the
+        remaining slots with a similarity of 0, like the pure-Python service.
+        """
+        if len(businesses) <= 1 or sizes[row] == 0:
+            return []
+
+        start, end = intersections.indptr[block_row], intersections.indptr[block_row + 1]
+        columns = intersections.indices[start:end]
+        counts = intersections.data[start:end]
+        others = columns != row
+        columns, counts = columns[others], counts[others]
+        overlapping = set(columns.tolist())
+
+        similarities = counts / (sizes[row] + sizes[columns] - counts)
+        if len(columns) > self.max_similar:
+            kth = similarities[np.argpartition(-similarities, self.max_similar - 1)[self.max_similar - 1]]
+            candidates = similarities >= kth
+            columns, similarities = columns[candidates], similarities[candidates]
+        order = np.lexsort((columns, -similarities))[:self.max_similar]
+
+        top = [businesses[column] for column in columns[order].tolist()]
+        for position, business in enumerate(businesses):
+            if len(top) >= self.max_similar:
+                break
+            if position != row and position not in overlapping:
+                top.append(business)
+        return top
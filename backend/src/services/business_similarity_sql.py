@@ -0,0 +1,93 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+from uuid import UUID
+from sqlalchemy import Float, cast, select
+from src.db.connection import db
+from src.db.models import BusinessDetails, Enrollment
+from src.services.business_similarity import BusinessSimilarityService
+
+class SqlBusinessSimilarityService(BusinessSimilarityService):
+    """Jaccard similarity computed inside PostgreSQL.
+
+    Intersections come from a self-join on `enrollment` grouped by business pair, unions from
+    per-business member counts, and a window function keeps the top-k rows per business, so
+    only small result tuples are sent back instead of every enrollment.
+    """
+
+    def get_similar_businesses(self, target_business_id: UUID, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment] = None) -> List[BusinessDetails]:
+        """Find similar businesses for one business. `enrollments` is ignored."""
+        return self._get_similar(businesses, target_business_id).get(target_business_id, [])
+
+    def get_all_similar_businesses(self, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment] = None) -> Dict[UUID, List[BusinessDetails]]:
+        """Find similar businesses for every business. `enrollments` is ignored."""
+        return self._get_similar(businesses)
+
+    def _get_similar(self, businesses: List[BusinessDetails], target_business_id: Optional[UUID] = None) -> Dict[UUID, List[BusinessDetails]]:
+        sizes, intersections = self._load_top_intersections(target_business_id)
+        positions = {business.id: position for position, business in enumerate(businesses)}
+
+        similar_businesses = {}
+        for business in businesses:
+            if target_business_id is not None and business.id != target_business_id:
+                continue
+            if len(businesses) <= 1 or not sizes.get(business.id):
+                similar_businesses[business.id] = []
+                continue
+            similar_businesses[business.id] = self._get_top_similar_from_intersections(
+                business.id, businesses, positions, sizes, intersections.get(business.id, {})
+            )
+        return similar_businesses
+
+    def _load_top_intersections(self, target_business_id: Optional[UUID] = None) -> Tuple[Dict[UUID, int], Dict[UUID, Dict[UUID, int]]]:
+        """Load member counts and the intersection counts of each business's top-k neighbours.
+
+        rank() keeps every neighbour tied with the k-th one, so ties can still be broken by the
+        order of the caller's business list exactly like the in-Python service.
+        """
+        memberships = select(Enrollment.user_id, Enrollment.business_id).distinct().cte('memberships')
+        other_memberships = memberships.alias('other_memberships')
+        member_counts = (
+            select(memberships.c.business_id, db.func.count().label('member_count'))
+            .group_by(memberships.c.business_id)
+            .cte('member_counts')
+        )
+        other_member_counts = member_counts.alias('other_member_counts')
+
+        pairs = (
+            select(
+                memberships.c.business_id,
+                other_memberships.c.business_id.label('other_business_id'),
+                db.func.count().label('shared_count'),
+            )
+            .join(other_memberships, (memberships.c.user_id == other_memberships.c.user_id)
+                  & (memberships.c.business_id != other_memberships.c.business_id))
+            .group_by(memberships.c.business_id, other_memberships.c.business_id)
+        )
+        if target_business_id is not None:
+            pairs = pairs.where(memberships.c.business_id == target_business_id)
+        pairs = pairs.cte('pairs')
+
+        similarity = cast(pairs.c.shared_count, Float) / (
+            member_counts.c.member_count + other_member_counts.c.member_count - pairs.c.shared_count
+        )
+        ranked = (
+            select(
+                pairs.c.business_id,
+                pairs.c.other_business_id,
+                pairs.c.shared_count,
+                db.func.rank().over(partition_by=pairs.c.business_id, order_by=similarity.desc()).label('similarity_rank'),
+            )
+            .join(member_counts, member_counts.c.business_id == pairs.c.business_id)
+            .join(other_member_counts, other_member_counts.c.business_id == pairs.c.other_business_id)
+            .subquery('ranked')
+        )
+        top_pairs = (
+            select(ranked.c.business_id, ranked.c.other_business_id, ranked.c.shared_count)
+            .where(ranked.c.similarity_rank <= self.max_similar)
+        )
+
+        sizes: Dict[UUID, int] = dict(db.session.execute(select(member_counts.c.business_id, member_counts.c.member_count)).all())
+        intersections: Dict[UUID, Dict[UUID, int]] = defaultdict(dict)
+        for business_id, other_business_id, shared_count in db.session.execute(top_pairs):
+            intersections[business_id][other_business_id] = shared_count
+        return sizes, intersections
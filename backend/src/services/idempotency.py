@@ -0,0 +1,107 @@
+from typing import Optional
+from datetime import datetime, timedelta
+from uuid import UUID
+import threading
+import time
+from flask import Flask, Response
+from sqlalchemy import delete, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from src.config import Config
+from src.db.connection import db
+from src.db.models import IdempotencyKey
+
+# Longest Idempotency-Key header accepted, the length of the key column
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """First responses of writes sent with an Idempotency-Key, in `idempotency_key`.
+
+    A retry is answered with one primary key lookup. A new key is claimed in the transaction
+    of the write, so the write, the claim and the response commit together, and a concurrent request with
+    the same key waits for that commit instead of writing again. Entries expire after
+    `ttl_seconds`, and every `purge_seconds` a background thread of the worker deletes
+    expired entries and the oldest ones beyond `max_entries`.
+    """
+
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 1000000, purge_seconds: float = 300):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.purge_seconds = purge_seconds
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, business_id: UUID, key: str) -> Optional[IdempotencyKey]:
+        """The unexpired entry of a key, or None."""
+        return db.session.execute(
+            select(IdempotencyKey)
+            .where(IdempotencyKey.business_id == business_id, IdempotencyKey.key == key,
+                   IdempotencyKey.created_at > self._cutoff())
+        ).scalar()
+
+    def claim(self, business_id: UUID, key: str, request_hash: str) -> bool:
+        """Reserve a key in the current transaction, taking over an expired entry. Returns False
+        if another request holds it; if that request has not committed yet, waits for it first."""
+        statement = insert(IdempotencyKey).values(
+            business_id=business_id, key=key, request_hash=request_hash, created_at=datetime.utcnow(),
+        )
+        return db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=['business_id', 'key'],
+                set_={'request_hash': statement.excluded.request_hash, 'created_at': statement.excluded.created_at,
+                      'status_code': None, 'mimetype': None, 'body': None},
+                where=IdempotencyKey.created_at <= self._cutoff(),
+            ).returning(IdempotencyKey.key)
+        ).first() is not None
+
+    def save(self, business_id: UUID, key: str, response: Response) -> None:
+        """Store the response of a claimed key, in the current transaction."""
+        db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.business_id == business_id, IdempotencyKey.key == key,
+                   IdempotencyKey.status_code.is_(None))
+            .values(status_code=response.status_code, mimetype=response.mimetype, body=response.get_data())
+            .execution_options(synchronize_session=False)
+        )
+
+    def purge(self) -> int:
+        """Delete expired entries and the oldest ones beyond `max_entries`, and commit."""
+        overflow = (
+            select(IdempotencyKey.business_id, IdempotencyKey.key)
+            .order_by(IdempotencyKey.created_at.desc())
+            .offset(self.max_entries)
+        )
+        result = db.session.execute(
+            delete(IdempotencyKey)
+            .where(or_(IdempotencyKey.created_at <= self._cutoff(),
+                       tuple_(IdempotencyKey.business_id, IdempotencyKey.key).in_(overflow)))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
+
+    def start(self, app: Flask) -> None:
+        """Start the background purge of this worker, unless it is disabled or already running."""
+        if self.purge_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='idempotency-purge', daemon=True)
+        self._thread.start()
+
+    def _run(self, app: Flask) -> None:
+        while True:
+            time.sleep(self.purge_seconds)
+            with app.app_context():
+                try:
+                    self.purge()
+                except Exception as e:
+                    print(f"Purging idempotency keys failed: {e}")
+                    db.session.rollback()
+
+    def _cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=Config.IDEMPOTENCY_KEY_TTL_SECONDS,
+    max_entries=Config.IDEMPOTENCY_KEY_MAX_ENTRIES,
+    purge_seconds=Config.IDEMPOTENCY_KEY_PURGE_SECONDS,
+)
@@ -0,0 +1,83 @@
+from typing import Callable, Optional, TypeVar
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+from passlib.hash import pbkdf2_sha256
+from src.config import Config
+
+T = TypeVar('T')
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when every hashing slot is taken and the request should be retried later."""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pbkdf2_sha256.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    """pbkdf2_sha256 hashing and verification in a bounded process pool.
+
+    Hashing is deliberately CPU-heavy and holds the GIL, so running it on request threads
+    stalls every other request of the worker. At most `max_workers + max_pending` calls are
+    in flight; any more fail fast with PasswordHasherBusy instead of queueing up. With
+    `max_workers=0` calls run inline on the calling thread.
+    """
+
+    def __init__(self, rounds: int = 29000, max_workers: int = 2, max_pending: int = 32):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending) if max_workers else None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """Hash a password with the configured number of rounds."""
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        """Check a password against a stored hash."""
+        return self._run(_verify, password, hashed_password)
+
+    def needs_update(self, hashed_password: str) -> bool:
+        """Whether a stored hash was made with a different number of rounds than configured."""
+        return pbkdf2_sha256.using(rounds=self.rounds).needs_update(hashed_password)
+
+    def shutdown(self) -> None:
+        """Stop the pool's processes. The pool is recreated on the next call."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, function: Callable[..., T], *args) -> T:
+        if self._slots is None:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use, and with 'spawn', so that no database connections or
+        # request threads are forked into the pool
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+
+password_hasher = PasswordHasher(
+    Config.PASSWORD_HASH_ROUNDS,
+    Config.PASSWORD_HASH_WORKERS,
+    Config.PASSWORD_HASH_MAX_PENDING,
+)
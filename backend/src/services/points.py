@@ -0,0 +1,210 @@
+from typing import Dict, Iterable, Optional, Tuple
+from datetime import datetime
+from decimal import Decimal
+from uuid import UUID
+import random
+import threading
+import time
+from flask import Flask
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.config import Config
+from src.db.connection import db
+from src.db.models import Enrollment, RewardUsageSlot
+from src.services.response_cache import response_cache
+
+# Balance of enrollment `e`: its snapshot plus the ledger entries not folded into it yet,
+# read from ix_points_transaction_enrollment_id_xid. Same as the Enrollment.points property.
+_BALANCE = """e.points_snapshot + coalesce((
+            SELECT sum(t.amount) FROM points_transaction t
+            WHERE t.enrollment_id = e.id AND t.xid >= e.points_snapshot_xid
+        ), 0)"""
+
+_ADD_POINTS = text(f"""
+    WITH target AS (
+        SELECT e.id, {_BALANCE} AS balance
+        FROM enrollment e
+        WHERE e.user_id = :user_id AND e.business_id = :business_id
+    ), entry AS (
+        INSERT INTO points_transaction (enrollment_id, amount, created_at)
+        SELECT id, :points, :now FROM target
+    )
+    SELECT balance + :points AS balance FROM target
+""")
+
+# One ledger entry per item; the returned balances add up the grants of each user
+_ADD_POINTS_BULK = text(f"""
+    WITH item AS (
+        SELECT item.user_id, item.points
+        FROM unnest(CAST(:user_ids AS uuid[]), CAST(:points AS numeric[])) AS item(user_id, points)
+    ), target AS (
+        SELECT e.id, e.user_id, {_BALANCE} AS balance
+        FROM enrollment e
+        WHERE e.business_id = :business_id AND e.user_id IN (SELECT user_id FROM item)
+    ), entry AS (
+        INSERT INTO points_transaction (enrollment_id, amount, created_at)
+        SELECT target.id, item.points, :now FROM target JOIN item ON item.user_id = target.user_id
+    )
+    SELECT target.user_id, target.balance + grants.points AS balance
+    FROM target
+    JOIN (SELECT user_id, sum(points) AS points FROM item GROUP BY user_id) grants ON grants.user_id = target.user_id
+""")
+
+# The entry is only written if the reward is active and the balance covers it
+_REDEEM = text(f"""
+    WITH target AS (
+        SELECT e.id, {_BALANCE} AS balance, r.required_points
+        FROM enrollment e
+        JOIN reward r ON r.id = :reward_id AND r.business_id = e.business_id
+        WHERE e.id = :enrollment_id
+            AND r.valid_from_timestamp <= :now
+            AND (r.valid_until_timestamp IS NULL OR r.valid_until_timestamp > :now)
+    ), entry AS (
+        INSERT INTO points_transaction (enrollment_id, amount, reward_id, created_at)
+        SELECT id, -required_points, :reward_id, :now FROM target WHERE balance >= required_points
+        RETURNING amount
+    )
+    SELECT target.balance + entry.amount AS balance FROM target, entry
+""")
+
+# Folds entries of transactions that ended before the oldest one still running. Entries of
+# running transactions are left for a later run, however they end up ordered by commit.
+_COMPACT = text("""
+    WITH horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xid
+    ), pending AS (
+        SELECT t.enrollment_id, sum(t.amount) AS amount
+        FROM points_transaction t
+        JOIN enrollment e ON e.id = t.enrollment_id
+        CROSS JOIN horizon
+        WHERE t.xid >= :since_xid AND t.xid >= e.points_snapshot_xid AND t.xid < horizon.xid
+        GROUP BY t.enrollment_id
+    ), compacted AS (
+        UPDATE enrollment
+        SET points_snapshot = enrollment.points_snapshot + pending.amount, points_snapshot_xid = horizon.xid
+        FROM pending, horizon
+        WHERE enrollment.id = pending.enrollment_id
+        RETURNING 1
+    )
+    SELECT (SELECT xid FROM horizon) AS xid, (SELECT count(*) FROM compacted) AS enrollments
+""")
+
+# Held for the rest of the compacting transaction, so that runs of several workers never overlap
+_COMPACTION_LOCK = text("SELECT pg_try_advisory_xact_lock(hashtext('points_transaction_compaction'))")
+
+
+class PointsService:
+    """Points balance changes, appended to the `points_transaction` ledger.
+
+    Earning only inserts an entry, so concurrent grants to the same enrollment never wait
+    for each other. Redemptions lock the enrollment row against each other only, and write
+    their entry only if the balance still covers the reward. A balance is the enrollment's
+    snapshot plus its entries since the snapshot, which compaction folds into the snapshot
+    every `compaction_seconds`, so reads stay one index probe over a few entries. Reward
+    uses are counted in one of `usage_slots` rows picked at random. Callers commit, except
+    for compact().
+    """
+
+    def __init__(self, compaction_seconds: float = 60, usage_slots: int = 16):
+        self.compaction_seconds = compaction_seconds
+        self.usage_slots = usage_slots
+        self._thread: Optional[threading.Thread] = None
+        # Entries of older transactions were all folded by an earlier run of this worker
+        self._compacted_xid = 0
+
+    def add_points(self, business_id: UUID, user_id: UUID, points: Decimal) -> Optional[Decimal]:
+        """Add points to a user's enrollment. Returns the new balance, or None if they are not enrolled.
+        Grants committed concurrently are not included in the returned balance."""
+        # A text statement, so the response cache is not invalidated: no cached response shows points
+        return db.session.execute(_ADD_POINTS, {
+            'business_id': business_id,
+            'user_id': user_id,
+            'points': points,
+            'now': datetime.utcnow(),
+        }).scalar()
+
+    def add_points_bulk(self, business_id: UUID, grants: Iterable[Tuple[UUID, Decimal]]) -> Dict[UUID, Decimal]:
+        """Add many grants at once, in one statement. Returns the new balance of each enrolled user;
+        grants to users who are not enrolled are left out."""
+        user_ids, points = [], []
+        for user_id, amount in grants:
+            user_ids.append(str(user_id))
+            points.append(amount)
+        rows = db.session.execute(_ADD_POINTS_BULK, {
+            'business_id': business_id,
+            'user_ids': user_ids,
+            'points': points,
+            'now': datetime.utcnow(),
+        })
+        return {row.user_id: row.balance for row in rows}
+
+    def redeem(self, business_id: UUID, user_id: UUID, reward_id: UUID, now: datetime) -> Optional[Decimal]:
+        """Spend a reward's points and count its use. Returns the new balance, or None if the
+        reward is not an active reward of the business, the user is not enrolled, or their
+        balance is too low."""
+        # FOR NO KEY UPDATE: redemptions and compaction of the enrollment wait for each other,
+        # while grants, whose inserts only take a key share lock on it, go ahead
+        enrollment_id = db.session.execute(
+            select(Enrollment.id)
+            .where(Enrollment.user_id == user_id, Enrollment.business_id == business_id)
+            .with_for_update(key_share=True)
+        ).scalar()
+        if enrollment_id is None:
+            return None
+        # A statement of its own, whose snapshot sees the redemptions committed before the lock was granted
+        balance = db.session.execute(_REDEEM, {
+            'enrollment_id': enrollment_id,
+            'reward_id': reward_id,
+            'now': now,
+        }).scalar()
+        if balance is None:
+            return None
+        self._count_use(reward_id)
+        # Cached reward lists show usage counts, and neither statement is an ORM write the cache sees
+        response_cache.mark_dirty(db.session)
+        return balance
+
+    def _count_use(self, reward_id: UUID) -> None:
+        # A random slot row instead of the reward row, which every redemption of the reward would queue on.
+        # Not an ORM statement on Reward, so the category index is left alone; redeem() invalidates the response cache.
+        statement = pg_insert(RewardUsageSlot).values(
+            reward_id=reward_id, slot=random.randrange(self.usage_slots), count=1,
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['reward_id', 'slot'],
+            set_={'count': RewardUsageSlot.count + 1},
+        ))
+
+    def compact(self) -> int:
+        """Fold committed ledger entries into the enrollment snapshots, and commit. Returns the
+        number of enrollments compacted, or 0 if another worker is compacting."""
+        if not db.session.execute(_COMPACTION_LOCK).scalar():
+            db.session.rollback()
+            return 0
+        row = db.session.execute(_COMPACT, {'since_xid': self._compacted_xid}).one()
+        db.session.commit()
+        self._compacted_xid = row.xid
+        return row.enrollments
+
+    def start(self, app: Flask) -> None:
+        """Start the background compaction of this worker, unless it is disabled or already running."""
+        if self.compaction_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='points-compaction', daemon=True)
+        self._thread.start()
+
+    def _run(self, app: Flask) -> None:
+        while True:
+            time.sleep(self.compaction_seconds)
+            with app.app_context():
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"Compacting points failed: {e}")
+                    db.session.rollback()
+
+
+points_service = PointsService(
+    compaction_seconds=Config.POINTS_COMPACTION_SECONDS,
+    usage_slots=Config.REWARD_USAGE_SLOTS,
+)
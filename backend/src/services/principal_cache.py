@@ -0,0 +1,128 @@
+from typing import Dict, NamedTuple, Optional, Set
+from collections import OrderedDict
+from uuid import UUID
+import threading
+import time
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessDetails, User
+
+
+class Principal(NamedTuple):
+    """The authenticated user as seen by request handlers, with the business they own."""
+    id: UUID
+    is_business_owner: bool
+    business_id: Optional[UUID] = None
+
+
+class PrincipalCache:
+    """Bounded LRU cache of principals keyed by user id, with a TTL.
+
+    Commits that change or delete users, or create or delete their businesses, evict them
+    through session events. The TTL bounds how long a change made by another worker can go
+    unnoticed.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[UUID, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Session.info keys, per instance so that several caches can listen at once
+        self._changed_users_key = ('principal_cache_changed_users', id(self))
+        self._all_users_key = ('principal_cache_all_users', id(self))
+
+    def get(self, user_id: UUID) -> Optional[Principal]:
+        """Return the principal for `user_id`, loading it on a miss. None if the user does not exist."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._load(user_id, now)
+
+    def reload(self, user_id: UUID) -> Optional[Principal]:
+        """Load the principal for `user_id` from the database, replacing any cached entry."""
+        with self._lock:
+            self.misses += 1
+        return self._load(user_id, time.monotonic())
+
+    def invalidate(self, user_ids: Optional[Set[UUID]] = None) -> None:
+        """Evict the given users, or every user."""
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+                return
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters since the worker started, and the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def listen(self, session_class=Session) -> None:
+        """Register the session events that evict users changed by a commit."""
+        for name, listener in (
+            ('after_flush', self._after_flush),
+            ('do_orm_execute', self._do_orm_execute),
+            ('after_commit', self._after_commit),
+            ('after_rollback', self._after_rollback),
+        ):
+            if not event.contains(session_class, name, listener):
+                event.listen(session_class, name, listener)
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        user_ids = {instance.id for instance in (*session.dirty, *session.deleted) if isinstance(instance, User)}
+        user_ids.update(instance.user_id for instance in (*session.new, *session.deleted)
+                        if isinstance(instance, BusinessDetails))
+        if user_ids:
+            session.info.setdefault(self._changed_users_key, set()).update(user_ids)
+
+    def _do_orm_execute(self, orm_execute_state) -> None:
+        # Bulk UPDATE/DELETE statements do not say which users they touched
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, (User, BusinessDetails)):
+            orm_execute_state.session.info[self._all_users_key] = True
+
+    def _after_commit(self, session: Session) -> None:
+        user_ids = session.info.pop(self._changed_users_key, None)
+        if session.info.pop(self._all_users_key, False):
+            self.invalidate()
+        elif user_ids:
+            self.invalidate(user_ids)
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._changed_users_key, None)
+        session.info.pop(self._all_users_key, None)
+
+    def _load(self, user_id: UUID, now: float) -> Optional[Principal]:
+        # The user and their business in one round-trip
+        row = db.session.execute(
+            select(User.id, User.is_business_owner, BusinessDetails.id.label('business_id'))
+            .outerjoin(BusinessDetails, BusinessDetails.user_id == User.id)
+            .where(User.id == user_id)
+            .limit(1)
+        ).first()
+        if row is None:
+            self.invalidate({user_id})
+            return None
+        principal = Principal(row.id, bool(row.is_business_owner), row.business_id)
+        with self._lock:
+            self._entries[user_id] = (principal, now + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return principal
+
+
+principal_cache = PrincipalCache(Config.PRINCIPAL_CACHE_MAX_ENTRIES, Config.PRINCIPAL_CACHE_TTL_SECONDS)
@@ -0,0 +1,157 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from collections import Counter, deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from uuid import UUID
+import multiprocessing
+import random
+import time
+from sqlalchemy import select
+from src.db.connection import db
+from src.db.models import BusinessDetails, Enrollment, Reward
+from src.db.queries import reward_active
+from src.services.recommendation_store import UserRecommendationStore, user_recommendations
+
+# Category -> businesses in it with their reward ids
+Catalog = Dict[str, List[Tuple[UUID, Tuple[UUID, ...]]]]
+# (user_id, [(business_id, category), ...]) for each user with enrollments
+UserEnrollments = Tuple[UUID, List[Tuple[UUID, Optional[str]]]]
+
+# Catalog of a pool process, set once by its initializer instead of being sent with every chunk
+_worker_catalog: Optional[Catalog] = None
+
+
+class BatchRecommendationResult(NamedTuple):
+    users: int
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _init_worker(catalog: Catalog) -> None:
+    global _worker_catalog
+    _worker_catalog = catalog
+
+
+def _recommend_chunk(chunk: Sequence[UserEnrollments], max_categories: int,
+                     catalog: Optional[Catalog] = None) -> Dict[UUID, List[UUID]]:
+    """Recommended reward ids of each user of `chunk`, picked like BusinessRecommendationService does."""
+    catalog = _worker_catalog if catalog is None else catalog
+    reward_ids_by_user = {}
+    for user_id, enrollments in chunk:
+        enrolled = {business_id for business_id, _ in enrollments}
+        histogram = Counter(category for _, category in enrollments if category)
+        reward_ids = []
+        # Ties are broken by category name, as in the SQL backend
+        top_categories = sorted(histogram, key=lambda category: (-histogram[category], category))[:max_categories]
+        for category in top_categories:
+            pick = _pick_business(catalog.get(category, ()), enrolled)
+            if pick is not None:
+                reward_ids.append(random.choice(pick[1]))
+        reward_ids_by_user[user_id] = reward_ids
+    return reward_ids_by_user
+
+
+def _pick_business(businesses, exclude):
+    # Users are enrolled in few businesses, so a few random probes nearly always succeed
+    for _ in range(8):
+        if not businesses:
+            return None
+        business = random.choice(businesses)
+        if business[0] not in exclude:
+            return business
+    candidates = [business for business in businesses if business[0] not in exclude]
+    return random.choice(candidates) if candidates else None
+
+
+class BatchRecommendationService:
+    """Recommendations for every user at once, written to the recommendation store.
+
+    The catalog is loaded once and the enrollment table is streamed once in user order.
+    Chunks of `chunk_size` users are handed to a pool of `workers` processes (0 computes
+    on the calling thread), and each finished chunk is written and committed on its own,
+    so memory stays bounded by the chunks in flight rather than the number of users.
+    Users refreshed or marked dirty since the generation started keep their entry.
+    """
+
+    def __init__(self, workers: int = 2, chunk_size: int = 1000, max_categories: int = 3,
+                 store: Optional[UserRecommendationStore] = None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_categories = max_categories
+        self.store = store or user_recommendations
+
+    def generate(self) -> BatchRecommendationResult:
+        """Recompute and store the recommendations of every user with enrollments."""
+        started = time.perf_counter()
+        generated_at = datetime.utcnow()
+        catalog = self._load_catalog()
+        users = rows = 0
+
+        def write(reward_ids_by_user: Dict[UUID, List[UUID]]) -> None:
+            nonlocal users, rows
+            saved = self.store.save(reward_ids_by_user, computed_before=generated_at)
+            db.session.commit()
+            users += len(saved)
+            rows += sum(len(reward_ids_by_user[user_id]) for user_id in saved)
+
+        if not self.workers:
+            for chunk in self._stream_chunks():
+                write(_recommend_chunk(chunk, self.max_categories, catalog))
+            return BatchRecommendationResult(users, rows, time.perf_counter() - started)
+
+        # Spawned rather than forked, so that no database connections are inherited
+        executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(catalog,),
+        )
+        pending = deque()
+        try:
+            for chunk in self._stream_chunks():
+                pending.append(executor.submit(_recommend_chunk, chunk, self.max_categories))
+                # Bound the chunks in flight, and write them in submission order
+                if len(pending) >= 2 * self.workers:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return BatchRecommendationResult(users, rows, time.perf_counter() - started)
+
+    def _load_catalog(self) -> Catalog:
+        rows = db.session.execute(
+            select(BusinessDetails.id, BusinessDetails.description, Reward.id)
+            .join(Reward, Reward.business_id == BusinessDetails.id)
+            .where(BusinessDetails.description.is_not(None), BusinessDetails.description != '')
+            .where(reward_active(datetime.utcnow()))
+        ).all()
+        reward_ids: Dict[UUID, List[UUID]] = {}
+        categories: Dict[UUID, str] = {}
+        for business_id, category, reward_id in rows:
+            reward_ids.setdefault(business_id, []).append(reward_id)
+            categories[business_id] = category
+        catalog: Catalog = {}
+        for business_id, category in categories.items():
+            catalog.setdefault(category, []).append((business_id, tuple(reward_ids[business_id])))
+        return catalog
+
+    def _stream_chunks(self) -> Iterator[List[UserEnrollments]]:
+        # A connection of its own, so that committing each written chunk does not close the cursor
+        with db.engine.connect() as connection:
+            result = connection.execution_options(yield_per=10 * self.chunk_size).execute(
+                select(Enrollment.user_id, Enrollment.business_id, BusinessDetails.description)
+                .join(BusinessDetails, BusinessDetails.id == Enrollment.business_id)
+                .order_by(Enrollment.user_id)
+            )
+            chunk = []
+            for user_id, rows in groupby(result, key=lambda row: row.user_id):
+                chunk.append((user_id, [(row.business_id, row.description) for row in rows]))
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
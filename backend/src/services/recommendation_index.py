@@ -0,0 +1,297 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime
+import heapq
+import random
+import threading
+import time
+from uuid import UUID
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessDetails, Reward
+from src.db.queries import reward_active, reward_not_expired
+from src.api_schemas import BusinessRecommendation
+from src.services.business_recommendation import BusinessRecommendationService, to_recommendation
+
+# Sampling rounds before giving up on a category whose picks keep turning out stale
+_MAX_SAMPLE_ROUNDS = 3
+
+
+class _Bucket:
+    """Set of business ids supporting O(1) add, remove and uniform random choice."""
+
+    def __init__(self):
+        self.items: List[UUID] = []
+        self._positions: Dict[UUID, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add(self, business_id: UUID) -> None:
+        if business_id not in self._positions:
+            self._positions[business_id] = len(self.items)
+            self.items.append(business_id)
+
+    def remove(self, business_id: UUID) -> None:
+        position = self._positions.pop(business_id, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if last != business_id:
+            self.items[position] = last
+            self._positions[last] = position
+
+    def sample(self, exclude: Set[UUID]) -> Optional[UUID]:
+        # Users are enrolled in few businesses, so a few random probes nearly always succeed
+        for _ in range(8):
+            if not self.items:
+                return None
+            business_id = random.choice(self.items)
+            if business_id not in exclude:
+                return business_id
+        candidates = [business_id for business_id in self.items if business_id not in exclude]
+        return random.choice(candidates) if candidates else None
+
+
+class CategoryIndex:
+    """Per-worker map from category (business description) to businesses with at least one active reward.
+
+    Commits of this worker that write businesses or rewards update the index through
+    session events. Every `refresh_seconds` it is rebuilt from the database to pick up
+    writes of other workers, by one request while the others keep reading the current
+    index, and readers drop entries they find to be stale. Rewards
+    enter and leave the index at the bounds of their validity window, through a heap
+    of upcoming bounds that readers advance.
+    """
+
+    def __init__(self, refresh_seconds: float = 30):
+        self.refresh_seconds = refresh_seconds
+        self._categories: Dict[UUID, str] = {}
+        # Active reward ids by business, and the window of every unexpired reward
+        self._rewards: Dict[UUID, Set[UUID]] = {}
+        self._windows: Dict[UUID, Tuple[UUID, datetime, Optional[datetime]]] = {}
+        # (time, reward id) for each upcoming start or end; entries of changed windows are re-checked, not removed
+        self._schedule: List[Tuple[datetime, UUID]] = []
+        self._buckets: Dict[str, _Bucket] = {}
+        self._next_refresh = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        # Held by the request rebuilding the index, so that only one does
+        self._reload_lock = threading.Lock()
+        # Session.info keys, per instance so that several indexes can listen at once
+        self._changes_key = ('category_index_changes', id(self))
+        self._reload_key = ('category_index_reload', id(self))
+
+    def sample(self, category: str, exclude: Set[UUID]) -> Optional[Tuple[UUID, UUID]]:
+        """Pick a random business of `category` outside `exclude`, and a random reward id of it."""
+        self._refresh_if_due()
+        with self._lock:
+            self._advance(datetime.utcnow())
+            bucket = self._buckets.get(category)
+            business_id = bucket.sample(exclude) if bucket else None
+            if business_id is None:
+                return None
+            return business_id, random.choice(tuple(self._rewards[business_id]))
+
+    def discard(self, business_id: UUID, reward_id: UUID) -> None:
+        """Forget a reward that turned out to be gone, and its business if it was gone too."""
+        with self._lock:
+            self._remove_reward(reward_id, business_id)
+
+    def reload(self) -> None:
+        """Rebuild the index from the database."""
+        businesses = db.session.execute(
+            select(BusinessDetails.id, BusinessDetails.description)
+            .where(BusinessDetails.description.is_not(None), BusinessDetails.description != '')
+        ).all()
+        rewards = db.session.execute(
+            select(Reward.id, Reward.business_id, Reward.valid_from_timestamp, Reward.valid_until_timestamp)
+            .where(reward_not_expired(datetime.utcnow()))
+        ).all()
+        with self._lock:
+            self._categories, self._rewards, self._windows, self._schedule, self._buckets = {}, {}, {}, [], {}
+            for business_id, category in businesses:
+                self._set_business(business_id, category)
+            for reward_id, business_id, valid_from, valid_until in rewards:
+                self._set_reward(reward_id, business_id, valid_from, valid_until)
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+            self._loaded = True
+
+    def listen(self, session_class=Session) -> None:
+        """Register the session events that apply committed business and reward writes."""
+        for name, listener in (
+            ('after_flush', self._after_flush),
+            ('do_orm_execute', self._do_orm_execute),
+            ('after_commit', self._after_commit),
+            ('after_rollback', self._after_rollback),
+        ):
+            if not event.contains(session_class, name, listener):
+                event.listen(session_class, name, listener)
+
+    def _refresh_if_due(self) -> None:
+        if time.monotonic() < self._next_refresh:
+            return
+        # Readers skip a rebuild already under way, except for the first one, which has nothing to read yet
+        if not self._reload_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if time.monotonic() >= self._next_refresh:
+                self.reload()
+        finally:
+            self._reload_lock.release()
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        changes = session.info.setdefault(self._changes_key, [])
+        for instance in (*session.new, *session.dirty):
+            if isinstance(instance, BusinessDetails):
+                changes.append((self._set_business, instance.id, instance.description))
+            elif isinstance(instance, Reward):
+                changes.append((self._set_reward, instance.id, instance.business_id,
+                                instance.valid_from_timestamp, instance.valid_until_timestamp))
+        for instance in session.deleted:
+            if isinstance(instance, BusinessDetails):
+                changes.append((self._remove_business, instance.id))
+            elif isinstance(instance, Reward):
+                changes.append((self._remove_reward, instance.id, instance.business_id))
+
+    def _do_orm_execute(self, orm_execute_state) -> None:
+        # Bulk UPDATE/DELETE statements do not say which rows they touched
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, (BusinessDetails, Reward)):
+            orm_execute_state.session.info[self._reload_key] = True
+
+    def _after_commit(self, session: Session) -> None:
+        changes = session.info.pop(self._changes_key, ())
+        if session.info.pop(self._reload_key, False):
+            self._next_refresh = 0.0
+            return
+        if changes:
+            with self._lock:
+                for apply, *args in changes:
+                    apply(*args)
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._changes_key, None)
+        session.info.pop(self._reload_key, None)
+
+    def _set_business(self, business_id: UUID, category: Optional[str]) -> None:
+        old_category = self._categories.get(business_id)
+        if old_category == category:
+            return
+        if old_category is not None:
+            self._remove_from_bucket(old_category, business_id)
+            del self._categories[business_id]
+        if category:
+            self._categories[business_id] = category
+            if self._rewards.get(business_id):
+                self._buckets.setdefault(category, _Bucket()).add(business_id)
+
+    def _remove_business(self, business_id: UUID) -> None:
+        self._set_business(business_id, None)
+        self._rewards.pop(business_id, None)
+
+    def _set_reward(self, reward_id: UUID, business_id: UUID, valid_from: datetime,
+                    valid_until: Optional[datetime]) -> None:
+        self._windows[reward_id] = (business_id, valid_from, valid_until)
+        for bound in (valid_from, valid_until):
+            if bound is not None:
+                heapq.heappush(self._schedule, (bound, reward_id))
+        self._apply_window(reward_id, datetime.utcnow())
+
+    def _remove_reward(self, reward_id: UUID, business_id: UUID) -> None:
+        self._windows.pop(reward_id, None)
+        self._deactivate_reward(reward_id, business_id)
+
+    def _advance(self, now: datetime) -> None:
+        while self._schedule and self._schedule[0][0] <= now:
+            _, reward_id = heapq.heappop(self._schedule)
+            self._apply_window(reward_id, now)
+
+    def _apply_window(self, reward_id: UUID, now: datetime) -> None:
+        window = self._windows.get(reward_id)
+        if window is None:
+            return
+        business_id, valid_from, valid_until = window
+        if valid_until is not None and valid_until <= now:
+            self._remove_reward(reward_id, business_id)
+        elif valid_from <= now:
+            self._activate_reward(reward_id, business_id)
+        else:
+            self._deactivate_reward(reward_id, business_id)
+
+    def _activate_reward(self, reward_id: UUID, business_id: UUID) -> None:
+        self._rewards.setdefault(business_id, set()).add(reward_id)
+        category = self._categories.get(business_id)
+        if category is not None:
+            self._buckets.setdefault(category, _Bucket()).add(business_id)
+
+    def _deactivate_reward(self, reward_id: UUID, business_id: UUID) -> None:
+        reward_ids = self._rewards.get(business_id)
+        if reward_ids is None:
+            return
+        reward_ids.discard(reward_id)
+        if not reward_ids:
+            del self._rewards[business_id]
+            category = self._categories.get(business_id)
+            if category is not None:
+                self._remove_from_bucket(category, business_id)
+
+    def _remove_from_bucket(self, category: str, business_id: UUID) -> None:
+        # Businesses without rewards were never added to a bucket
+        bucket = self._buckets.get(category)
+        if bucket is not None:
+            bucket.remove(business_id)
+
+
+class IndexedBusinessRecommendationService(BusinessRecommendationService):
+    """Recommendations sampled from the category index instead of the whole catalog."""
+
+    needs_catalog = False
+
+    def __init__(self, index: Optional[CategoryIndex] = None):
+        self.index = index or category_index
+
+    def get_recommendations(self, user_businesses: List[BusinessDetails], all_businesses: Iterable[BusinessDetails] = None) -> List[BusinessRecommendation]:
+        """Get top 3 business recommendations based on user's most frequented categories. `all_businesses` is ignored."""
+        if not user_businesses:
+            return []
+
+        user_business_ids = {business.id for business in user_businesses}
+        top_categories = self._get_top_user_categories(user_businesses)
+        pending = top_categories
+        recommendations: Dict[str, BusinessRecommendation] = {}
+        for _ in range(_MAX_SAMPLE_ROUNDS):
+            picks = {}
+            for category in pending:
+                pick = self.index.sample(category, user_business_ids)
+                if pick is not None:
+                    picks[category] = pick
+            if not picks:
+                break
+
+            # One query for the picked rewards, which also weeds out stale picks
+            rows = db.session.execute(
+                select(Reward, BusinessDetails.business_name)
+                .join(BusinessDetails, Reward.business_id == BusinessDetails.id)
+                .where(Reward.id.in_([reward_id for _, reward_id in picks.values()]), reward_active(datetime.utcnow()))
+            ).all()
+            rewards = {reward.id: (reward, business_name) for reward, business_name in rows}
+            pending = []
+            for category, (business_id, reward_id) in picks.items():
+                if reward_id in rewards:
+                    reward, business_name = rewards[reward_id]
+                    recommendations[category] = to_recommendation(business_name, reward)
+                else:
+                    self.index.discard(business_id, reward_id)
+                    pending.append(category)
+            if not pending:
+                break
+
+        # Keep the order of the user's top categories
+        return [recommendations[category] for category in top_categories if category in recommendations]
+
+
+category_index = CategoryIndex(Config.RECOMMENDATION_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,182 @@
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from uuid import UUID
+import threading
+from flask import Flask
+from sqlalchemy import and_, delete, event, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessDetails, Reward, UserRecommendation, UserRecommendationState
+from src.db.queries import reward_active
+from src.api_schemas import BusinessRecommendation
+from src.services.business_recommendation import (
+    BusinessRecommendationService,
+    create_recommendation_service,
+    to_recommendation,
+)
+
+
+class UserRecommendationStore:
+    """Recommendations materialized per user in `user_recommendation`.
+
+    Reads are one indexed query. A background thread recomputes users whose enrollments
+    changed, right after the change commits, and users whose entry is older than
+    `staleness_seconds`, every `refresh_seconds`. Workers claim users with SKIP LOCKED in
+    a short transaction, so several of them can refresh at once without doing the same
+    work twice, and enrollment changes never wait for a recomputation.
+    """
+
+    def __init__(self, service: BusinessRecommendationService, staleness_seconds: float = 3600,
+                 refresh_seconds: float = 60, batch_size: int = 100):
+        self.service = service
+        self.staleness_seconds = staleness_seconds
+        self.refresh_seconds = refresh_seconds
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Session.info key, per instance so that several stores can listen at once
+        self._stale_key = ('user_recommendations_stale', id(self))
+
+    def get(self, user_id: UUID) -> Optional[List[BusinessRecommendation]]:
+        """Stored recommendations of a user, or None if none were materialized yet."""
+        rows = db.session.execute(
+            select(UserRecommendationState.user_id, BusinessDetails.business_name, Reward)
+            .outerjoin(UserRecommendation, UserRecommendation.user_id == UserRecommendationState.user_id)
+            # Rewards that expired since the entry was computed are left out
+            .outerjoin(Reward, and_(Reward.id == UserRecommendation.reward_id, reward_active(datetime.utcnow())))
+            .outerjoin(BusinessDetails, BusinessDetails.id == Reward.business_id)
+            .where(UserRecommendationState.user_id == user_id)
+            .order_by(UserRecommendation.position)
+        ).all()
+        if not rows:
+            return None
+        return [to_recommendation(row.business_name, row.Reward) for row in rows if row.Reward is not None]
+
+    def refresh(self, user_id: UUID) -> List[BusinessRecommendation]:
+        """Recompute and store the recommendations of one user, and commit."""
+        recommendations = self._store(user_id)
+        db.session.commit()
+        return recommendations
+
+    def mark_stale(self, user_id: UUID) -> None:
+        """Flag a user for recomputation in the current transaction. The refresher wakes up on commit."""
+        db.session.execute(
+            update(UserRecommendationState)
+            .where(UserRecommendationState.user_id == user_id)
+            .values(dirty=True)
+        )
+        db.session.info[self._stale_key] = True
+
+    def refresh_due(self) -> int:
+        """Recompute one batch of dirty or stale users, committing each. Returns the number of users refreshed."""
+        claimed_at = datetime.utcnow()
+        cutoff = claimed_at - timedelta(seconds=self.staleness_seconds)
+        # Clearing `dirty` and moving `computed_at` takes the users off the queue. Changes
+        # committed while they are recomputed set `dirty` again, and the result is then not saved.
+        due = (
+            select(UserRecommendationState.user_id)
+            .where(or_(UserRecommendationState.dirty, UserRecommendationState.computed_at < cutoff))
+            .order_by(UserRecommendationState.dirty.desc(), UserRecommendationState.computed_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        user_ids = db.session.execute(
+            update(UserRecommendationState)
+            .where(UserRecommendationState.user_id.in_(due))
+            .values(computed_at=claimed_at, dirty=False)
+            .returning(UserRecommendationState.user_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.session.commit()
+        for position, user_id in enumerate(user_ids):
+            try:
+                self._store(user_id, computed_before=claimed_at)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Back on the queue for the next run
+                db.session.execute(
+                    update(UserRecommendationState)
+                    .where(UserRecommendationState.user_id.in_(user_ids[position:]))
+                    .values(dirty=True)
+                )
+                db.session.commit()
+                raise
+        return len(user_ids)
+
+    def listen(self, session_class=Session) -> None:
+        """Register the session events that wake the refresher after enrollment changes commit."""
+        for name, listener in (('after_commit', self._after_commit), ('after_rollback', self._after_rollback)):
+            if not event.contains(session_class, name, listener):
+                event.listen(session_class, name, listener)
+
+    def start(self, app: Flask) -> None:
+        """Start the background refresher of this worker, unless it is disabled or already running."""
+        if self.refresh_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='recommendation-refresher', daemon=True)
+        self._thread.start()
+
+    def _run(self, app: Flask) -> None:
+        while True:
+            self._wakeup.wait(self.refresh_seconds)
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    while self.refresh_due() == self.batch_size:
+                        pass
+                except Exception as e:
+                    print(f"Refreshing recommendations failed: {e}")
+                    db.session.rollback()
+
+    def save(self, reward_ids_by_user: Dict[UUID, List[UUID]],
+             computed_before: Optional[datetime] = None) -> List[UUID]:
+        """Replace the stored recommendations of several users, in the current transaction.
+        With `computed_before`, users who are dirty or whose entry was computed after it are
+        skipped, so that an older result never replaces a newer one. Returns the users saved."""
+        if not reward_ids_by_user:
+            return []
+        now = datetime.utcnow()
+        statement = pg_insert(UserRecommendationState).values([
+            {'user_id': user_id, 'computed_at': now, 'dirty': False} for user_id in reward_ids_by_user
+        ])
+        saved = db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={'computed_at': statement.excluded.computed_at, 'dirty': False},
+            where=None if computed_before is None else and_(
+                UserRecommendationState.computed_at <= computed_before, ~UserRecommendationState.dirty,
+            ),
+        ).returning(UserRecommendationState.user_id)).scalars().all()
+        if not saved:
+            return []
+        db.session.execute(delete(UserRecommendation).where(UserRecommendation.user_id.in_(saved)))
+        rows = [
+            {'user_id': user_id, 'position': position, 'reward_id': reward_id}
+            for user_id in saved
+            for position, reward_id in enumerate(reward_ids_by_user[user_id])
+        ]
+        if rows:
+            db.session.execute(insert(UserRecommendation), rows)
+        return saved
+
+    def _store(self, user_id: UUID, computed_before: Optional[datetime] = None) -> List[BusinessRecommendation]:
+        recommendations = self.service.get_recommendations_for_user(user_id) or []
+        self.save({user_id: [recommendation.reward.id for recommendation in recommendations]}, computed_before)
+        return recommendations
+
+    def _after_commit(self, session: Session) -> None:
+        if session.info.pop(self._stale_key, False):
+            self._wakeup.set()
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._stale_key, None)
+
+
+user_recommendations = UserRecommendationStore(
+    create_recommendation_service(Config.RECOMMENDATION_BACKEND),
+    staleness_seconds=Config.RECOMMENDATION_STALENESS_SECONDS,
+    refresh_seconds=Config.RECOMMENDATION_REFRESH_SECONDS,
+    batch_size=Config.RECOMMENDATION_REFRESH_BATCH_SIZE,
+)
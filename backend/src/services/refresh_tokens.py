@@ -0,0 +1,88 @@
+from typing import Optional, Tuple
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+import hashlib
+import secrets
+from sqlalchemy import delete, select, update
+from src.config import Config
+from src.db.connection import db
+from src.db.models import RefreshToken
+
+
+def _hash_token(token: str) -> str:
+    # Refresh tokens are 256 random bits, so a plain SHA-256 is enough to store them safely
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RefreshTokenService:
+    """Opaque refresh tokens, stored hashed and rotated on every use.
+
+    Each use marks the presented token as used and issues a successor in the same family.
+    Presenting a used token again means it leaked, so the whole family is revoked and the
+    user has to sign in again.
+    """
+
+    def __init__(self, ttl: timedelta = timedelta(days=30)):
+        self.ttl = ttl
+
+    def issue(self, user_id: UUID, family_id: Optional[UUID] = None) -> str:
+        """Add a new refresh token to the session and return it. The caller commits."""
+        token = secrets.token_urlsafe(32)
+        db.session.add(RefreshToken(
+            user_id=user_id,
+            token_hash=_hash_token(token),
+            family_id=family_id or uuid4(),
+            expires_at=datetime.utcnow() + self.ttl,
+        ))
+        return token
+
+    def rotate(self, token: str) -> Optional[Tuple[UUID, str]]:
+        """Exchange a refresh token for a new one. Returns the user id and the new token, or None."""
+        token_hash = _hash_token(token)
+        now = datetime.utcnow()
+        # Marking the token as used in the same statement that finds it lets only one of
+        # several concurrent refreshes with the same token succeed
+        row = db.session.execute(
+            update(RefreshToken)
+            .where(RefreshToken.token_hash == token_hash,
+                   RefreshToken.used_at.is_(None),
+                   RefreshToken.expires_at > now)
+            .values(used_at=now)
+            .returning(RefreshToken.user_id, RefreshToken.family_id)
+        ).first()
+        if row is None:
+            family_id = db.session.execute(
+                select(RefreshToken.family_id)
+                .where(RefreshToken.token_hash == token_hash, RefreshToken.used_at.is_not(None))
+            ).scalar()
+            if family_id is not None:
+                print(f"Refresh token reused, revoking token family {family_id}")
+                self._revoke_family(family_id)
+            db.session.commit()
+            return None
+
+        new_token = self.issue(row.user_id, row.family_id)
+        db.session.commit()
+        return row.user_id, new_token
+
+    def revoke(self, token: str, user_id: UUID) -> None:
+        """Revoke the family of a refresh token owned by `user_id`."""
+        family_id = db.session.execute(
+            select(RefreshToken.family_id)
+            .where(RefreshToken.token_hash == _hash_token(token), RefreshToken.user_id == user_id)
+        ).scalar()
+        if family_id is not None:
+            self._revoke_family(family_id)
+        db.session.commit()
+
+    def purge(self) -> int:
+        """Delete refresh tokens that have expired."""
+        result = db.session.execute(delete(RefreshToken).where(RefreshToken.expires_at < datetime.utcnow()))
+        db.session.commit()
+        return result.rowcount
+
+    def _revoke_family(self, family_id: UUID) -> None:
+        db.session.execute(delete(RefreshToken).where(RefreshToken.family_id == family_id))
+
+
+refresh_token_service = RefreshTokenService(Config.JWT_REFRESH_TOKEN_EXPIRES)
@@ -0,0 +1,113 @@
+from typing import Hashable, NamedTuple, Optional
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import threading
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessDetails, Enrollment, Reward, response_cache_version
+
+# Commits touching these models change catalog responses
+_WATCHED_MODELS = (BusinessDetails, Reward, Enrollment)
+
+
+class CachedResponse(NamedTuple):
+    version: int
+    etag: str
+    body: bytes
+    mimetype: str
+    # When the body goes stale without a commit, e.g. because a listed reward expires (naive UTC)
+    expires_at: Optional[datetime] = None
+
+
+class ResponseCache:
+    """Bounded LRU cache of rendered responses with strong ETags.
+
+    Entries are tagged with the value of the `response_cache_version` sequence they were
+    rendered under. Session events bump the sequence after each commit that touches a
+    watched model, which invalidates the entries of every worker at once.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Session.info key, per instance so that several caches can listen at once
+        self._dirty_key = ('response_cache_dirty', id(self))
+
+    def current_version(self) -> int:
+        """Read the current cache version from its sequence."""
+        # A sequence that was never bumped reports its start value as last_value, like after its first bump
+        return db.session.execute(text(
+            f'SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {response_cache_version.name}'
+        )).scalar()
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedResponse]:
+        """Return the entry for `key` if it was rendered under `version`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            if entry.expires_at is not None and entry.expires_at <= datetime.utcnow():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, version: int, body: bytes, mimetype: str,
+            expires_at: Optional[datetime] = None) -> CachedResponse:
+        """Store a rendered response body and return the entry with its ETag."""
+        entry = CachedResponse(version, hashlib.sha256(body).hexdigest(), body, mimetype, expires_at)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, session: Session) -> None:
+        """Bump the cache version outside the session's (finished) transaction."""
+        with session.get_bind().begin() as connection:
+            connection.execute(select(response_cache_version.next_value()))
+        with self._lock:
+            self._entries.clear()
+
+    def mark_dirty(self, session: Session) -> None:
+        """Invalidate the cache when the session commits, for writes its events do not see."""
+        session.info[self._dirty_key] = True
+
+    def listen(self, session_class=Session) -> None:
+        """Register the session events that invalidate the cache on relevant commits."""
+        for name, listener in (
+            ('after_flush', self._after_flush),
+            ('do_orm_execute', self._do_orm_execute),
+            ('after_commit', self._after_commit),
+            ('after_rollback', self._after_rollback),
+        ):
+            if not event.contains(session_class, name, listener):
+                event.listen(session_class, name, listener)
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        if any(isinstance(instance, _WATCHED_MODELS)
+               for instance in (*session.new, *session.dirty, *session.deleted)):
+            session.info[self._dirty_key] = True
+
+    def _do_orm_execute(self, orm_execute_state) -> None:
+        # Bulk UPDATE/DELETE statements bypass the unit of work and never show up in a flush
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, _WATCHED_MODELS):
+            orm_execute_state.session.info[self._dirty_key] = True
+
+    def _after_commit(self, session: Session) -> None:
+        if session.info.pop(self._dirty_key, False):
+            self.invalidate(session)
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._dirty_key, None)
+
+
+response_cache = ResponseCache(Config.RESPONSE_CACHE_MAX_ENTRIES)
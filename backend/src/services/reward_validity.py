@@ -0,0 +1,29 @@
+from typing import Iterable, List, Optional
+from datetime import datetime
+from src.db.models import Reward
+
+# Rewards are active from `valid_from_timestamp` (inclusive) until `valid_until_timestamp`
+# (exclusive, NULL for never). Timestamps are naive UTC, like the column defaults.
+# src.db.queries has the matching SQL criteria.
+
+
+def is_active(reward: Reward, now: datetime) -> bool:
+    """Whether `reward` can be recommended and redeemed at `now`."""
+    return (reward.valid_from_timestamp <= now
+            and (reward.valid_until_timestamp is None or reward.valid_until_timestamp > now))
+
+
+def active_rewards(rewards: Iterable[Reward], now: datetime) -> List[Reward]:
+    """The rewards of `rewards` that are active at `now`."""
+    return [reward for reward in rewards if is_active(reward, now)]
+
+
+def next_change(rewards: Iterable[Reward], now: datetime) -> Optional[datetime]:
+    """First time after `now` when one of `rewards` starts or expires, or None if none will."""
+    return min(
+        (timestamp
+         for reward in rewards
+         for timestamp in (reward.valid_from_timestamp, reward.valid_until_timestamp)
+         if timestamp is not None and timestamp > now),
+        default=None,
+    )
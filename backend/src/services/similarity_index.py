@@ -0,0 +1,204 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+from uuid import UUID
+from sqlalchemy import and_, delete, literal, or_, select, text, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BusinessCoEnrollment, BusinessDetails, CoEnrollmentIndexState, Enrollment
+from src.services.business_similarity import BusinessSimilarityService
+
+# Held until the enrollment change commits, so that concurrent changes of one user see each other's rows
+_USER_LOCK = text("SELECT pg_advisory_xact_lock(hashtext('business_co_enrollment:' || :user_id))")
+
+# Makes enrollment changes that have not written their counts yet wait until a rebuild commits
+_REBUILD_LOCK = text(f"LOCK TABLE {BusinessCoEnrollment.__tablename__} IN EXCLUSIVE MODE")
+
+class CoEnrollmentIndex:
+    """Per-business member counts and pairwise co-enrollment counts stored in `business_co_enrollment`.
+
+    Updates run inside the caller's transaction, so the index commits together with the
+    enrollment change that caused it. They only run when `maintained`, i.e. when the index
+    serves similarity; `co_enrollment_index_state` records whether it was kept current, so
+    that a worker switched to the index rebuilds it first.
+    """
+
+    def __init__(self, maintained: bool = True):
+        self.maintained = maintained
+
+    def record_enrollment(self, user_id: UUID, business_id: UUID) -> None:
+        """Add a flushed enrollment to the index in O(user's enrollment count)."""
+        if not self.maintained:
+            return
+        db.session.execute(_USER_LOCK, {'user_id': str(user_id)})
+        pairs = union_all(
+            select(literal(business_id), Enrollment.business_id, literal(1))
+            .where(Enrollment.user_id == user_id),
+            select(Enrollment.business_id, literal(business_id), literal(1))
+            .where(Enrollment.user_id == user_id, Enrollment.business_id != business_id),
+        )
+        statement = insert(BusinessCoEnrollment).from_select(
+            ['business_id', 'other_business_id', 'shared_count'], pairs
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['business_id', 'other_business_id'],
+            set_={'shared_count': BusinessCoEnrollment.shared_count + 1},
+        ))
+
+    def record_cancellation(self, user_id: UUID, business_id: UUID) -> None:
+        """Remove an enrollment from the index. Must run before the enrollment row is deleted."""
+        if not self.maintained:
+            return
+        db.session.execute(_USER_LOCK, {'user_id': str(user_id)})
+        user_business_ids = select(Enrollment.business_id).where(Enrollment.user_id == user_id)
+        affected_rows = or_(
+            and_(BusinessCoEnrollment.business_id == business_id,
+                 BusinessCoEnrollment.other_business_id.in_(user_business_ids)),
+            and_(BusinessCoEnrollment.other_business_id == business_id,
+                 BusinessCoEnrollment.business_id != business_id,
+                 BusinessCoEnrollment.business_id.in_(user_business_ids)),
+        )
+        db.session.execute(
+            update(BusinessCoEnrollment)
+            .where(affected_rows)
+            .values(shared_count=BusinessCoEnrollment.shared_count - 1)
+        )
+        db.session.execute(
+            delete(BusinessCoEnrollment)
+            .where(BusinessCoEnrollment.shared_count <= 0,
+                   or_(BusinessCoEnrollment.business_id == business_id,
+                       BusinessCoEnrollment.other_business_id == business_id))
+        )
+
+    def rebuild(self) -> int:
+        """Recompute the whole index from the enrollment table, and commit. Returns the number of rows written."""
+        rows = self._rebuild()
+        self._record_state()
+        db.session.commit()
+        return rows
+
+    def ensure_current(self) -> bool:
+        """Rebuild the index if this worker maintains it but it was not kept current, e.g. after
+        SIMILARITY_BACKEND was switched to 'index', and record whether it is maintained from now
+        on. Commits. Returns whether the index was rebuilt."""
+        was_maintained = db.session.execute(
+            select(CoEnrollmentIndexState.maintained).with_for_update()
+        ).scalar()
+        rebuilt = self.maintained and not was_maintained
+        if rebuilt:
+            self._rebuild()
+        self._record_state()
+        db.session.commit()
+        return rebuilt
+
+    def _record_state(self) -> None:
+        statement = insert(CoEnrollmentIndexState).values(id=1, maintained=self.maintained)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['id'], set_={'maintained': statement.excluded.maintained},
+        ))
+
+    def _rebuild(self) -> int:
+        db.session.execute(_REBUILD_LOCK)
+        db.session.execute(delete(BusinessCoEnrollment))
+        memberships = select(Enrollment.user_id, Enrollment.business_id).distinct().subquery()
+        other_memberships = select(Enrollment.user_id, Enrollment.business_id).distinct().subquery()
+        pairs = (
+            select(memberships.c.business_id, other_memberships.c.business_id, db.func.count())
+            .join(other_memberships, memberships.c.user_id == other_memberships.c.user_id)
+            .group_by(memberships.c.business_id, other_memberships.c.business_id)
+        )
+        result = db.session.execute(
+            insert(BusinessCoEnrollment).from_select(['business_id', 'other_business_id', 'shared_count'], pairs)
+        )
+        return result.rowcount
+
+    def load_counts(self, business_id: Optional[UUID] = None) -> Tuple[Dict[UUID, int], Dict[UUID, Dict[UUID, int]]]:
+        """Load member counts and intersection counts, for one business or for all of them."""
+        query = select(
+            BusinessCoEnrollment.business_id,
+            BusinessCoEnrollment.other_business_id,
+            BusinessCoEnrollment.shared_count,
+        )
+        if business_id is not None:
+            query = query.where(or_(
+                BusinessCoEnrollment.business_id == business_id,
+                BusinessCoEnrollment.business_id == BusinessCoEnrollment.other_business_id,
+            ))
+
+        sizes: Dict[UUID, int] = {}
+        intersections: Dict[UUID, Dict[UUID, int]] = defaultdict(dict)
+        for row_business_id, other_business_id, shared_count in db.session.execute(query):
+            if row_business_id == other_business_id:
+                sizes[row_business_id] = shared_count
+            else:
+                intersections[row_business_id][other_business_id] = shared_count
+        return sizes, intersections
+
+    def load_counts_for(self, business_ids: List[UUID]) -> Tuple[Dict[UUID, int], Dict[UUID, Dict[UUID, int]]]:
+        """Intersection counts of a few businesses, and member counts of them and the businesses they share users with."""
+        intersections: Dict[UUID, Dict[UUID, int]] = defaultdict(dict)
+        for business_id, other_business_id, shared_count in db.session.execute(
+            select(BusinessCoEnrollment.business_id, BusinessCoEnrollment.other_business_id, BusinessCoEnrollment.shared_count)
+            .where(BusinessCoEnrollment.business_id.in_(business_ids),
+                   BusinessCoEnrollment.other_business_id != BusinessCoEnrollment.business_id)
+        ):
+            intersections[business_id][other_business_id] = shared_count
+        counted = set(business_ids).union(*(target.keys() for target in intersections.values()))
+        sizes = dict(db.session.execute(
+            select(BusinessCoEnrollment.business_id, BusinessCoEnrollment.shared_count)
+            .where(BusinessCoEnrollment.business_id.in_(counted),
+                   BusinessCoEnrollment.other_business_id == BusinessCoEnrollment.business_id)
+        ).all())
+        return sizes, intersections
+
+
+class IndexedBusinessSimilarityService(BusinessSimilarityService):
+    """Similarity served from the precomputed co-enrollment index instead of raw enrollments."""
+
+    def __init__(self, max_similar: int = 3, index: Optional[CoEnrollmentIndex] = None):
+        super().__init__(max_similar)
+        self.index = index or CoEnrollmentIndex()
+
+    def get_similar_businesses(self, target_business_id: UUID, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment] = None) -> List[BusinessDetails]:
+        """Find similar businesses from the index. `enrollments` is ignored."""
+        sizes, intersections = self.index.load_counts(target_business_id)
+        return self._get_top_similar_from_index(target_business_id, businesses, sizes, intersections)
+
+    def get_all_similar_businesses(self, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment] = None) -> Dict[UUID, List[BusinessDetails]]:
+        """Find similar businesses for every business from the index. `enrollments` is ignored."""
+        sizes, intersections = self.index.load_counts()
+        positions = {business.id: position for position, business in enumerate(businesses)}
+        return {
+            business.id: self._get_top_similar_from_index(business.id, businesses, sizes, intersections, positions)
+            for business in businesses
+        }
+
+    def _load_intersections_for(self, business_ids: List[UUID]) -> Tuple[Dict[UUID, int], Dict[UUID, Dict[UUID, int]]]:
+        """Member counts and shared user counts of `business_ids`, read from the index."""
+        return self.index.load_counts_for(business_ids)
+
+    def find_inconsistencies(self, businesses: List[BusinessDetails], enrollments: Iterable[Enrollment]) -> List[UUID]:
+        """Compare the index against BusinessSimilarityService and return the IDs of businesses that differ."""
+        expected = BusinessSimilarityService(self.max_similar).get_all_similar_businesses(businesses, enrollments)
+        actual = self.get_all_similar_businesses(businesses)
+        return [
+            business.id for business in businesses
+            if [b.id for b in expected[business.id]] != [b.id for b in actual[business.id]]
+        ]
+
+    def _get_top_similar_from_index(self, target_business_id: UUID, businesses: List[BusinessDetails],
+                                    sizes: Dict[UUID, int], intersections: Dict[UUID, Dict[UUID, int]],
+                                    positions: Optional[Dict[UUID, int]] = None) -> List[BusinessDetails]:
+        """Get top N most similar businesses for the target from index counts."""
+        if len(businesses) <= 1 or not sizes.get(target_business_id):
+            return []
+        if positions is None:
+            positions = {business.id: position for position, business in enumerate(businesses)}
+        if target_business_id not in positions:
+            return []
+        return self._get_top_similar_from_intersections(
+            target_business_id, businesses, positions, sizes, intersections.get(target_business_id, {})
+        )
+
+
+co_enrollment_index = CoEnrollmentIndex(maintained=Config.SIMILARITY_BACKEND == 'index')
@@ -0,0 +1,180 @@
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import math
+import threading
+import time
+from flask import Flask
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from src.config import Config
+from src.db.connection import db
+from src.db.models import BlacklistedToken
+
+# Serial IDs are allocated before commit, so a slow transaction can commit an ID below one
+# that was already synced; each sync re-reads this many IDs below the last one it saw
+_SYNC_ID_OVERLAP = 256
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys.
+
+    Bit positions come from double hashing of Python's built-in (SipHash) string hash. That
+    hash is randomized per process, which is fine since the filter never leaves the process.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: str) -> None:
+        value = hash(key)
+        position, step = value % self.size, (value >> 20) % self.size | 1
+        for _ in range(self.hash_count):
+            self._bits[position >> 3] |= 1 << (position & 7)
+            position = (position + step) % self.size
+
+    def __contains__(self, key: str) -> bool:
+        # Hot path of every authenticated request. Most keys are absent, and the first unset
+        # bit proves it, so the first probe is checked before setting up the loop.
+        value = hash(key)
+        bits, size = self._bits, self.size
+        position = value % size
+        if not bits[position >> 3] & (1 << (position & 7)):
+            return False
+        step = (value >> 20) % size | 1
+        for _ in range(self.hash_count - 1):
+            position = (position + step) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def token_id(token: str, payload: Dict[str, Any]) -> str:
+    """Revocation key of a decoded token: its `jti`, or its SHA-256 for tokens issued without one."""
+    return payload.get('jti') or hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenRevocationStore:
+    """Revoked token IDs, with the `blacklisted_tokens` table as the source of truth.
+
+    A Bloom filter holds every unexpired revoked ID this worker knows about, so the common
+    case (a token that was never revoked) is answered without touching the database. Filter
+    hits are confirmed against a small exact cache and then the unique `jti` index. Every
+    `sync_seconds` the worker picks up rows revoked by other workers. A background thread
+    deletes rows past their expiry and rebuilds the filter every `purge_seconds`, so that
+    no request pays for it.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001, exact_size: int = 4096,
+                 sync_seconds: float = 2, purge_seconds: float = 3600):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_size = exact_size
+        self.sync_seconds = sync_seconds
+        self.purge_seconds = purge_seconds
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._exact: 'OrderedDict[str, bool]' = OrderedDict()
+        self._last_id: Optional[int] = None
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def revoke(self, jti: str, expires_at: datetime) -> None:
+        """Revoke a token in the current transaction and commit it. Revoking twice is a no-op."""
+        db.session.execute(
+            insert(BlacklistedToken)
+            .values(jti=jti, expires_at=expires_at, blacklisted_on=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=['jti'])
+        )
+        db.session.commit()
+        self._bloom.add(jti)
+        self._remember(jti, True)
+
+    def is_revoked(self, jti: str) -> bool:
+        """Check whether a token ID has been revoked."""
+        self._refresh_if_due()
+        if jti not in self._bloom:
+            return False
+        revoked = self._exact.get(jti)
+        if revoked is None:
+            revoked = db.session.execute(
+                select(BlacklistedToken.id).where(BlacklistedToken.jti == jti)
+            ).first() is not None
+            self._remember(jti, revoked)
+        return revoked
+
+    def purge(self) -> int:
+        """Delete revocations of tokens that have expired anyway, then rebuild the filter."""
+        result = db.session.execute(delete(BlacklistedToken).where(BlacklistedToken.expires_at < datetime.utcnow()))
+        db.session.commit()
+        with self._lock:
+            self._reload()
+        return result.rowcount
+
+    def start(self, app: Flask) -> None:
+        """Start the background purge of this worker, unless it is disabled or already running."""
+        if self.purge_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='revocation-purge', daemon=True)
+        self._thread.start()
+
+    def _run(self, app: Flask) -> None:
+        while True:
+            time.sleep(self.purge_seconds)
+            with app.app_context():
+                try:
+                    self.purge()
+                except Exception as e:
+                    print(f"Purging revoked tokens failed: {e}")
+                    db.session.rollback()
+
+    def _refresh_if_due(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        with self._lock:
+            if now >= self._next_sync:
+                self._sync()
+
+    def _reload(self) -> None:
+        rows = db.session.execute(select(BlacklistedToken.id, BlacklistedToken.jti)).all()
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        for _, jti in rows:
+            bloom.add(jti)
+        self._bloom = bloom
+        self._exact = OrderedDict((jti, revoked) for jti, revoked in self._exact.items() if revoked)
+        self._last_id = max((row_id for row_id, _ in rows), default=0)
+        self._next_sync = time.monotonic() + self.sync_seconds
+
+    def _sync(self) -> None:
+        if self._last_id is None:
+            self._reload()
+            return
+        rows = db.session.execute(
+            select(BlacklistedToken.id, BlacklistedToken.jti)
+            .where(BlacklistedToken.id > self._last_id - _SYNC_ID_OVERLAP)
+        ).all()
+        for row_id, jti in rows:
+            if self._exact.get(jti) is False:
+                del self._exact[jti]
+            self._bloom.add(jti)
+            self._last_id = max(self._last_id, row_id)
+        self._next_sync = time.monotonic() + self.sync_seconds
+
+    def _remember(self, jti: str, revoked: bool) -> None:
+        self._exact[jti] = revoked
+        self._exact.move_to_end(jti)
+        while len(self._exact) > self.exact_size:
+            self._exact.popitem(last=False)
+
+
+token_revocation_store = TokenRevocationStore(
+    Config.REVOCATION_BLOOM_CAPACITY,
+    Config.REVOCATION_BLOOM_ERROR_RATE,
+    sync_seconds=Config.REVOCATION_SYNC_SECONDS,
+    purge_seconds=Config.REVOCATION_PURGE_SECONDS,
+)
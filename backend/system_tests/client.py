@@ -5,6 +5,7 @@ from src.api_schemas import (
     CreateRewardRequest,
     UpdateRewardRequest,
     AddPointsRequest,
+    BulkAddPointsRequest,
     RedeemRewardRequest,
     UpsertBusinessRequest
 )
@@ -18,11 +19,18 @@ class AppBackendRequester:
     def __init__(self, base_url: str):
         self.base_url = base_url
         self.token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
         
     def _headers(self) -> dict:
         if self.token:
             return {"Authorization": f"Bearer {self.token}"}
         return {}
+
+    def _idempotent_headers(self, idempotency_key: Optional[str]) -> dict:
+        headers = self._headers()
+        if idempotency_key is not None:
+            headers["Idempotency-Key"] = idempotency_key
+        return headers
         
     def register(self, user_data: CreateUserRequest) -> requests.Response:
         response = requests.post(
@@ -31,6 +39,7 @@ class AppBackendRequester:
         )
         if response.ok:
             self.token = response.json()["access_token"]
+            self.refresh_token = response.json()["refresh_token"]
         return response
         
     def login(self, login_data: LoginUserRequest) -> requests.Response:
@@ -40,15 +49,28 @@ class AppBackendRequester:
         )
         if response.ok:
             self.token = response.json()["access_token"]
+            self.refresh_token = response.json()["refresh_token"]
+        return response
+        
+    def refresh(self) -> requests.Response:
+        response = requests.post(
+            f"{self.base_url}/auth/refresh",
+            json={"refresh_token": self.refresh_token}
+        )
+        if response.ok:
+            self.token = response.json()["access_token"]
+            self.refresh_token = response.json()["refresh_token"]
         return response
         
     def logout(self) -> requests.Response:
         response = requests.post(
             f"{self.base_url}/auth/logout",
-            headers=self._headers()
+            headers=self._headers(),
+            json={"refresh_token": self.refresh_token}
         )
         if response.ok:
             self.token = None
+            self.refresh_token = None
         return response
 
     def get_current_user_details(self) -> requests.Response:
@@ -58,10 +80,25 @@ class AppBackendRequester:
         )
         return response
         
-    def list_businesses(self) -> requests.Response:
+    def list_businesses(self, etag: Optional[str] = None) -> requests.Response:
+        headers = self._headers()
+        if etag:
+            headers["If-None-Match"] = etag
         return requests.get(
             f"{self.base_url}/businesses",
-            headers=self._headers()
+            headers=headers
+        )
+        
+    def list_businesses_page(self, limit: int, after: Optional[str] = None, expand: Optional[str] = None) -> requests.Response:
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+        if expand:
+            params["expand"] = expand
+        return requests.get(
+            f"{self.base_url}/businesses",
+            headers=self._headers(),
+            params=params
         )
         
     def upsert_business(self, upsert_business_request: UpsertBusinessRequest) -> requests.Response:
@@ -71,6 +108,12 @@ class AppBackendRequester:
             json=upsert_business_request.model_dump(mode="json")
         )
         
+    def get_business_enrollments(self) -> requests.Response:
+        return requests.get(
+            f"{self.base_url}/businesses/enrollments",
+            headers=self._headers()
+        )
+        
     def create_reward(self, reward_details: CreateRewardRequest) -> requests.Response:
         return requests.post(
             f"{self.base_url}/businesses/rewards",
@@ -109,17 +152,24 @@ class AppBackendRequester:
             headers=self._headers()
         )
 
-    def add_points(self, points_data: AddPointsRequest) -> requests.Response:
+    def add_points(self, points_data: AddPointsRequest, idempotency_key: Optional[str] = None) -> requests.Response:
         return requests.post(
             f"{self.base_url}/enrollments/add_points",
-            headers=self._headers(),
+            headers=self._idempotent_headers(idempotency_key),
             json=points_data.model_dump(mode="json")
         )
 
-    def redeem_reward(self, redeem_data: RedeemRewardRequest) -> requests.Response:
+    def add_points_bulk(self, bulk_data: BulkAddPointsRequest) -> requests.Response:
         return requests.post(
-            f"{self.base_url}/enrollments/redeem_reward",
+            f"{self.base_url}/enrollments/add_points/bulk",
             headers=self._headers(),
+            json=bulk_data.model_dump(mode="json")
+        )
+
+    def redeem_reward(self, redeem_data: RedeemRewardRequest, idempotency_key: Optional[str] = None) -> requests.Response:
+        return requests.post(
+            f"{self.base_url}/enrollments/redeem_reward",
+            headers=self._idempotent_headers(idempotency_key),
             json=redeem_data.model_dump(mode="json"),
         )
 
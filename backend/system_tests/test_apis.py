@@ -1,19 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from decimal import Decimal
 from src.main import create_app
 import pytest
+import threading
+import time
 import uuid
+from sqlalchemy import event, text, update
+from sqlalchemy.orm import Session
 from src.api_schemas import (
+    BusinessDetailsModel,
+    EnrollmentModel,
+    RewardModel,
+    UserModel,
     CreateUserRequest,
     LoginUserRequest,
 
     CreateRewardRequest,
     AddPointsRequest,
+    BulkAddPointsRequest,
     RedeemRewardRequest,
     UpsertBusinessRequest
 )
 from client import AppBackendRequester, TestConfig
+from flask import jsonify
+from src.config import Config
 from src.db.connection import db
-from src.db.models import User, BusinessDetails, Enrollment, Reward, BlacklistedToken
+from src.db.models import (
+    User, BusinessDetails, Enrollment, Reward, BlacklistedToken, BusinessCoEnrollment, RefreshToken,
+    UserRecommendationState, PointsTransaction, RewardUsageSlot, IdempotencyKey,
+)
+from src.db.queries import (
+    business_enrollments_with_users,
+    businesses_with_rewards,
+    user_enrollments_with_businesses,
+)
+from src.serialization import (
+    business_details_encoder,
+    dumps,
+    enrollment_encoder,
+    json_response,
+    reward_encoder,
+    stream_json_array,
+    user_encoder,
+)
+from src.services.idempotency import IdempotencyStore, idempotency_store
+from src.services.password_hashing import PasswordHasher
+from src.services.points import PointsService
+from src.services.principal_cache import PrincipalCache, principal_cache
+from src.services.response_cache import ResponseCache
+from src.services.business_recommendation import BusinessRecommendationService
+from src.services.business_recommendation_sql import SqlBusinessRecommendationService
+from src.services.recommendation_batch import BatchRecommendationService
+from src.services.recommendation_index import CategoryIndex, IndexedBusinessRecommendationService
+from src.services.recommendation_store import UserRecommendationStore
+from src.services.token_revocation import BloomFilter, token_revocation_store
+from src.services.business_similarity import BusinessSimilarityService, create_similarity_service
+from src.services.similarity_index import CoEnrollmentIndex, IndexedBusinessSimilarityService, co_enrollment_index
 
 
 @pytest.fixture(autouse=True)
@@ -26,10 +69,16 @@ def app():
 def cleanup_database(app):
     yield
     # Truncate all tables after each test
+    db.session.query(PointsTransaction).delete()
     db.session.query(Enrollment).delete()
+    db.session.query(BusinessCoEnrollment).delete()
+    db.session.query(UserRecommendationState).delete()
+    db.session.query(RewardUsageSlot).delete()
+    db.session.query(IdempotencyKey).delete()
     db.session.query(Reward).delete()
     db.session.query(BusinessDetails).delete()
     db.session.query(BlacklistedToken).delete()
+    db.session.query(RefreshToken).delete()
     db.session.query(User).delete()
     db.session.commit()
 
@@ -440,3 +489,1054 @@ def test_business_recommendations(client):
     assert recommendation["reward"]["name"] == "Free Dessert"
 
 
+def _create_co_enrolled_businesses(client):
+    # Create three businesses
+    for index in range(3):
+        client.token = None
+        business_username = f"business_user{index}_{uuid.uuid4()}"
+        business_user = CreateUserRequest(
+            username=business_username,
+            password="password123",
+            email_address=f"{business_username}@test.com",
+            is_business_owner=True
+        )
+        response = client.register(business_user)
+        assert response.status_code == 200
+
+        response = client.upsert_business(UpsertBusinessRequest(
+            business_name=f"Business {index}",
+            email_address=f"business{index}@test.com"
+        ))
+        assert response.status_code == 200
+
+    response = client.list_businesses()
+    assert response.status_code == 200
+    business_ids = [
+        next(b["details"]["id"] for b in response.json() if b["details"]["business_name"] == f"Business {index}")
+        for index in range(3)
+    ]
+
+    # Customers enroll in overlapping sets of businesses
+    for enrolled_indexes in [(0, 1), (0, 1, 2), (1, 2), (2,)]:
+        client.token = None
+        customer_username = f"customer_{uuid.uuid4()}"
+        response = client.register(CreateUserRequest(
+            username=customer_username,
+            password="password123",
+            email_address=f"{customer_username}@test.com",
+            is_business_owner=False
+        ))
+        assert response.status_code == 200
+        for index in enrolled_indexes:
+            response = client.enroll_to_business(business_ids[index])
+            assert response.status_code == 200
+
+    return business_ids
+
+
+def _create_business_with_customers(client, customers, points_snapshot, required_points=None, usage_count_base=0):
+    """Register an owner with business "Cafe A", and enroll `customers` new users in it with `points_snapshot`
+    points. Adds a reward costing `required_points` unless it is None. Returns the reward id, customer ids
+    and enrollment ids."""
+    owner_username = f"business_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=owner_username,
+        password="password123",
+        email_address=f"{owner_username}@test.com",
+        is_business_owner=True
+    ))
+    assert response.status_code == 200
+    response = client.upsert_business(UpsertBusinessRequest(business_name="Cafe A", email_address="business@test.com"))
+    assert response.status_code == 200
+    business = BusinessDetails.query.filter_by(business_name="Cafe A").one()
+    reward = None
+    if required_points is not None:
+        reward = Reward(business_id=business.id, name="Coffee", required_points=required_points,
+                        usage_count_base=usage_count_base)
+        db.session.add(reward)
+    users = [
+        User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+        for _ in range(customers)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    enrollments = [Enrollment(user_id=user.id, business_id=business.id, points_snapshot=points_snapshot) for user in users]
+    db.session.add_all(enrollments)
+    db.session.commit()
+    return (reward.id if reward else None), [user.id for user in users], [enrollment.id for enrollment in enrollments]
+
+
+def test_all_similar_businesses_matches_per_business(client):
+    _create_co_enrolled_businesses(client)
+
+    # Batch similarities match the per-business computation
+    similarity_service = BusinessSimilarityService()
+    businesses = BusinessDetails.query.all()
+    enrollments = Enrollment.query.all()
+    all_similar = similarity_service.get_all_similar_businesses(businesses, enrollments)
+    for business in businesses:
+        expected = similarity_service.get_similar_businesses(business.id, businesses, enrollments)
+        assert [b.id for b in all_similar[business.id]] == [b.id for b in expected]
+
+def test_numpy_similarity_matches_python(client):
+    _create_co_enrolled_businesses(client)
+
+    businesses = BusinessDetails.query.all()
+    enrollments = Enrollment.query.all()
+    expected = create_similarity_service('python').get_all_similar_businesses(businesses, enrollments)
+    actual = create_similarity_service('numpy').get_all_similar_businesses(businesses, enrollments)
+    for business in businesses:
+        assert [b.id for b in actual[business.id]] == [b.id for b in expected[business.id]]
+
+@pytest.mark.skipif(Config.SIMILARITY_BACKEND != 'index', reason="enroll and cancel only maintain the index for the index backend")
+def test_co_enrollment_index_matches_similarity_service(client):
+    business_ids = _create_co_enrolled_businesses(client)
+
+    # The last customer cancels, which must be reflected in the index too
+    response = client.cancel_enrollment(business_ids[2])
+    assert response.status_code == 204
+
+    businesses = BusinessDetails.query.all()
+    enrollments = Enrollment.query.all()
+    assert IndexedBusinessSimilarityService().find_inconsistencies(businesses, enrollments) == []
+
+@pytest.mark.skipif(Config.SIMILARITY_BACKEND != 'index', reason="enroll and cancel only maintain the index for the index backend")
+def test_co_enrollment_index_external_writes(app, client):
+    business_ids = _create_co_enrolled_businesses(client)
+
+    # Enrollments deleted outside the routes bypass the index until it is rebuilt
+    db.session.query(Enrollment).filter_by(business_id=business_ids[2]).delete()
+    db.session.commit()
+    businesses = BusinessDetails.query.all()
+    assert IndexedBusinessSimilarityService().find_inconsistencies(businesses, Enrollment.query.all()) != []
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=["similarity", "check-index"]).exit_code != 0
+
+    result = runner.invoke(args=["similarity", "rebuild-index"])
+    assert result.exit_code == 0, result.output
+    assert runner.invoke(args=["similarity", "check-index"]).exit_code == 0
+    assert IndexedBusinessSimilarityService().find_inconsistencies(businesses, Enrollment.query.all()) == []
+
+def test_co_enrollment_index_maintenance(app):
+    owner = User(username=f"owner_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    customer = User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add_all([owner, customer])
+    db.session.flush()
+    businesses = [BusinessDetails(user_id=owner.id, business_name=f"Business {index}", email_address="b@test.com")
+                  for index in range(3)]
+    db.session.add_all(businesses)
+    db.session.commit()
+    customer_id = customer.id
+    a, b, c = (business.id for business in businesses)
+    index = CoEnrollmentIndex(maintained=True)
+
+    def enroll(business_id, barrier):
+        with app.app_context():
+            db.session.add(Enrollment(user_id=customer_id, business_id=business_id, points_snapshot=0))
+            db.session.flush()
+            barrier.wait()
+            index.record_enrollment(customer_id, business_id)
+            db.session.commit()
+
+    def cancel(business_id, barrier):
+        with app.app_context():
+            barrier.wait()
+            index.record_cancellation(customer_id, business_id)
+            Enrollment.query.filter_by(user_id=customer_id, business_id=business_id).delete()
+            db.session.commit()
+
+    try:
+        # A worker switched to the index rebuilds it, once
+        CoEnrollmentIndex(maintained=False).ensure_current()
+        assert index.ensure_current()
+        assert not index.ensure_current()
+
+        # Concurrent changes of one user see each other's enrollments
+        barrier = threading.Barrier(2)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(enroll, (a, b), (barrier, barrier)))
+        assert index.load_counts_for([a]) == ({a: 1, b: 1}, {a: {b: 1}})
+        barrier = threading.Barrier(2)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda change: change[0](change[1], barrier), ((cancel, a), (enroll, c))))
+        assert index.load_counts_for([a, b]) == ({b: 1, c: 1}, {b: {c: 1}})
+    finally:
+        co_enrollment_index.ensure_current()
+
+def test_sql_similarity_matches_python(client):
+    _create_co_enrolled_businesses(client)
+
+    businesses = BusinessDetails.query.all()
+    enrollments = Enrollment.query.all()
+    expected = create_similarity_service('python').get_all_similar_businesses(businesses, enrollments)
+    sql_service = create_similarity_service('sql')
+    actual = sql_service.get_all_similar_businesses(businesses)
+    for business in businesses:
+        assert [b.id for b in actual[business.id]] == [b.id for b in expected[business.id]]
+        assert [b.id for b in sql_service.get_similar_businesses(business.id, businesses)] == [b.id for b in expected[business.id]]
+
+def test_similar_for_page_matches_full_catalog(client):
+    _create_co_enrolled_businesses(client)
+    # Enroll and cancel only maintain the index for the index backend
+    co_enrollment_index.rebuild()
+
+    businesses = BusinessDetails.query.order_by(BusinessDetails.id).all()
+    enrollments = Enrollment.query.all()
+    expected = create_similarity_service('python').get_all_similar_businesses(businesses, enrollments)
+    business_ids = [business.id for business in businesses]
+    for backend in ('python', 'index', 'sql'):
+        service = create_similarity_service(backend)
+        for page in (business_ids, business_ids[:1], business_ids[1:]):
+            actual = service.get_similar_for(page)
+            assert {business_id: [b.id for b in similar] for business_id, similar in actual.items()} == \
+                {business_id: [b.id for b in expected[business_id]] for business_id in page}
+
+def test_list_businesses_pagination(client):
+    business_ids = _create_co_enrolled_businesses(client)
+
+    # Pages follow business id order and carry no expansions by default
+    response = client.list_businesses_page(limit=2)
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page["items"]) == 2
+    assert first_page["items"][0]["rewards"] is None
+    assert first_page["items"][0]["similar_businesses"] is None
+    assert first_page["next_cursor"] == first_page["items"][1]["details"]["id"]
+
+    response = client.list_businesses_page(limit=2, after=first_page["next_cursor"], expand="rewards,similar")
+    assert response.status_code == 200
+    second_page = response.json()
+    assert len(second_page["items"]) == 1
+    assert second_page["next_cursor"] is None
+    assert second_page["items"][0]["rewards"] == []
+    assert len(second_page["items"][0]["similar_businesses"]) == 2
+
+    listed_ids = [item["details"]["id"] for item in first_page["items"] + second_page["items"]]
+    assert listed_ids == sorted(business_ids)
+
+    # Invalid parameters are rejected
+    response = client.list_businesses_page(limit=0)
+    assert response.status_code == 400
+    response = client.list_businesses_page(limit=2, expand="owners")
+    assert response.status_code == 400
+
+def test_business_enrollments(client):
+    business_username = f"business_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=business_username,
+        password="password123",
+        email_address=f"{business_username}@test.com",
+        is_business_owner=True
+    ))
+    assert response.status_code == 200
+    business_token = client.token
+
+    response = client.upsert_business(UpsertBusinessRequest(
+        business_name="Test Business",
+        email_address="business@test.com"
+    ))
+    assert response.status_code == 200
+    response = client.get_current_business_details()
+    business_id = response.json()["details"]["id"]
+
+    customer_usernames = []
+    for _ in range(2):
+        client.token = None
+        customer_username = f"customer_{uuid.uuid4()}"
+        response = client.register(CreateUserRequest(
+            username=customer_username,
+            password="password123",
+            email_address=f"{customer_username}@test.com",
+            is_business_owner=False
+        ))
+        assert response.status_code == 200
+        response = client.enroll_to_business(business_id)
+        assert response.status_code == 200
+        customer_usernames.append(customer_username)
+
+    client.token = business_token
+    response = client.get_business_enrollments()
+    assert response.status_code == 200
+    enrollments = response.json()
+    assert sorted(e["user"]["username"] for e in enrollments) == sorted(customer_usernames)
+    assert all(e["enrollment"]["business_id"] == business_id for e in enrollments)
+
+def _count_queries(load):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.expire_all()
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        load()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+def test_eager_loaders_use_constant_queries(client):
+    business_ids = _create_co_enrolled_businesses(client)
+    user_id = User.query.filter(User.username.startswith("customer_")).first().id
+
+    assert _count_queries(lambda: [b.rewards for b in businesses_with_rewards().all()]) == 2
+    assert _count_queries(lambda: [e.business.business_name for e in user_enrollments_with_businesses(user_id)]) == 1
+    assert _count_queries(lambda: [e.user.username for e in business_enrollments_with_users(business_ids[0])]) == 1
+
+def test_list_businesses_etag(client):
+    business_ids = _create_co_enrolled_businesses(client)
+
+    response = client.list_businesses()
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert len(response.json()) == len(business_ids)
+
+    response = client.list_businesses(etag=etag)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    # Enrolling commits an Enrollment, which invalidates the cached listing
+    response = client.enroll_to_business(business_ids[0])
+    assert response.status_code == 200
+    response = client.list_businesses(etag=etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # Writes from another process invalidate it as well
+    etag = response.headers["ETag"]
+    db.session.query(Enrollment).filter_by(business_id=business_ids[2]).delete()
+    db.session.commit()
+    response = client.list_businesses(etag=etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_response_cache_first_bump(app):
+    # A fresh sequence: the first invalidation must change the version other workers read
+    last_value = db.session.execute(text("SELECT last_value FROM response_cache_version")).scalar()
+    db.session.execute(text("ALTER SEQUENCE response_cache_version RESTART"))
+    db.session.commit()
+    try:
+        reader, writer = ResponseCache(), ResponseCache()
+        version = reader.current_version()
+        writer.invalidate(db.session)
+        assert reader.current_version() != version
+    finally:
+        # Never move the version back to values that cached entries may carry
+        db.session.execute(text("SELECT setval('response_cache_version', :value)"), {"value": last_value + 1})
+        db.session.commit()
+
+def test_encoders_match_pydantic_jsonify(app, client):
+    business_ids = _create_co_enrolled_businesses(client)
+    business = db.session.get(BusinessDetails, business_ids[0])
+    business.business_name = "Caf\u00e9 \u05e9\u05dc\u05d5\u05dd \U0001f600"
+    db.session.add(Reward(
+        business_id=business.id,
+        name="Free \"coffee\"\n",
+        required_points=Decimal("12.50"),
+        valid_from_timestamp=datetime(2024, 1, 1, 12, 30),
+        valid_until_timestamp=datetime(2024, 12, 31),
+    ))
+    db.session.commit()
+
+    cases = []
+    for business in BusinessDetails.query.all():
+        cases.append((business_details_encoder, BusinessDetailsModel, business))
+        cases.extend((reward_encoder, RewardModel, reward) for reward in business.rewards)
+    for enrollment in Enrollment.query.all():
+        cases.append((enrollment_encoder, EnrollmentModel, enrollment))
+        cases.append((user_encoder, UserModel, enrollment.user))
+
+    for compact in (None, True):
+        app.json.compact = compact
+        for encoder, model, obj in cases:
+            expected = jsonify(model.model_validate(obj, from_attributes=True).model_dump()).get_data()
+            assert dumps(encoder.encode(obj)) == expected
+
+def test_serialization_benchmark(app):
+    result = app.test_cli_runner().invoke(args=["serialization", "benchmark", "--businesses", "200", "--repeat", "1"])
+    assert result.exit_code == 0, result.output
+    assert "Speedup" in result.output
+
+def test_stream_json_array_matches_json_response(app):
+    items = [{"id": uuid.uuid4(), "name": "Caf\u00e9\n", "nested": {"points": Decimal("1.50"), "tags": []}}] * 5
+    with app.test_request_context():
+        for compact in (None, True):
+            app.json.compact = compact
+            for count in (0, 1, 5):
+                response = stream_json_array(iter(items[:count]), chunk_size=16)
+                assert response.is_streamed
+                assert response.get_data() == json_response(items[:count]).get_data()
+
+def test_streamed_list_endpoints(app, client, monkeypatch):
+    _create_co_enrolled_businesses(client)
+    headers = {"Authorization": f"Bearer {client.token}"}
+    test_client = app.test_client()
+
+    # Streamed responses are never cached, so request them before the buffered ones
+    monkeypatch.setattr(Config, "STREAM_LIST_RESPONSES", True)
+    monkeypatch.setattr(Config, "STREAM_BATCH_SIZE", 2)
+    streamed_businesses = test_client.get("/businesses", headers=headers).get_json()
+    streamed_enrollments = test_client.get("/enrollments/me", headers=headers).get_json()
+
+    monkeypatch.setattr(Config, "STREAM_LIST_RESPONSES", False)
+    businesses = test_client.get("/businesses", headers=headers).get_json()
+    enrollments = test_client.get("/enrollments/me", headers=headers).get_json()
+
+    assert [b["details"]["id"] for b in streamed_businesses] == sorted(b["details"]["id"] for b in businesses)
+    assert sorted(streamed_businesses, key=lambda b: b["details"]["id"]) == sorted(businesses, key=lambda b: b["details"]["id"])
+    assert sorted(streamed_enrollments, key=lambda e: e["enrollment"]["id"]) == sorted(enrollments, key=lambda e: e["enrollment"]["id"])
+    assert len(streamed_enrollments) == 1
+
+def test_logged_out_token_is_rejected(client):
+    username = f"test_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=username,
+        password="password123",
+        email_address=f"{username}@test.com",
+        is_business_owner=False
+    ))
+    assert response.status_code == 200
+    token = client.token
+    assert client.get_current_user_details().status_code == 200
+
+    response = client.logout()
+    assert response.status_code == 200
+
+    client.token = token
+    assert client.get_current_user_details().status_code == 401
+    assert client.get_user_enrollments().status_code == 401
+    # Logging out again is harmless
+    assert client.logout().status_code == 200
+
+    client.token = "not-a-token"
+    assert client.logout().status_code == 401
+
+def test_purge_revoked_tokens(app):
+    now = datetime.utcnow()
+    db.session.add(BlacklistedToken(jti="expired", expires_at=now - timedelta(minutes=1)))
+    db.session.add(BlacklistedToken(jti="active", expires_at=now + timedelta(hours=1)))
+    db.session.commit()
+
+    assert token_revocation_store.purge() == 1
+    assert [t.jti for t in BlacklistedToken.query.all()] == ["active"]
+    assert token_revocation_store.is_revoked("active")
+    assert not token_revocation_store.is_revoked("expired")
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [uuid.uuid4().hex for _ in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+    assert false_positives < 300
+
+def test_principal_cache(app, client):
+    username = f"test_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=username,
+        password="password123",
+        email_address=f"{username}@test.com",
+        is_business_owner=False
+    ))
+    assert response.status_code == 200
+    user_id = User.query.filter_by(username=username).first().id
+
+    cache = PrincipalCache(max_entries=2, ttl_seconds=60)
+    cache.listen()
+    try:
+        principal = cache.get(user_id)
+        assert principal.id == user_id and principal.is_business_owner is False
+        assert _count_queries(lambda: cache.get(user_id)) == 0
+        assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+        # Committing a change to the user evicts it
+        user = db.session.get(User, user_id)
+        user.is_business_owner = True
+        db.session.commit()
+        assert cache.get(user_id).is_business_owner is True
+        assert cache.stats()["misses"] == 2
+
+        assert cache.get(uuid.uuid4()) is None
+        assert cache.stats()["size"] == 1
+    finally:
+        for name, listener in (("after_flush", cache._after_flush), ("do_orm_execute", cache._do_orm_execute),
+                               ("after_commit", cache._after_commit), ("after_rollback", cache._after_rollback)):
+            event.remove(Session, name, listener)
+
+def test_password_hashing_pool(app, client, monkeypatch):
+    username = f"test_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=username,
+        password="password123",
+        email_address=f"{username}@test.com",
+        is_business_owner=False
+    ))
+    assert response.status_code == 200
+    login = {"username": username, "password": "password123"}
+    test_client = app.test_client()
+
+    hasher = PasswordHasher(rounds=1000, max_workers=1, max_pending=0)
+    monkeypatch.setattr("src.routes.auth.password_hasher", hasher)
+    try:
+        # A saturated pool fails fast
+        hasher._slots.acquire()
+        response = test_client.post("/auth/login", json=login)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        hasher._slots.release()
+
+        # Logging in rehashes the password with the configured rounds
+        assert test_client.post("/auth/login", json=login).status_code == 200
+        hashed_password = User.query.filter_by(username=username).first().hashed_password
+        assert hashed_password.startswith("$pbkdf2-sha256$1000$")
+        assert test_client.post("/auth/login", json=login).status_code == 200
+        assert test_client.post("/auth/login", json={**login, "password": "wrong"}).status_code == 401
+    finally:
+        hasher.shutdown()
+
+def test_require_business_resolves_business_with_principal(app, client):
+    username = f"business_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=username,
+        password="password123",
+        email_address=f"{username}@test.com",
+        is_business_owner=True
+    ))
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {client.token}"}
+    test_client = app.test_client()
+
+    assert test_client.get("/businesses/enrollments", headers=headers).status_code == 404
+    user_id = User.query.filter_by(username=username).first().id
+    assert principal_cache.get(user_id).business_id is None
+
+    # The business is created by the server process, which this worker does not hear about
+    response = client.upsert_business(UpsertBusinessRequest(
+        business_name="Business",
+        email_address="business@test.com"
+    ))
+    assert response.status_code == 200
+    business_id = BusinessDetails.query.filter_by(user_id=user_id).first().id
+
+    assert test_client.get("/businesses/enrollments", headers=headers).status_code == 200
+    assert principal_cache.get(user_id).business_id == business_id
+    # Business-owner requests now resolve the business without querying it
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        assert test_client.get("/businesses/enrollments", headers=headers).status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    assert not any("FROM business_detail" in statement for statement in statements)
+
+def test_refresh_token_rotation(client):
+    username = f"test_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=username,
+        password="password123",
+        email_address=f"{username}@test.com",
+        is_business_owner=False
+    ))
+    assert response.status_code == 200
+    assert response.json()["expires_in"] == int(Config.JWT_ACCESS_TOKEN_EXPIRES.total_seconds())
+    first_refresh_token = client.refresh_token
+    # Only hashes are stored
+    assert RefreshToken.query.filter_by(token_hash=first_refresh_token).first() is None
+
+    response = client.refresh()
+    assert response.status_code == 200
+    assert client.refresh_token != first_refresh_token
+    assert client.get_current_user_details().status_code == 200
+
+    # Reusing a rotated token revokes the whole family
+    second_refresh_token = client.refresh_token
+    client.refresh_token = first_refresh_token
+    assert client.refresh().status_code == 401
+    client.refresh_token = second_refresh_token
+    assert client.refresh().status_code == 401
+
+    # Logging out revokes the refresh token sent along
+    response = client.login(LoginUserRequest(username=username, password="password123"))
+    assert response.status_code == 200
+    refresh_token = client.refresh_token
+    assert client.logout().status_code == 200
+    client.refresh_token = refresh_token
+    assert client.refresh().status_code == 401
+    assert RefreshToken.query.count() == 0
+
+def test_category_index(app):
+    owner = User(username=f"owner_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add(owner)
+    db.session.flush()
+    cafe, other_cafe, bakery = (
+        BusinessDetails(user_id=owner.id, business_name=name, description=category, email_address="b@test.com")
+        for name, category in (("Cafe A", "Cafe"), ("Cafe B", "Cafe"), ("Bakery", "Bakery"))
+    )
+    db.session.add_all([cafe, other_cafe, bakery])
+    db.session.flush()
+    cafe_reward = Reward(business_id=cafe.id, name="Coffee", required_points=10)
+    db.session.add_all([cafe_reward, Reward(business_id=bakery.id, name="Bread", required_points=10)])
+    db.session.commit()
+
+    index = CategoryIndex(refresh_seconds=3600)
+    index.reload()
+    index.listen()
+    try:
+        assert index.sample("Cafe", set()) == (cafe.id, cafe_reward.id)
+        # Businesses without rewards are not recommended
+        assert index.sample("Cafe", {cafe.id}) is None
+
+        # Committed writes are applied without a reload
+        other_cafe_reward = Reward(business_id=other_cafe.id, name="Tea", required_points=10)
+        db.session.add(other_cafe_reward)
+        bakery.description = "Cafe"
+        db.session.delete(cafe_reward)
+        db.session.commit()
+        assert index.sample("Bakery", set()) is None
+        assert index.sample("Cafe", {other_cafe.id})[0] == bakery.id
+        assert index.sample("Cafe", {bakery.id}) == (other_cafe.id, other_cafe_reward.id)
+        assert index.sample("Cafe", {other_cafe.id, bakery.id}) is None
+
+        recommendations = IndexedBusinessRecommendationService(index).get_recommendations([cafe])
+        assert len(recommendations) == 1
+        assert recommendations[0].business_name in ("Cafe B", "Bakery")
+    finally:
+        for name, listener in (("after_flush", index._after_flush), ("do_orm_execute", index._do_orm_execute),
+                               ("after_commit", index._after_commit), ("after_rollback", index._after_rollback)):
+            event.remove(Session, name, listener)
+
+def test_category_index_reloads_once(app):
+    class CountingIndex(CategoryIndex):
+        reloads = 0
+
+        def reload(self):
+            self.reloads += 1
+            time.sleep(0.2)
+            super().reload()
+
+    def refresh():
+        with app.app_context():
+            index._refresh_if_due()
+
+    index = CountingIndex(refresh_seconds=3600)
+    index.reload()
+    # A due rebuild is run by one reader only
+    index._next_refresh = 0.0
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: refresh(), range(8)))
+    assert index.reloads == 2
+
+
+def test_sql_recommendations(app):
+    owner = User(username=f"owner_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    customer = User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add_all([owner, customer])
+    db.session.flush()
+    businesses = {}
+    for name, category, reward_count in (("Cafe A", "Cafe", 1), ("Cafe B", "Cafe", 2), ("Cafe C", "Cafe", 1),
+                                         ("Cafe D", "Cafe", 0), ("Bakery A", "Bakery", 1), ("Bakery B", "Bakery", 1),
+                                         ("Gym", "Gym", 1)):
+        business = BusinessDetails(user_id=owner.id, business_name=name, description=category, email_address="b@test.com")
+        db.session.add(business)
+        db.session.flush()
+        db.session.add_all(Reward(business_id=business.id, name=f"{name} {index}", required_points=10)
+                           for index in range(reward_count))
+        businesses[name] = business
+    for name in ("Cafe A", "Cafe D", "Bakery A"):
+        db.session.add(Enrollment(user_id=customer.id, business_id=businesses[name].id, points_snapshot=0))
+    db.session.commit()
+
+    service = SqlBusinessRecommendationService()
+    seen = set()
+    for _ in range(20):
+        recommendations = service.get_recommendations_for_user(customer.id)
+        # Categories by enrollment count; enrolled businesses and ones without rewards are skipped
+        assert [r.business_name[:-2] for r in recommendations] == ["Cafe", "Bakery"]
+        assert recommendations[0].business_name in ("Cafe B", "Cafe C")
+        assert recommendations[1].business_name == "Bakery B"
+        seen.update(r.reward.name for r in recommendations)
+    assert seen <= {"Cafe B 0", "Cafe B 1", "Cafe C 0", "Bakery B 0"}
+    assert service.get_recommendations_for_user(owner.id) == []
+
+def test_user_recommendation_store(app, client):
+    owner = User(username=f"owner_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add(owner)
+    db.session.flush()
+    cafe, other_cafe = (
+        BusinessDetails(user_id=owner.id, business_name=name, description="Cafe", email_address="b@test.com")
+        for name in ("Cafe A", "Cafe B")
+    )
+    db.session.add_all([cafe, other_cafe])
+    db.session.flush()
+    db.session.add_all([Reward(business_id=cafe.id, name="Coffee", required_points=10),
+                        Reward(business_id=other_cafe.id, name="Tea", required_points=10)])
+    db.session.commit()
+
+    customer_username = f"customer_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=customer_username,
+        password="password123",
+        email_address=f"{customer_username}@test.com",
+    ))
+    assert response.status_code == 200
+    customer_id = User.query.filter_by(username=customer_username).one().id
+
+    # Without a stored entry /auth/me computes synchronously and stores the result
+    response = client.get_current_user_details()
+    assert response.status_code == 200
+    assert not response.json()["recommendations"]
+    assert not db.session.get(UserRecommendationState, customer_id).dirty
+
+    store = UserRecommendationStore(SqlBusinessRecommendationService(), staleness_seconds=3600, batch_size=10)
+    assert store.get(customer_id) == []
+    assert store.get(owner.id) is None
+
+    # Enrolling marks the user dirty and wakes the server's refresher
+    computed_at = db.session.get(UserRecommendationState, customer_id).computed_at
+    assert client.enroll_to_business(cafe.id).status_code == 200
+    for _ in range(50):
+        db.session.expire_all()
+        state = db.session.get(UserRecommendationState, customer_id)
+        # The refresher clears `dirty` when it claims the user, and stores the result after
+        if not state.dirty and store.get(customer_id):
+            break
+        time.sleep(0.1)
+    assert not state.dirty and state.computed_at > computed_at
+
+    # Entries past the staleness budget are refreshed too
+    store.staleness_seconds = 0
+    assert store.refresh_due() == 1
+    store.staleness_seconds = 3600
+    assert store.refresh_due() == 0
+    assert _count_queries(lambda: store.get(customer_id)) == 1
+    recommendations = store.get(customer_id)
+    assert [(r.business_name, r.reward.name) for r in recommendations] == [("Cafe B", "Tea")]
+    response = client.get_current_user_details()
+    assert [r["reward"]["name"] for r in response.json()["recommendations"]] == ["Tea"]
+
+    # Enrollment changes neither wait for a refresh under way nor get lost by it
+    def mark_stale():
+        with app.app_context():
+            db.session.execute(text("SET LOCAL lock_timeout = '2s'"))
+            store.mark_stale(customer_id)
+            db.session.commit()
+
+    class MarkingService(SqlBusinessRecommendationService):
+        def get_recommendations_for_user(self, user_id):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(mark_stale).result()
+            return super().get_recommendations_for_user(user_id)
+
+    assert UserRecommendationStore(MarkingService(), staleness_seconds=0, batch_size=10).refresh_due() == 1
+    db.session.expire_all()
+    assert db.session.get(UserRecommendationState, customer_id).dirty
+    assert store.refresh_due() == 1
+    db.session.expire_all()
+    assert not db.session.get(UserRecommendationState, customer_id).dirty
+
+def test_batch_recommendations(app):
+    owner = User(username=f"owner_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add(owner)
+    db.session.flush()
+    businesses = {}
+    for name, category in (("Cafe A", "Cafe"), ("Cafe B", "Cafe"), ("Bakery A", "Bakery"), ("Bakery B", "Bakery"),
+                           ("Gym A", "Gym")):
+        business = BusinessDetails(user_id=owner.id, business_name=name, description=category, email_address="b@test.com")
+        db.session.add(business)
+        db.session.flush()
+        db.session.add(Reward(business_id=business.id, name=name, required_points=10))
+        businesses[name] = business
+    customers = []
+    for enrolled in (("Cafe A",), ("Cafe A", "Bakery A", "Gym A"), ("Cafe A", "Cafe B")):
+        customer = User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+        db.session.add(customer)
+        db.session.flush()
+        db.session.add_all(Enrollment(user_id=customer.id, business_id=businesses[name].id, points_snapshot=0) for name in enrolled)
+        customers.append(customer.id)
+    db.session.commit()
+
+    store = UserRecommendationStore(SqlBusinessRecommendationService())
+    for workers in (0, 2):
+        result = BatchRecommendationService(workers=workers, chunk_size=2, store=store).generate()
+        assert (result.users, result.rows) == (3, 3)
+        recommendations = [[r.business_name for r in store.get(customer_id)] for customer_id in customers]
+        assert recommendations == [["Cafe B"], ["Bakery B", "Cafe B"], []]
+    assert store.get(owner.id) is None
+
+    # Entries computed after the generation started are not replaced by its older results
+    newer = datetime.utcnow() + timedelta(hours=1)
+    db.session.execute(
+        update(UserRecommendationState).where(UserRecommendationState.user_id == customers[0]).values(computed_at=newer)
+    )
+    db.session.commit()
+    result = BatchRecommendationService(workers=0, chunk_size=2, store=store).generate()
+    assert (result.users, result.rows) == (2, 2)
+    db.session.expire_all()
+    assert db.session.get(UserRecommendationState, customers[0]).computed_at == newer
+
+def test_active_rewards(app, client):
+    owner_username = f"business_user_{uuid.uuid4()}"
+    response = client.register(CreateUserRequest(
+        username=owner_username,
+        password="password123",
+        email_address=f"{owner_username}@test.com",
+        is_business_owner=True
+    ))
+    assert response.status_code == 200
+    response = client.upsert_business(UpsertBusinessRequest(
+        business_name="Cafe A", description="Cafe", email_address="business@test.com"
+    ))
+    assert response.status_code == 200
+    business = BusinessDetails.query.filter_by(business_name="Cafe A").one()
+
+    now = datetime.utcnow()
+    rewards = {
+        name: Reward(business_id=business.id, name=name, required_points=10,
+                     valid_from_timestamp=valid_from, valid_until_timestamp=valid_until)
+        for name, valid_from, valid_until in (
+            ("Coffee", now - timedelta(days=1), None),
+            ("Expired", now - timedelta(days=2), now - timedelta(days=1)),
+            ("Upcoming", now + timedelta(days=1), None),
+            ("Brief", now - timedelta(days=1), now + timedelta(seconds=2)),
+        )
+    }
+    customer = User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add_all([*rewards.values(), customer])
+    db.session.flush()
+    db.session.add(Enrollment(user_id=customer.id, business_id=business.id, points_snapshot=100))
+    db.session.commit()
+
+    def listed_rewards():
+        response = client.list_businesses()
+        assert response.status_code == 200
+        item = next(b for b in response.json() if b["details"]["id"] == str(business.id))
+        return sorted(reward["name"] for reward in item["rewards"])
+
+    index = CategoryIndex(refresh_seconds=3600)
+    index.reload()
+    service = BusinessRecommendationService()
+    other_business = BusinessDetails(user_id=customer.id, business_name="Cafe B", description="Cafe", email_address="b@test.com")
+    assert listed_rewards() == ["Brief", "Coffee"]
+    assert index.sample("Cafe", set())[1] in {rewards["Coffee"].id, rewards["Brief"].id}
+    for _ in range(10):
+        recommendation, = service.get_recommendations([other_business], businesses_with_rewards().all())
+        assert recommendation.reward.name in ("Brief", "Coffee")
+
+    # Rewards leave the listing, its cached copy and the index when they expire
+    time.sleep(2)
+    assert listed_rewards() == ["Coffee"]
+    assert index.sample("Cafe", set()) == (business.id, rewards["Coffee"].id)
+
+    response = client.redeem_reward(RedeemRewardRequest(user_id=customer.id, reward_id=rewards["Upcoming"].id))
+    assert response.status_code == 400
+    assert response.json()["error"] == "Reward is not active"
+    response = client.redeem_reward(RedeemRewardRequest(user_id=customer.id, reward_id=rewards["Coffee"].id))
+    assert response.status_code == 200
+
+def test_concurrent_points_updates(app, client):
+    reward_id, (customer_id,), _ = _create_business_with_customers(client, 1, points_snapshot=0, required_points=30)
+
+    def add_points(_):
+        return client.add_points(AddPointsRequest(user_id=customer_id, points=Decimal("2.50"))).status_code
+
+    def redeem(_):
+        return client.redeem_reward(RedeemRewardRequest(user_id=customer_id, reward_id=reward_id)).status_code
+
+    def balance():
+        db.session.expire_all()
+        return Enrollment.query.filter_by(user_id=customer_id).one().points
+
+    # Concurrent grants must not lose updates, and redemptions must not overdraw the balance
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(add_points, range(40))) == {200}
+        assert balance() == 100
+        statuses = list(executor.map(redeem, range(10)))
+    assert statuses.count(200) == 3
+    assert statuses.count(400) == 7
+
+    assert balance() == 10
+    assert db.session.get(Reward, reward_id).usage_count == 3
+
+def test_reward_usage_slots(app, client):
+    reward_id, customer_ids, _ = _create_business_with_customers(
+        client, 20, points_snapshot=1, required_points=1, usage_count_base=5,
+    )
+
+    def redeem(customer_id):
+        return client.redeem_reward(RedeemRewardRequest(user_id=customer_id, reward_id=reward_id)).status_code
+
+    # Served from the response cache until a redemption invalidates it
+    listing = client.get_current_business_details().json()
+    assert [reward["usage_count"] for reward in listing["rewards"]] == [5]
+
+    # Uses of one reward are spread over slot rows, and usage_count adds them up
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(redeem, customer_ids)) == {200}
+    slots = RewardUsageSlot.query.filter_by(reward_id=reward_id).all()
+    assert 1 < len(slots) <= Config.REWARD_USAGE_SLOTS
+    assert sum(slot.count for slot in slots) == 20
+    db.session.expire_all()
+    assert db.session.get(Reward, reward_id).usage_count == 25
+
+    listing = client.get_current_business_details().json()
+    assert [reward["usage_count"] for reward in listing["rewards"]] == [25]
+
+def test_points_ledger(app, client):
+    reward_id, (customer_id,), (enrollment_id,) = _create_business_with_customers(
+        client, 1, points_snapshot=5, required_points=30,
+    )
+
+    def add_points(points):
+        response = client.add_points(AddPointsRequest(user_id=customer_id, points=Decimal(points)))
+        assert response.status_code == 200
+        return float(response.json()["new_points_balance"])
+
+    def current():
+        db.session.expire_all()
+        return db.session.get(Enrollment, enrollment_id)
+
+    # Every earn and redemption appends an entry, and the balance adds them to the snapshot
+    assert add_points(20) == 25
+    assert add_points(10) == 35
+    response = client.redeem_reward(RedeemRewardRequest(user_id=customer_id, reward_id=reward_id))
+    assert response.status_code == 200
+    assert float(response.json()["new_points_balance"]) == 5
+    entries = PointsTransaction.query.filter_by(enrollment_id=enrollment_id).order_by(PointsTransaction.id).all()
+    assert [(entry.amount, entry.reward_id) for entry in entries] == [(20, None), (10, None), (-30, reward_id)]
+    assert current().points == 5
+
+    # Compaction folds the committed entries into the snapshot and keeps them for auditing
+    service = PointsService()
+    for _ in range(50):
+        service.compact()
+        if current().points_snapshot_xid > max(entry.xid for entry in entries):
+            break
+        time.sleep(0.1)
+    enrollment = current()
+    assert enrollment.points_snapshot_xid > max(entry.xid for entry in entries)
+    assert enrollment.points_snapshot == 5
+    assert enrollment.points == 5
+    assert PointsTransaction.query.filter_by(enrollment_id=enrollment_id).count() == 3
+
+    # Later entries are added on top of the compacted snapshot
+    assert add_points("7.50") == 12.5
+    assert current().points == Decimal("12.50")
+    response = client.redeem_reward(RedeemRewardRequest(user_id=customer_id, reward_id=reward_id))
+    assert response.status_code == 400
+    assert response.json()["current"] == 12.5
+
+def test_add_points_bulk(app, client):
+    _, (first, second), _ = _create_business_with_customers(client, 2, points_snapshot=10)
+    customer = User(username=f"customer_{uuid.uuid4()}", hashed_password="x", email_address=f"{uuid.uuid4()}@test.com")
+    db.session.add(customer)
+    db.session.commit()
+    not_enrolled = customer.id
+
+    items = [(first, "5"), (not_enrolled, "7"), (second, "1.50"), (first, "2.25")]
+    response = client.add_points_bulk(BulkAddPointsRequest(
+        items=[AddPointsRequest(user_id=user_id, points=Decimal(points)) for user_id, points in items]
+    ))
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"user_id": str(first), "status": "applied", "new_points_balance": 17.25},
+        {"user_id": str(not_enrolled), "status": "not_enrolled", "new_points_balance": None},
+        {"user_id": str(second), "status": "applied", "new_points_balance": 11.5},
+        {"user_id": str(first), "status": "applied", "new_points_balance": 17.25},
+    ]
+
+    # Thousands of grants are applied in one statement
+    response = client.add_points_bulk(BulkAddPointsRequest(
+        items=[AddPointsRequest(user_id=(first, second)[index % 2], points=Decimal(1)) for index in range(5000)]
+    ))
+    assert response.status_code == 200
+    assert {r["new_points_balance"] for r in response.json()["results"]} == {2517.25, 2511.5}
+    assert client.add_points_bulk(BulkAddPointsRequest.model_construct(items=[])).status_code == 400
+
+def test_idempotency_keys(app, client):
+    reward_id, (customer_id,), (enrollment_id,) = _create_business_with_customers(
+        client, 1, points_snapshot=0, required_points=10,
+    )
+
+    def add_points(points, key):
+        return client.add_points(AddPointsRequest(user_id=customer_id, points=Decimal(points)), idempotency_key=key)
+
+    def balance():
+        db.session.expire_all()
+        return db.session.get(Enrollment, enrollment_id).points
+
+    # A retry replays the first response instead of adding the points again
+    first = add_points(15, "grant-1")
+    retry = add_points(15, "grant-1")
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert balance() == 15
+
+    # Concurrent retries wait for the first request and replay it
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: add_points(5, "grant-2"), range(8)))
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.text for response in responses}) == 1
+    assert balance() == 20
+    assert PointsTransaction.query.filter_by(enrollment_id=enrollment_id).count() == 2
+
+    # Redemptions, and refusals, are replayed too
+    redeem = RedeemRewardRequest(user_id=customer_id, reward_id=reward_id)
+    first = client.redeem_reward(redeem, idempotency_key="redeem-1")
+    retry = client.redeem_reward(redeem, idempotency_key="redeem-1")
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert balance() == 10
+    assert db.session.get(Reward, reward_id).usage_count == 1
+    assert client.redeem_reward(redeem, idempotency_key="redeem-2").status_code == 200
+    refused = client.redeem_reward(redeem, idempotency_key="redeem-3")
+    assert refused.status_code == 400
+    assert add_points(50, "grant-3").status_code == 200
+    retry = client.redeem_reward(redeem, idempotency_key="redeem-3")
+    assert retry.status_code == 400
+    assert retry.json() == refused.json()
+    assert balance() == 50
+
+    # Keys are refused for other requests, and without a key every request is applied
+    assert add_points(1, "grant-1").status_code == 422
+    assert client.redeem_reward(redeem, idempotency_key="grant-1").status_code == 422
+    assert add_points(1, "x" * 256).status_code == 400
+    assert add_points(1, None).status_code == 200
+    assert add_points(1, None).status_code == 200
+    assert balance() == 52
+
+    # Keys are pruned beyond the size bound and after their TTL, after which they apply again
+    assert IdempotencyStore(max_entries=4).purge() == 2
+    assert IdempotencyKey.query.count() == 4
+    assert IdempotencyStore(ttl_seconds=0).purge() == 4
+    assert add_points(15, "grant-1").headers.get("Idempotent-Replayed") is None
+    assert balance() == 67
+
+def test_idempotency_key_commits_with_write(app, client, monkeypatch):
+    _, (customer_id,), (enrollment_id,) = _create_business_with_customers(client, 1, points_snapshot=0)
+    test_client = app.test_client()
+    headers = {"Authorization": f"Bearer {client.token}", "Idempotency-Key": "grant-1"}
+    grant = AddPointsRequest(user_id=customer_id, points=Decimal(15))
+
+    def fail(*args):
+        raise RuntimeError("worker stopped")
+
+    # A request failing between its write and storing its response leaves neither behind
+    monkeypatch.setattr(idempotency_store, "save", fail)
+    with pytest.raises(RuntimeError):
+        test_client.post("/enrollments/add_points", json=grant.model_dump(mode="json"), headers=headers)
+    db.session.rollback()
+    monkeypatch.undo()
+    assert IdempotencyKey.query.count() == 0
+
+    # so its retry applies the write once, and is then replayed
+    first = client.add_points(grant, idempotency_key="grant-1")
+    retry = client.add_points(grant, idempotency_key="grant-1")
+    assert first.status_code == retry.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert db.session.get(Enrollment, enrollment_id).points == 15
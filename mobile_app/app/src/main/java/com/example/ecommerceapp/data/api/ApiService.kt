@@ -3,15 +3,28 @@ package com.example.ecommerceapp.data.api
 import com.example.ecommerceapp.data.api.client.NetworkClient
 import com.example.ecommerceapp.data.api.models.*
 import io.ktor.client.call.body
+import io.ktor.client.plugins.auth.Auth
+import io.ktor.client.plugins.auth.providers.BearerAuthProvider
+import io.ktor.client.plugins.auth.providers.BearerTokens
+import io.ktor.client.plugins.plugin
 import io.ktor.client.request.get
 import io.ktor.client.request.post
 import io.ktor.client.request.put
 import io.ktor.client.request.delete
+import io.ktor.client.request.parameter
 import io.ktor.client.request.setBody
 import java.math.BigDecimal
 
-class ApiService(private var token: String? = null) {
-    private val client = NetworkClient.createHttpClient { token }
+class ApiService(
+    private var token: String? = null,
+    private var refreshToken: String? = null,
+    private val onTokensRefreshed: suspend (TokenResponse) -> Unit = {}
+) {
+    private val client = NetworkClient.createHttpClient(
+        tokenProvider = { token },
+        refreshTokenProvider = { refreshToken },
+        refreshTokens = { refreshToken -> refreshTokens(refreshToken) }
+    )
 
     companion object {
         // This is currently points to a locally running server. To find the correct IP for the
@@ -28,8 +41,13 @@ class ApiService(private var token: String? = null) {
     suspend fun login(request: LoginRequest): TokenResponse =
         client.post("$BASE_URL/auth/login") { setBody(request) }.body()
 
+    suspend fun refresh(refreshToken: String): TokenResponse =
+        NetworkClient.unauthenticatedClient.post("$BASE_URL/auth/refresh") {
+            setBody(RefreshTokenRequest(refreshToken))
+        }.body()
+
     suspend fun logout() =
-        client.post("$BASE_URL/auth/logout")
+        client.post("$BASE_URL/auth/logout") { setBody(LogoutRequest(refreshToken)) }
 
     suspend fun getCurrentUser(): UserModel =
         client.get("$BASE_URL/auth/me").body()
@@ -38,6 +56,17 @@ class ApiService(private var token: String? = null) {
     suspend fun getAllBusinesses(): List<BusinessDetailsWithRewards> =
         client.get("$BASE_URL/businesses").body()
 
+    suspend fun getBusinessesPage(
+        limit: Int,
+        after: String? = null,
+        expand: List<String> = emptyList()
+    ): BusinessPage =
+        client.get("$BASE_URL/businesses") {
+            parameter("limit", limit)
+            after?.let { parameter("after", it) }
+            if (expand.isNotEmpty()) parameter("expand", expand.joinToString(","))
+        }.body()
+
     suspend fun upsertBusinessDetails(details: BusinessDetails) =
         client.put("$BASE_URL/businesses") { setBody(details) }
 
@@ -74,7 +103,23 @@ class ApiService(private var token: String? = null) {
             setBody(RedeemRewardRequest(userId, rewardId))
         }.body<RedeemRewardResponse>()
 
-    fun updateToken(newToken: String?) {
+    fun updateToken(newToken: String?, newRefreshToken: String? = null) {
+        if (newToken == token && newRefreshToken == refreshToken) return
         token = newToken
+        refreshToken = newRefreshToken
+        // The Auth plugin caches the tokens it loaded; make it load the new ones
+        client.plugin(Auth).providers.filterIsInstance<BearerAuthProvider>().forEach { it.clearToken() }
+    }
+
+    private suspend fun refreshTokens(refreshToken: String): BearerTokens? {
+        val response = try {
+            refresh(refreshToken)
+        } catch (e: Exception) {
+            return null
+        }
+        token = response.accessToken
+        this.refreshToken = response.refreshToken
+        onTokensRefreshed(response)
+        return BearerTokens(response.accessToken, response.refreshToken ?: "")
     }
 }
\ No newline at end of file
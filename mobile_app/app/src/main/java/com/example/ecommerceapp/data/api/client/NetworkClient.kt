@@ -37,12 +37,25 @@ object NetworkClient {
         }
     }
 
-    fun createHttpClient(tokenProvider: () -> String?): HttpClient {
+    // Client without authentication, for requests such as token refreshes
+    val unauthenticatedClient: HttpClient
+        get() = client
+
+    fun createHttpClient(
+        tokenProvider: () -> String?,
+        refreshTokenProvider: () -> String? = { null },
+        refreshTokens: suspend (refreshToken: String) -> BearerTokens? = { null }
+    ): HttpClient {
         return client.config {
             install(Auth) {
                 bearer {
                     loadTokens {
-                        BearerTokens(tokenProvider() ?: "", "")
+                        BearerTokens(tokenProvider() ?: "", refreshTokenProvider() ?: "")
+                    }
+                    // Called on a 401; access tokens are short-lived, so this is the usual path
+                    // for renewing them
+                    refreshTokens {
+                        oldTokens?.refreshToken?.takeIf { it.isNotEmpty() }?.let { refreshTokens(it) }
                     }
                 }
             }
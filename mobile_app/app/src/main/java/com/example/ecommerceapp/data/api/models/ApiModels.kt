@@ -21,7 +21,19 @@ data class LoginRequest(
 @Serializable
 data class TokenResponse(
     val accessToken: String,
-    val tokenType: String = "bearer"
+    val tokenType: String = "bearer",
+    val refreshToken: String? = null,
+    val expiresIn: Int? = null
+)
+
+@Serializable
+data class RefreshTokenRequest(
+    val refreshToken: String
+)
+
+@Serializable
+data class LogoutRequest(
+    val refreshToken: String? = null
 )
 
 @Serializable
@@ -59,10 +71,16 @@ data class Reward(
 @Serializable
 data class BusinessDetailsWithRewards(
     val details: BusinessDetails,
-    val rewards: List<Reward>,
+    val rewards: List<Reward> = emptyList(),
     val similarBusinesses: List<BusinessDetails> = emptyList()
 )
 
+@Serializable
+data class BusinessPage(
+    val items: List<BusinessDetailsWithRewards>,
+    val nextCursor: String? = null
+)
+
 @Serializable
 data class CreateRewardRequest(
     val name: String,
@@ -11,20 +11,31 @@ private val Context.dataStore by preferencesDataStore(name = "auth_prefs")
 
 class TokenManager(private val context: Context) {
     private val tokenKey = stringPreferencesKey("auth_token")
+    private val refreshTokenKey = stringPreferencesKey("refresh_token")
 
     val token: Flow<String?> = context.dataStore.data.map { preferences ->
         preferences[tokenKey]
     }
 
-    suspend fun saveToken(token: String) {
+    val tokens: Flow<Pair<String?, String?>> = context.dataStore.data.map { preferences ->
+        preferences[tokenKey] to preferences[refreshTokenKey]
+    }
+
+    suspend fun saveToken(token: String, refreshToken: String? = null) {
         context.dataStore.edit { preferences ->
             preferences[tokenKey] = token
+            if (refreshToken != null) {
+                preferences[refreshTokenKey] = refreshToken
+            } else {
+                preferences.remove(refreshTokenKey)
+            }
         }
     }
 
     suspend fun clearToken() {
         context.dataStore.edit { preferences ->
             preferences.remove(tokenKey)
+            preferences.remove(refreshTokenKey)
         }
     }
-}
\ No newline at end of file
+}
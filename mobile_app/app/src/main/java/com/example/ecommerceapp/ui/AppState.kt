@@ -25,7 +25,9 @@ import java.math.BigDecimal
 
 open class AppState(context: Context) : ViewModel() {
     private val tokenManager = TokenManager(context)
-    private val apiService = ApiService()
+    private val apiService = ApiService(onTokensRefreshed = { response ->
+        tokenManager.saveToken(response.accessToken, response.refreshToken)
+    })
 
     // Auth state
     var isLoggedIn by mutableStateOf(false)
@@ -41,6 +43,8 @@ open class AppState(context: Context) : ViewModel() {
     // Business listing
     private val _businesses = MutableStateFlow<Resource<List<BusinessDetailsWithRewards>>>(Resource.Loading())
     val businesses = _businesses.asStateFlow()
+    private var businessesCursor: String? = null
+    private var isLoadingMoreBusinesses = false
 
     // Business owner's details
     private val _myBusiness = MutableStateFlow<Resource<BusinessDetailsWithRewards?>>(Resource.Loading())
@@ -53,10 +57,12 @@ open class AppState(context: Context) : ViewModel() {
 
     init {
         viewModelScope.launch {
-            tokenManager.token.collect { token ->
-                apiService.updateToken(token)
+            tokenManager.tokens.collect { (token, refreshToken) ->
+                apiService.updateToken(token, refreshToken)
+                val wasLoggedIn = isLoggedIn
                 isLoggedIn = !token.isNullOrBlank()
-                if (isLoggedIn) {
+                // Refreshed tokens are saved here too; only a new sign-in reloads the data
+                if (isLoggedIn && !wasLoggedIn) {
                     loadUserDetails()
                     loadBusinesses()
                     loadEnrollments()
@@ -86,7 +92,7 @@ open class AppState(context: Context) : ViewModel() {
         viewModelScope.launch {
             try {
                 val response = apiService.login(LoginRequest(username, password))
-                tokenManager.saveToken(response.accessToken)
+                tokenManager.saveToken(response.accessToken, response.refreshToken)
             } catch (e: Exception) {
                 Log.e("Login", "$e")
             }
@@ -104,7 +110,7 @@ open class AppState(context: Context) : ViewModel() {
                     emailAddress = email,
                     isBusinessOwner = isBusinessOwner
                 ))
-                tokenManager.saveToken(response.accessToken)
+                tokenManager.saveToken(response.accessToken, response.refreshToken)
             } catch (e: Exception) {
                 Log.e("AppState", "Failed registering user: $e")
             }
@@ -131,14 +137,33 @@ open class AppState(context: Context) : ViewModel() {
         viewModelScope.launch {
             try {
                 _businesses.value = Resource.Loading()
-                val businesses = apiService.getAllBusinesses()
-                _businesses.value = Resource.Success(businesses)
+                val page = apiService.getBusinessesPage(BUSINESSES_PAGE_SIZE, expand = BUSINESSES_EXPAND)
+                businessesCursor = page.nextCursor
+                _businesses.value = Resource.Success(page.items)
             } catch (e: Exception) {
                 _businesses.value = Resource.Error(e.message ?: "Unknown error")
             }
         }
     }
 
+    fun loadMoreBusinesses() {
+        val cursor = businessesCursor ?: return
+        val loaded = (_businesses.value as? Resource.Success)?.data ?: return
+        if (isLoadingMoreBusinesses) return
+        isLoadingMoreBusinesses = true
+        viewModelScope.launch {
+            try {
+                val page = apiService.getBusinessesPage(BUSINESSES_PAGE_SIZE, cursor, BUSINESSES_EXPAND)
+                businessesCursor = page.nextCursor
+                _businesses.value = Resource.Success(loaded + page.items)
+            } catch (e: Exception) {
+                Log.e("LoadMoreBusinesses", "$e")
+            } finally {
+                isLoadingMoreBusinesses = false
+            }
+        }
+    }
+
     private fun loadMyBusiness() {
         viewModelScope.launch {
             try {
@@ -263,6 +288,12 @@ open class AppState(context: Context) : ViewModel() {
         }
     }
 
+    companion object {
+        private const val BUSINESSES_PAGE_SIZE = 20
+        // The list screen only shows similar businesses, so rewards are not requested
+        private val BUSINESSES_EXPAND = listOf("similar")
+    }
+
     private fun resetAllStates() {
         _currentUser.value = Resource.Loading()
         _businesses.value = Resource.Loading()
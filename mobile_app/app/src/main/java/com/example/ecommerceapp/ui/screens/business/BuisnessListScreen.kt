@@ -2,7 +2,7 @@ package com.example.ecommerceapp.ui.screens.business
 
 import androidx.compose.foundation.layout.*
 import androidx.compose.foundation.lazy.LazyColumn
-import androidx.compose.foundation.lazy.items
+import androidx.compose.foundation.lazy.itemsIndexed
 import androidx.compose.foundation.shape.RoundedCornerShape
 import androidx.compose.material.icons.Icons
 import androidx.compose.material3.*
@@ -32,6 +32,7 @@ fun BusinessListScreen(
         is Resource.Success -> BusinessListScreenContent(
             businesses = businessesResource.data,
             onEnroll = { appState.enrollToBusiness(it.details.id) },
+            onLoadMore = { appState.loadMoreBusinesses() },
             onNavigateToEnrollments = onNavigateToEnrollments,
             onNavigateToProfile = onNavigateToProfile
         )
@@ -42,6 +43,7 @@ fun BusinessListScreen(
 fun BusinessListScreenContent(
     businesses: List<BusinessDetailsWithRewards> = emptyList(),
     onEnroll: (BusinessDetailsWithRewards) -> Unit = { },
+    onLoadMore: () -> Unit = { },
     onNavigateToEnrollments: () -> Unit = { },
     onNavigateToProfile: () -> Unit = { }
 ) {
@@ -78,7 +80,10 @@ fun BusinessListScreenContent(
         Spacer(modifier = Modifier.height(16.dp))
 
         LazyColumn {
-            items(businesses) { business ->
+            itemsIndexed(businesses) { index, business ->
+                if (index == businesses.lastIndex) {
+                    LaunchedEffect(business.details.id) { onLoadMore() }
+                }
                 BusinessCard(
                     business = business,
                     onEnroll = { onEnroll(business) }